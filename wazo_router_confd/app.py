@@ -6,9 +6,14 @@ from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
 from .auth import setup_auth
+from .cdr_buffer import setup_cdr_buffer
+from .cdr_partitions import setup_cdr_partitions
 from .consul import setup_consul
 from .database import setup_database, setup_aiopg_database, upgrade_database
+from .metrics import setup_metrics
+from .tracing import setup_tracing
 from .redis import setup_redis
+from .routing_engine import setup_routing_engine
 from .routers import carriers
 from .routers import carrier_trunks
 from .routers import cdr
@@ -21,6 +26,7 @@ from .routers import routing_rules
 from .routers import routing_group
 from .routers import status
 from .routers import tenants
+from .services.password import setup_password_verifier
 
 
 def get_app(config: dict):
@@ -36,7 +42,13 @@ def get_app(config: dict):
     app = setup_aiopg_database(app, config)
     if config.get('database_upgrade'):
         upgrade_database(app, config)
+    app = setup_cdr_partitions(app, config)
     app = setup_redis(app, config)
+    app = setup_password_verifier(app, config)
+    if config.get('routing_engine'):
+        app = setup_routing_engine(app, config)
+    if config.get('cdr_buffer_size'):
+        app = setup_cdr_buffer(app, config)
     app.include_router(status.router, tags=['status'])
 
     app.include_router(carriers.router, prefix="/1.0", tags=['carriers'])
@@ -52,6 +64,8 @@ def get_app(config: dict):
     app.include_router(tenants.router, prefix="/1.0", tags=['tenants'])
 
     app = setup_auth(app, config)
+    app = setup_metrics(app, config)
+    app = setup_tracing(app, config)
 
     app.add_middleware(
         CORSMiddleware,
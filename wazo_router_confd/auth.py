@@ -1,16 +1,27 @@
+import asyncio
+
 from dataclasses import dataclass
-from typing import Optional, List
+from datetime import datetime, timezone
+from typing import Any, List, Optional, Tuple
 
 from aiohttp import ClientSession
 from aiohttp import TCPConnector  # type: ignore
 
 from fastapi import FastAPI
+from starlette.datastructures import Headers
 from starlette.requests import Request
 from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from wazo_router_confd.redis import LocalCache
 
 
 X_AUTH_TOKEN_HEADER = 'X-Auth-Token'
 WAZO_TENANT = 'Wazo-Tenant'
+# principals of the valid tokens remembered, and their time to live in
+# seconds, bounded by the expiration of the tokens, 0 disables the cache
+AUTH_CACHE_SIZE = 4096
+AUTH_CACHE_TTL = 60
 
 
 @dataclass
@@ -22,78 +33,148 @@ class Principal:
     token: str
 
 
+def get_token_ttl(data: dict) -> Optional[float]:
+    # seconds until the expiration of the token, None if unknown
+    try:
+        expires_at = datetime.fromisoformat(data['utc_expires_at'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    # a naive timestamp is in UTC, an aware one may have any offset
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return (expires_at - datetime.now(timezone.utc)).total_seconds()
+
+
 class AuthClient(object):
-    def __init__(self, url: str, cert: bool):
+    """
+    Client of wazo-auth, on one pooled session, remembering the principals
+    of the valid tokens by token and tenant, until the token expires and at
+    most for the time to live of the cache.
+    """
+
+    session: Optional[ClientSession]
+    cache: LocalCache
+
+    def __init__(
+        self,
+        url: str,
+        cert: bool,
+        cache_size: int = AUTH_CACHE_SIZE,
+        cache_ttl: int = AUTH_CACHE_TTL,
+    ):
         self._url = url
         self._cert = cert
+        self.session = None
+        self.cache = LocalCache(cache_size, cache_ttl, name='auth')
+
+    def get_session(self) -> ClientSession:
+        # created lazily, to be bound to the running loop
+        if self.session is None:
+            connector = TCPConnector(verify_ssl=bool(self._cert))
+            self.session = ClientSession(connector=connector)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.cache.clear()
+
+    async def get_json(self, url: str, headers: dict = None) -> Tuple[bool, Any]:
+        async with self.get_session().get(url, headers=headers) as response:
+            if response.status != 200:
+                return False, None
+            return True, await response.json()
 
     async def get_token_data(self, token: str, tenant_uuid: str) -> Optional[Principal]:
-        verify_ssl = bool(self._cert)
-        connector = TCPConnector(verify_ssl=verify_ssl)
-        async with ClientSession(connector=connector) as session:
-            token_data = dict()
-            # get the token data
-            token_url = self._url + '/token/' + token
-            async with session.get(token_url) as response:
-                if response.status != 200:
-                    return None
-                data = await response.json()
-                if data is not None and data.get('data'):
-                    token_data.update(
-                        dict(
-                            auth_id=data['data']['auth_id'],
-                            uuid=data['data']['metadata']['uuid'],
-                            tenant_uuid=data['data']['metadata']['tenant_uuid'],
-                            tenant_uuids=[data['data']['metadata']['tenant_uuid']],
-                            token=data['data']['token'],
-                        )
-                    )
-            # get the list of tenants linked to the token
-            tenants_url = self._url + '/tenants'
-            async with session.get(
-                tenants_url, headers={"X-Auth-Token": token}
-            ) as response:
-                if response.status != 200:
+        cache_key = "%s\0%s" % (token, tenant_uuid or '')
+        principal = self.cache.get(cache_key)
+        if principal is not None:
+            return principal
+        # the token data and the list of tenants linked to the token
+        (token_ok, data), (tenants_ok, tenants_data) = await asyncio.gather(
+            self.get_json(self._url + '/token/' + token),
+            self.get_json(self._url + '/tenants', headers={"X-Auth-Token": token}),
+        )
+        if not token_ok or not tenants_ok:
+            return None
+        token_data = dict()
+        ttl = None
+        if data is not None and data.get('data'):
+            token_data.update(
+                dict(
+                    auth_id=data['data']['auth_id'],
+                    uuid=data['data']['metadata']['uuid'],
+                    tenant_uuid=data['data']['metadata']['tenant_uuid'],
+                    tenant_uuids=[data['data']['metadata']['tenant_uuid']],
+                    token=data['data']['token'],
+                )
+            )
+            ttl = get_token_ttl(data['data'])
+        if tenants_data is not None and tenants_data.get('items'):
+            token_data['tenant_uuids'] = list(
+                map(lambda x: x['uuid'], tenants_data['items'])
+            )
+            if tenant_uuid:
+                if tenant_uuid not in token_data['tenant_uuids']:
                     return None
-                data = await response.json()
-                if data is not None and data.get('items'):
-                    token_data['tenant_uuids'] = list(
-                        map(lambda x: x['uuid'], data['items'])
-                    )
-                    if tenant_uuid:
-                        if tenant_uuid not in token_data['tenant_uuids']:
-                            return None
-                        token_data['tenant_uuid'] = tenant_uuid
-                        token_data['tenant_uuids'] = [tenant_uuid]
-            return Principal(**token_data)
+                token_data['tenant_uuid'] = tenant_uuid
+                token_data['tenant_uuids'] = [tenant_uuid]
+        principal = Principal(**token_data)
+        if ttl is None or ttl > 0:
+            self.cache.set(cache_key, principal, ttl)
+        return principal
 
 
 def get_principal(request: Request) -> Optional[Principal]:
     return getattr(request.state, 'principal', None)
 
 
+class AuthMiddleware(object):
+    """
+    Answer 401 to the requests without a valid wazo-auth token, and expose
+    the principal of the token to the others.
+    """
+
+    def __init__(self, app: ASGIApp, auth_client: AuthClient):
+        self.app = app
+        self.auth_client = auth_client
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        header = headers.get(X_AUTH_TOKEN_HEADER)
+        if header is None:
+            response = Response(
+                "Missing %s header" % X_AUTH_TOKEN_HEADER, status_code=401
+            )
+            await response(scope, receive, send)
+            return
+        tenant_uuid = headers.get(WAZO_TENANT)
+        principal = await self.auth_client.get_token_data(header, tenant_uuid)
+        if principal is None:
+            response = Response("The provided token is not valid", status_code=401)
+            await response(scope, receive, send)
+            return
+        scope.setdefault('state', {})['principal'] = principal
+        await self.app(scope, receive, send)
+
+
 def setup_auth(app: FastAPI, config: dict) -> FastAPI:
     config['wazo_auth'] = bool(config.get('wazo_auth'))
 
     if config['wazo_auth']:
         auth_client = AuthClient(
-            url=config['wazo_auth_url'], cert=bool(config['wazo_auth_cert'])
+            url=config['wazo_auth_url'],
+            cert=bool(config['wazo_auth_cert']),
+            cache_size=int(config.get('wazo_auth_cache_size', AUTH_CACHE_SIZE) or 0),
+            cache_ttl=int(config.get('wazo_auth_cache_ttl', AUTH_CACHE_TTL) or 0),
         )
+        setattr(app, 'auth_client', auth_client)
+        app.add_event_handler("shutdown", auth_client.close)
 
-        # pylint: disable= unused-variable
-        @app.middleware("http")
-        async def auth_middleware(request: Request, call_next):
-            header = request.headers.get(X_AUTH_TOKEN_HEADER)
-            if header is None:
-                return Response(
-                    "Missing %s header" % X_AUTH_TOKEN_HEADER, status_code=401
-                )
-            tenant_uuid = request.headers.get(WAZO_TENANT)
-            principal = await auth_client.get_token_data(header, tenant_uuid)
-            if principal is None:
-                return Response("The provided token is not valid", status_code=401)
-            request.state.principal = principal
-            response = await call_next(request)
-            return response
+        app.add_middleware(AuthMiddleware, auth_client=auth_client)
 
     return app
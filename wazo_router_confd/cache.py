@@ -0,0 +1,144 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from typing import Any, Iterable, List, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from wazo_router_confd.database import SessionLocal
+from wazo_router_confd.models.carrier import Carrier
+from wazo_router_confd.models.carrier_trunk import CarrierTrunk
+from wazo_router_confd.models.did import DID
+from wazo_router_confd.models.domain import Domain
+from wazo_router_confd.models.ipbx import IPBX
+from wazo_router_confd.models.normalization import (
+    NormalizationProfile,
+    NormalizationRule,
+)
+from wazo_router_confd.models.tenant import Tenant
+
+
+# Cached Kamailio answers are tagged with the inputs and the entities they
+# depend on, a write evicts the answers tagged with what it changed:
+#
+#   domain:<domain>                 routing to the ipbx linked to a domain
+#   did_prefix:<prefix>             routing to the DIDs with a given prefix
+#   source_ip:<ip>                  outbound routing from the ipbx with that ip_fqdn
+#   tenant_trunks:<tenant_uuid>     outbound routing to the trunks of a tenant
+#   auth_domain:<domain>|*          auth of ipbxs, by requested domain
+#   auth_trunk_ip:<ip>|*            auth of carrier trunks, by ip address
+#   ipbx:<id>                       answers built from an ipbx
+#   carrier_trunk:<id>              answers built from a carrier trunk
+#   carrier_trunks                  version of the uacreg dbtext, any trunk
+#   normalization_profile:<id>      answers normalized by a profile
+#   tenant:<tenant_uuid>            answers built from the entities of a tenant
+
+PENDING_CACHE_TAGS = 'pending_cache_tags'
+CACHE_TAGS = 'cache_tags'
+
+
+def add_cache_tags(session: Session, tags: Iterable[str]):
+    """
+    Record the cache tags to evict once the session is committed, for the
+    writes done outside of the ORM unit of work (bulk or raw SQL).
+    """
+    session.info.setdefault(PENDING_CACHE_TAGS, set()).update(tags)
+
+
+def pop_cache_tags(session: Session) -> Set[str]:
+    return session.info.pop(CACHE_TAGS, set())
+
+
+def get_attribute_values(
+    instance: Any, name: str, include_none: bool = False
+) -> List[Any]:
+    # current and previous values of the attribute
+    history = getattr(inspect(instance).attrs, name).history
+    values = list(history.added or ()) + list(history.unchanged or ())
+    values += list(history.deleted or ())
+    if not values:
+        values = [getattr(instance, name)]
+    return [value for value in values if include_none or value is not None]
+
+
+def get_instance_cache_tags(session: Session, instance: Any) -> Set[str]:
+    tags: Set[str] = set()
+    if isinstance(instance, Tenant):
+        tags.add('tenant:%s' % instance.uuid)
+    elif isinstance(instance, Domain):
+        for domain in get_attribute_values(instance, 'domain'):
+            tags.update(['domain:%s' % domain, 'auth_domain:%s' % domain])
+    elif isinstance(instance, IPBX):
+        tags.update(['ipbx:%s' % instance.id, 'auth_domain:*'])
+        domain_ids = get_attribute_values(instance, 'domain_id')
+        if domain_ids:
+            for (domain,) in session.query(Domain.domain).filter(
+                Domain.id.in_(domain_ids)
+            ):
+                tags.update(['domain:%s' % domain, 'auth_domain:%s' % domain])
+        for ip_fqdn in get_attribute_values(instance, 'ip_fqdn'):
+            tags.add('source_ip:%s' % ip_fqdn)
+    elif isinstance(instance, DID):
+        for did_prefix in get_attribute_values(instance, 'did_prefix'):
+            tags.add('did_prefix:%s' % did_prefix)
+    elif isinstance(instance, Carrier):
+        tags.add('carrier_trunks')
+        for tenant_uuid in get_attribute_values(instance, 'tenant_uuid'):
+            tags.add('tenant_trunks:%s' % tenant_uuid)
+    elif isinstance(instance, CarrierTrunk):
+        tags.update(['carrier_trunk:%s' % instance.id, 'carrier_trunks'])
+        for tenant_uuid in get_attribute_values(instance, 'tenant_uuid'):
+            tags.add('tenant_trunks:%s' % tenant_uuid)
+        # a trunk with no ip address authenticates any source ip
+        for ip_address in get_attribute_values(instance, 'ip_address', True):
+            tags.add('auth_trunk_ip:%s' % (ip_address or '*'))
+    elif isinstance(instance, NormalizationProfile):
+        tags.add('normalization_profile:%s' % instance.id)
+    elif isinstance(instance, NormalizationRule):
+        for profile_id in get_attribute_values(instance, 'profile_id'):
+            tags.add('normalization_profile:%s' % profile_id)
+    return tags
+
+
+# load the previous value of the attributes the tags are built from, even if
+# expired, so that the entries tagged with the previous value are evicted too
+TAGGED_ATTRIBUTES = (
+    Domain.domain,
+    IPBX.domain_id,
+    IPBX.ip_fqdn,
+    DID.did_prefix,
+    Carrier.tenant_uuid,
+    CarrierTrunk.tenant_uuid,
+    CarrierTrunk.ip_address,
+    NormalizationRule.profile_id,
+)
+for attribute in TAGGED_ATTRIBUTES:
+    event.listen(attribute, 'set', lambda *args: None, active_history=True)
+
+
+@event.listens_for(SessionLocal, 'after_flush')
+def collect_cache_tags(session: Session, flush_context: Any):
+    tags: Set[str] = set()
+    for instance in list(session.new) + list(session.dirty):
+        tags.update(get_instance_cache_tags(session, instance))
+    for instance in session.deleted:
+        tags.update(get_instance_cache_tags(session, instance))
+        # the database cascades the deletion to the dependent entities
+        if isinstance(instance, Tenant):
+            tags.add('carrier_trunks')
+        tenant_uuid = getattr(instance, 'tenant_uuid', None)
+        if tenant_uuid is not None:
+            tags.add('tenant:%s' % tenant_uuid)
+    add_cache_tags(session, tags)
+
+
+@event.listens_for(SessionLocal, 'after_commit')
+def commit_cache_tags(session: Session):
+    tags = session.info.pop(PENDING_CACHE_TAGS, set())
+    session.info.setdefault(CACHE_TAGS, set()).update(tags)
+
+
+@event.listens_for(SessionLocal, 'after_rollback')
+def rollback_cache_tags(session: Session):
+    session.info.pop(PENDING_CACHE_TAGS, None)
@@ -0,0 +1,133 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import logging
+
+from typing import List, Optional
+
+import aiopg  # type: ignore
+import psycopg2  # type: ignore
+
+from fastapi import FastAPI
+from starlette.requests import Request
+
+from wazo_router_confd.schemas import cdr as cdr_schema
+from wazo_router_confd.services import kamailio as kamailio_service
+
+# number of buffered CDRs triggering a flush, 0 disables the buffer, and
+# interval in milliseconds between two flushes
+CDR_BUFFER_SIZE = 0
+CDR_BUFFER_INTERVAL = 1000
+# CDRs kept for a new attempt when a flush fails, as a multiple of the size
+CDR_BUFFER_MAX_PENDING = 10
+
+logger = logging.getLogger(__name__)
+
+
+class CDRBuffer(object):
+    """
+    Buffer of the CDRs sent by Kamailio, inserted in batches once the size
+    or the interval is reached, off the routing path.
+
+    The CDRs are acknowledged once buffered: the ones still buffered are
+    lost if the process is killed, at most a flush interval or a buffer
+    size of CDRs, and are flushed on a graceful shutdown. When a flush
+    fails, its CDRs are kept for the next one, up to the maximum number of
+    pending CDRs, after which the oldest are dropped and logged. When the
+    batch is rejected because of its data, it is bisected so that only the
+    rejected CDRs are dropped and logged.
+    """
+
+    size: int
+    interval: int
+    max_pending: int
+    cdrs: List[cdr_schema.CDRCreate]
+    pool: Optional[aiopg.Pool]
+    task: Optional[asyncio.Task]
+    lock: Optional[asyncio.Lock]
+
+    def __init__(self, size=CDR_BUFFER_SIZE, interval=CDR_BUFFER_INTERVAL):
+        self.size = size
+        self.interval = interval
+        self.max_pending = size * CDR_BUFFER_MAX_PENDING
+        self.cdrs = []
+        self.pool = None
+        self.task = None
+        self.lock = None
+
+    async def connect(self, pool: aiopg.Pool):
+        self.pool = pool
+        self.lock = asyncio.Lock()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def disconnect(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval / 1000)
+            await self.flush()
+
+    def add(self, cdrs: List[cdr_schema.CDRCreate]):
+        self.cdrs.extend(cdrs)
+        if len(self.cdrs) >= self.size and self.pool is not None:
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self.pool is None or self.lock is None:
+            return
+        async with self.lock:
+            cdrs, self.cdrs = self.cdrs, []
+            if not cdrs:
+                return
+            try:
+                async with self.pool.acquire() as conn:
+                    await self.insert(conn, cdrs)
+            except Exception as e:
+                # keep the CDRs for the next flush, before the new ones
+                self.cdrs = cdrs + self.cdrs
+                dropped = len(self.cdrs) - self.max_pending
+                if dropped > 0:
+                    del self.cdrs[:dropped]
+                logger.error(
+                    "fail to insert %d buffered CDRs, %d dropped: %s",
+                    len(cdrs),
+                    max(dropped, 0),
+                    e,
+                )
+
+    async def insert(self, conn: aiopg.Connection, cdrs: List[cdr_schema.CDRCreate]):
+        try:
+            await kamailio_service.insert_cdrs(conn, cdrs)
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            # the connection is in autocommit, the halves are inserted apart
+            if len(cdrs) == 1:
+                logger.error("drop the rejected CDR %s: %s", cdrs[0].call_id, e)
+                return
+            middle = len(cdrs) // 2
+            await self.insert(conn, cdrs[:middle])
+            await self.insert(conn, cdrs[middle:])
+
+
+def get_cdr_buffer(request: Request) -> Optional[CDRBuffer]:
+    return getattr(request.app, 'cdr_buffer', None)
+
+
+def setup_cdr_buffer(app: FastAPI, config: dict):
+    cdr_buffer = CDRBuffer(
+        size=int(config.get('cdr_buffer_size') or 0),
+        interval=int(config.get('cdr_buffer_interval') or CDR_BUFFER_INTERVAL),
+    )
+    setattr(app, 'cdr_buffer', cdr_buffer)
+
+    async def startup():
+        await cdr_buffer.connect(getattr(app, 'aiopg_pool').pool)
+
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", cdr_buffer.disconnect)
+
+    return app
@@ -0,0 +1,181 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import logging
+import re
+
+from datetime import date, datetime
+from typing import Any, List, Optional
+
+import aiopg  # type: ignore
+import psycopg2  # type: ignore
+
+from fastapi import FastAPI
+
+# the cdrs table is partitioned by month of insertion, in UTC, the rows of
+# the months without a partition are stored in the default partition
+CDR_PARTITION_DEFAULT = 'cdrs_default'
+# months partitioned ahead of the current one, months of cdrs kept, 0 keeps
+# them all, and interval in seconds between two checks of the partitions
+CDR_PARTITIONS_AHEAD = 3
+CDR_RETENTION_MONTHS = 0
+CDR_PARTITIONS_INTERVAL = 3600
+
+re_cdr_partition = re.compile(r'^cdrs_([0-9]{4})_([0-9]{2})$')
+
+logger = logging.getLogger(__name__)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_name(month: date) -> str:
+    return 'cdrs_%04d_%02d' % (month.year, month.month)
+
+
+def get_partition_month(name: str) -> Optional[date]:
+    match = re_cdr_partition.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def is_cdr_partition(name: str) -> bool:
+    return name == CDR_PARTITION_DEFAULT or get_partition_month(name) is not None
+
+
+def include_object(
+    object: Any, name: str, type_: str, reflected: bool, compare_to: Any
+) -> bool:
+    # the partitions are managed outside of the migrations
+    return not (type_ == 'table' and reflected and is_cdr_partition(name))
+
+
+def get_expired_partitions(
+    partitions: List[str], today: date, retention_months: int
+) -> List[str]:
+    if retention_months <= 0:
+        return []
+    # a partition expires once all of its rows are older than the retention
+    first_month = add_months(date(today.year, today.month, 1), -retention_months)
+    return [
+        name
+        for name in partitions
+        if get_partition_month(name) is not None
+        and add_months(get_partition_month(name), 1) <= first_month  # type: ignore
+    ]
+
+
+async def get_partitions(conn: aiopg.Connection) -> List[str]:
+    async with conn.cursor() as cur:
+        await cur.execute(
+            "SELECT partitions.relname FROM pg_inherits "
+            "JOIN pg_class partitions ON partitions.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parents ON parents.oid = pg_inherits.inhparent "
+            "WHERE parents.relname = 'cdrs' ORDER BY partitions.relname;"
+        )
+        return [name for (name,) in await cur.fetchall()]
+
+
+async def create_partitions(conn: aiopg.Connection, months: List[date]):
+    partitions = set(await get_partitions(conn))
+    async with conn.cursor() as cur:
+        for month in months:
+            name = get_partition_name(month)
+            if name in partitions:
+                continue
+            try:
+                await cur.execute(
+                    "CREATE TABLE %s PARTITION OF cdrs FOR VALUES FROM (%%s) TO (%%s);"
+                    % name,
+                    [month, add_months(month, 1)],
+                )
+            except psycopg2.Error as e:
+                # e.g. rows of this month already in the default partition
+                logger.warning("fail to create the cdrs partition %s: %s", name, e)
+
+
+async def drop_partitions(conn: aiopg.Connection, names: List[str]):
+    async with conn.cursor() as cur:
+        for name in names:
+            logger.info("dropping the expired cdrs partition %s", name)
+            await cur.execute("DROP TABLE IF EXISTS %s;" % name)
+
+
+class CDRPartitionManager(object):
+    """
+    Create the partitions of the cdrs ahead of time, and drop the expired
+    partitions as a whole instead of deleting their rows.
+    """
+
+    ahead: int
+    retention_months: int
+    interval: int
+    pool: Optional[aiopg.Pool]
+    task: Optional[asyncio.Task]
+
+    def __init__(
+        self,
+        ahead=CDR_PARTITIONS_AHEAD,
+        retention_months=CDR_RETENTION_MONTHS,
+        interval=CDR_PARTITIONS_INTERVAL,
+    ):
+        self.ahead = ahead
+        self.retention_months = retention_months
+        self.interval = interval
+        self.pool = None
+        self.task = None
+
+    async def connect(self, pool: aiopg.Pool):
+        self.pool = pool
+        try:
+            await self.update()
+        except Exception as e:
+            logger.warning("fail to update the cdrs partitions: %s", e)
+        self.task = asyncio.ensure_future(self.run())
+
+    def disconnect(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.update()
+            except Exception as e:
+                logger.warning("fail to update the cdrs partitions: %s", e)
+
+    async def update(self, today: Optional[date] = None):
+        if self.pool is None:
+            return
+        today = today or datetime.utcnow().date()
+        month = date(today.year, today.month, 1)
+        async with self.pool.acquire() as conn:
+            await create_partitions(
+                conn, [add_months(month, i) for i in range(self.ahead + 1)]
+            )
+            expired_partitions = get_expired_partitions(
+                await get_partitions(conn), today, self.retention_months
+            )
+            await drop_partitions(conn, expired_partitions)
+
+
+def setup_cdr_partitions(app: FastAPI, config: dict):
+    manager = CDRPartitionManager(
+        ahead=int(config.get('cdr_partitions_ahead', CDR_PARTITIONS_AHEAD) or 0),
+        retention_months=int(config.get('cdr_retention_months') or 0),
+    )
+    setattr(app, 'cdr_partitions', manager)
+
+    async def startup():
+        await manager.connect(getattr(app, 'aiopg_pool').pool)
+
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", manager.disconnect)
+
+    return app
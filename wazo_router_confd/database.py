@@ -4,6 +4,9 @@
 import logging
 import os
 
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
 import aiopg  # type: ignore
 
 import alembic.config  # type: ignore
@@ -14,11 +17,13 @@ from alembic import migration
 from urllib.parse import urlparse
 
 from fastapi import FastAPI
+from psycopg2.extras import DictCursor  # type: ignore
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+from sqlalchemy.orm import Query, Session, sessionmaker
 from tenacity import (  # type: ignore
     after_log,
     before_log,
@@ -27,18 +32,78 @@ from tenacity import (  # type: ignore
     wait_fixed,
 )
 
+from wazo_router_confd.metrics import DB_POOL_ACQUIRE_DURATION
 from wazo_router_confd.models.base import Base
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+# the dialect of the queries compiled for aiopg, which runs on psycopg2
+aiopg_dialect = PGDialect_psycopg2()
 logger = logging.getLogger(__name__)
 
+# maximum number of connections of the pool dedicated to the CDR exports,
+# which hold a connection for their whole streamed response
+CDR_EXPORT_CONNECTIONS = 2
+
 
-def get_db(request: Request):
-    return request.state.db
+def get_db(request: Request) -> Session:
+    # opened on demand, the routes without a dependency on it, e.g. the
+    # Kamailio ones and the CRUD reads on aiopg, never open a session
+    db = getattr(request.state, 'db', None)
+    if db is None:
+        db = request.state.db = SessionLocal(bind=getattr(request.app, 'engine'))
+    return db
 
 
 def get_aiopg_pool(request: Request) -> aiopg.Pool:
-    return request.state.aiopg_pool
+    return getattr(request.app, 'aiopg_pool').pool
+
+
+def get_aiopg_export_pool(request: Request) -> aiopg.Pool:
+    return getattr(request.app, 'aiopg_export_pool').pool
+
+
+def compile_query(query: Query) -> Tuple[str, Dict[str, Any]]:
+    compiled = query.statement.compile(dialect=aiopg_dialect)
+    # psycopg2 adapts no UUID, unless registered
+    params = {
+        name: str(value) if isinstance(value, UUID) else value
+        for name, value in compiled.params.items()
+    }
+    return str(compiled), params
+
+
+async def fetch_all(pool: aiopg.Pool, query: Query) -> List[Dict[str, Any]]:
+    """
+    Get the rows of the query, built without a session, as dicts by column
+    name, on a connection of the aiopg pool instead of a threadpool slot.
+    """
+    sql, params = compile_query(query)
+    async with pool.acquire() as conn:
+        async with conn.cursor(cursor_factory=DictCursor) as cur:
+            await cur.execute(sql, params)
+            return [dict(row) for row in await cur.fetchall()]
+
+
+async def fetch_one(pool: aiopg.Pool, query: Query) -> Optional[Dict[str, Any]]:
+    rows = await fetch_all(pool, query.limit(1))
+    return rows[0] if rows else None
+
+
+class DBSessionMiddleware(object):
+    """
+    Close the session of the request once answered, if it was opened.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            db = scope.get('state', {}).get('db')
+            if db is not None:
+                db.close()
 
 
 def setup_database(app: FastAPI, config: dict):
@@ -49,29 +114,58 @@ def setup_database(app: FastAPI, config: dict):
     engine = create_engine(database_uri, connect_args=connect_args)
     setattr(app, 'engine', engine)
 
-    # pylint: disable= unused-variable
-    @app.middleware("http")
-    async def db_session_middleware(request: Request, call_next):
-        response = Response("Internal server error", status_code=500)
-        try:
-            request.state.db = SessionLocal(bind=engine)
-            response = await call_next(request)
-        finally:
-            request.state.db.close()
-        return response
+    app.add_middleware(DBSessionMiddleware)
 
     return app
 
 
+class AcquireContextManager(object):
+    def __init__(self, pool: aiopg.Pool):
+        self.pool = pool
+        self.conn = None
+
+    async def __aenter__(self):
+        with DB_POOL_ACQUIRE_DURATION.time():
+            self.conn = await self.pool.acquire()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        conn, self.conn = self.conn, None
+        await self.pool.release(conn)
+
+
+class InstrumentedPool(object):
+    """
+    aiopg pool recording the time spent waiting for a connection.
+    """
+
+    def __init__(self, pool: aiopg.Pool):
+        self.pool = pool
+
+    def acquire(self) -> AcquireContextManager:
+        return AcquireContextManager(self.pool)
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+
 class AiopgConnectionPool(object):
     dsn: str
+    minsize: int
+    maxsize: int
     pool: aiopg.Pool
 
-    def __init__(self, dsn):
+    def __init__(self, dsn, minsize=1, maxsize=10):
         self.dsn = dsn
+        self.minsize = minsize
+        self.maxsize = maxsize
 
     async def connect(self):
-        self.pool = await aiopg.create_pool(self.dsn)
+        self.pool = InstrumentedPool(
+            await aiopg.create_pool(
+                self.dsn, minsize=self.minsize, maxsize=self.maxsize
+            )
+        )
 
     async def clear(self):
         await self.pool.clear()
@@ -93,17 +187,21 @@ def setup_aiopg_database(app: FastAPI, config: dict):
     database_uri = config['database_uri']
     dsn = from_database_uri_to_dsn(database_uri)
     connection_pool = AiopgConnectionPool(dsn)
+    setattr(app, 'aiopg_pool', connection_pool)
+    # a slow client of an export never starves the routing of connections
+    export_pool = AiopgConnectionPool(
+        dsn,
+        minsize=0,
+        maxsize=max(
+            int(config.get('cdr_export_connections') or CDR_EXPORT_CONNECTIONS), 1
+        ),
+    )
+    setattr(app, 'aiopg_export_pool', export_pool)
 
     app.add_event_handler("startup", connection_pool.connect)
+    app.add_event_handler("startup", export_pool.connect)
     app.add_event_handler("shutdown", connection_pool.clear)
-
-    # pylint: disable= unused-variable
-    @app.middleware("http")
-    async def db_aiopg_database_middleware(request: Request, call_next):
-        response = Response("Internal server error", status_code=500)
-        request.state.aiopg_pool = connection_pool.pool
-        response = await call_next(request)
-        return response
+    app.add_event_handler("shutdown", export_pool.clear)
 
     return app
 
@@ -66,6 +66,120 @@ from .app import get_app
     help="REDIS URI, overwrites the configuration obtained from the Consul agent",
     show_default=True,
 )
+@click.option(
+    "--redis-cache-ttl",
+    type=int,
+    default=3600,
+    help="Time to live in seconds of the cached Kamailio routing and auth answers, 0 to never expire",
+    show_default=True,
+)
+@click.option(
+    "--redis-negative-cache-ttl",
+    type=int,
+    default=5,
+    help="Time to live in seconds of the cached failed Kamailio routing and auth lookups",
+    show_default=True,
+)
+@click.option(
+    "--redis-local-cache-size",
+    type=int,
+    default=4096,
+    help="Maximum number of cached values kept in process in front of Redis, 0 disables",
+    show_default=True,
+)
+@click.option(
+    "--redis-local-cache-ttl",
+    type=int,
+    default=10,
+    help="Time to live in seconds of the cached values kept in process",
+    show_default=True,
+)
+@click.option(
+    "--redis-lock-timeout",
+    type=int,
+    default=0,
+    help="Time in milliseconds an instance holds the lock on the cache keys it computes, 0 disables the lock",
+    show_default=True,
+)
+@click.option(
+    "--redis-cache-key-secret",
+    type=str,
+    help="Secret of the hashed passwords in the cache keys, shared by the instances through Redis if unset",
+)
+@click.option(
+    "--password-verify-workers",
+    type=int,
+    default=4,
+    help="Number of processes verifying the passwords, 0 verifies them in threads",
+    show_default=True,
+)
+@click.option(
+    "--password-verify-cache-ttl",
+    type=int,
+    default=30,
+    help="Time to live in seconds of the successful password verifications, 0 disables the cache",
+    show_default=True,
+)
+@click.option(
+    "--cdr-partitions-ahead",
+    type=int,
+    default=3,
+    help="Number of monthly partitions of the CDRs created ahead of the current month",
+    show_default=True,
+)
+@click.option(
+    "--cdr-retention-months",
+    type=int,
+    default=0,
+    help="Number of months of CDRs kept, the older partitions are dropped, 0 keeps them all",
+    show_default=True,
+)
+@click.option(
+    "--cdr-buffer-size",
+    type=int,
+    default=0,
+    help="Number of CDRs buffered before being inserted in a batch, 0 inserts each CDR when received",
+    show_default=True,
+)
+@click.option(
+    "--cdr-buffer-interval",
+    type=int,
+    default=1000,
+    help="Maximum time in milliseconds a CDR stays buffered",
+    show_default=True,
+)
+@click.option(
+    "--cdr-export-connections",
+    type=int,
+    default=2,
+    help="Maximum number of database connections streaming the CDR exports, apart from the routing ones",
+    show_default=True,
+)
+@click.option(
+    "--trace-file",
+    type=click.Path(),
+    default=None,
+    help="Path of the file the sampled request traces are appended to, as JSON lines",
+)
+@click.option(
+    "--trace-sample-rate",
+    type=float,
+    default=0.0,
+    help="Ratio of the requests traced to the trace file",
+    show_default=True,
+)
+@click.option(
+    "--routing-engine/--no-routing-engine",
+    default=False,
+    help="Answer the Kamailio routing and auth requests from an in-memory snapshot of the configuration",
+)
+@click.option(
+    "--routing-engine-refresh-interval",
+    type=int,
+    default=60,
+    help="Interval in seconds between two reloads of the in-memory routing snapshot, 0 to disable",
+    show_default=True,
+)
 @click.option(
     "--wazo-auth/--no-wazo-auth",
     default=False,
@@ -85,6 +199,20 @@ from .app import get_app
     help="Path of the X509 certificate to verify when communicatin with the wazo-auth service",
     show_default=True,
 )
+@click.option(
+    "--wazo-auth-cache-size",
+    type=int,
+    default=4096,
+    help="Number of validated wazo-auth tokens remembered",
+    show_default=True,
+)
+@click.option(
+    "--wazo-auth-cache-ttl",
+    type=int,
+    default=60,
+    help="Time to live in seconds of the validated wazo-auth tokens, at most until they expire, 0 to disable",
+    show_default=True,
+)
 @click.option(
     "--debug", is_flag=True, default=False, help="Enable debug mode", hidden=True
 )
@@ -98,9 +226,28 @@ def main(
     database_uri: Optional[str] = None,
     database_upgrade: bool = True,
     redis_uri: Optional[str] = None,
+    redis_cache_ttl: int = 3600,
+    redis_negative_cache_ttl: int = 5,
+    redis_local_cache_size: int = 4096,
+    redis_local_cache_ttl: int = 10,
+    redis_lock_timeout: int = 0,
+    redis_cache_key_secret: Optional[str] = None,
+    password_verify_workers: int = 4,
+    password_verify_cache_ttl: int = 30,
+    cdr_partitions_ahead: int = 3,
+    cdr_retention_months: int = 0,
+    cdr_buffer_size: int = 0,
+    cdr_buffer_interval: int = 1000,
+    cdr_export_connections: int = 2,
+    trace_file: Optional[str] = None,
+    trace_sample_rate: float = 0.0,
+    routing_engine: bool = False,
+    routing_engine_refresh_interval: int = 60,
     wazo_auth: bool = False,
     wazo_auth_url: Optional[str] = None,
     wazo_auth_cert: Optional[str] = None,
+    wazo_auth_cache_size: int = 4096,
+    wazo_auth_cache_ttl: int = 60,
     debug: bool = False,
     auto_envvar_prefix: Optional[str] = None,
 ):
@@ -113,9 +260,28 @@ def main(
         database_uri=database_uri,
         database_upgrade=database_upgrade,
         redis_uri=redis_uri,
+        redis_cache_ttl=redis_cache_ttl,
+        redis_negative_cache_ttl=redis_negative_cache_ttl,
+        redis_local_cache_size=redis_local_cache_size,
+        redis_local_cache_ttl=redis_local_cache_ttl,
+        redis_lock_timeout=redis_lock_timeout,
+        redis_cache_key_secret=redis_cache_key_secret,
+        password_verify_workers=password_verify_workers,
+        password_verify_cache_ttl=password_verify_cache_ttl,
+        cdr_partitions_ahead=cdr_partitions_ahead,
+        cdr_retention_months=cdr_retention_months,
+        cdr_buffer_size=cdr_buffer_size,
+        cdr_buffer_interval=cdr_buffer_interval,
+        cdr_export_connections=cdr_export_connections,
+        trace_file=trace_file,
+        trace_sample_rate=trace_sample_rate,
+        routing_engine=routing_engine,
+        routing_engine_refresh_interval=routing_engine_refresh_interval,
         wazo_auth=wazo_auth,
         wazo_auth_url=wazo_auth_url,
         wazo_auth_cert=wazo_auth_cert,
+        wazo_auth_cache_size=wazo_auth_cache_size,
+        wazo_auth_cache_ttl=wazo_auth_cache_ttl,
         debug=debug,
     )
     if config_file is not None:
@@ -0,0 +1,310 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import bisect
+
+from contextlib import contextmanager
+from time import monotonic
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from fastapi import FastAPI
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+LabelValues = Tuple[str, ...]
+# name, label names and label values of a sample, with its value
+Sample = Tuple[str, Tuple[str, ...], LabelValues, float]
+
+
+def format_labels(labelnames: Sequence[str], labelvalues: Sequence[str]) -> str:
+    if not labelnames:
+        return ''
+    labels = [
+        '%s="%s"'
+        % (
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'),
+        )
+        for name, value in zip(labelnames, labelvalues)
+    ]
+    return '{%s}' % ','.join(labels)
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Metric in the Prometheus text exposition format, by label values.
+    """
+
+    type: str = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def get_labelvalues(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def collect(self) -> Iterator[Sample]:
+        raise NotImplementedError  # pragma: no cover
+
+    def render(self) -> List[str]:
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.type),
+        ]
+        for name, labelnames, labelvalues, value in self.collect():
+            lines.append(
+                '%s%s %s'
+                % (name, format_labels(labelnames, labelvalues), format_value(value))
+            )
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        labelvalues = self.get_labelvalues(labels)
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.get_labelvalues(labels), 0)
+
+    def collect(self) -> Iterator[Sample]:
+        for labelvalues, value in sorted(self.values.items()):
+            yield self.name, self.labelnames, labelvalues, value
+
+
+class Gauge(Metric):
+    """
+    Gauge whose value is read from a callback when collected.
+    """
+
+    type = 'gauge'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Optional[Callable[[], Optional[float]]] = None,
+    ):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def collect(self) -> Iterator[Sample]:
+        value = self.callback() if self.callback is not None else None
+        if value is not None:
+            yield self.name, (), (), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # number of observations by bucket, with their sum
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        labelvalues = self.get_labelvalues(labels)
+        counts, total = self.values.setdefault(
+            labelvalues, ([0] * (len(self.buckets) + 1), [0.0])
+        )
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - start, **labels)
+
+    def get_count(self, **labels: str) -> int:
+        counts, _ = self.values.get(self.get_labelvalues(labels), ([0], [0.0]))
+        return sum(counts)
+
+    def collect(self) -> Iterator[Sample]:
+        bucket_labelnames = self.labelnames + ('le',)
+        for labelvalues, (counts, total) in sorted(self.values.items()):
+            count = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                count += bucket_count
+                bucket_labelvalues = labelvalues + (format_value(bound),)
+                yield '%s_bucket' % self.name, bucket_labelnames, bucket_labelvalues, count
+            yield '%s_count' % self.name, self.labelnames, labelvalues, count
+            yield '%s_sum' % self.name, self.labelnames, labelvalues, total[0]
+
+
+M = TypeVar('M', bound=Metric)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        'wazo_router_confd_http_request_duration_seconds',
+        'Latency of the HTTP requests, by route',
+        ['method', 'route', 'status'],
+    )
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        'wazo_router_confd_cache_requests_total',
+        'Lookups of the cached Kamailio answers, by cache and result',
+        ['cache', 'result'],
+    )
+)
+CACHE_INVALIDATIONS = REGISTRY.register(
+    Counter(
+        'wazo_router_confd_cache_invalidations_total',
+        'Invalidations of the cached Kamailio answers, by tags or FLUSHDB',
+        ['kind'],
+    )
+)
+REDIS_COMMAND_DURATION = REGISTRY.register(
+    Histogram(
+        'wazo_router_confd_redis_command_duration_seconds',
+        'Latency of the Redis commands',
+        ['command'],
+    )
+)
+DB_POOL_ACQUIRE_DURATION = REGISTRY.register(
+    Histogram(
+        'wazo_router_confd_db_pool_acquire_duration_seconds',
+        'Time spent waiting for a connection of the aiopg pool',
+    )
+)
+DB_POOL_SIZE = REGISTRY.register(
+    Gauge('wazo_router_confd_db_pool_size', 'Connections of the aiopg pool')
+)
+DB_POOL_IN_USE = REGISTRY.register(
+    Gauge('wazo_router_confd_db_pool_in_use', 'Connections of the aiopg pool in use')
+)
+PASSWORD_VERIFY_DURATION = REGISTRY.register(
+    Histogram(
+        'wazo_router_confd_password_verify_duration_seconds',
+        'Duration of the PBKDF2 password verifications, by result',
+        ['result'],
+    )
+)
+
+
+def get_route_path(app: FastAPI, request: Request) -> str:
+    # the route template, not the path, bounds the number of label values
+    endpoint = request.scope.get('endpoint')
+    for route in app.router.routes:
+        if getattr(route, 'endpoint', None) is endpoint:
+            return getattr(route, 'path', 'unmatched')
+    return 'unmatched'
+
+
+class MetricsMiddleware(object):
+    """
+    Record the duration of the requests by method, route and status.
+    """
+
+    def __init__(self, app: ASGIApp, fastapi_app: FastAPI):
+        self.app = app
+        self.fastapi_app = fastapi_app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        start = monotonic()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_DURATION.observe(
+                monotonic() - start,
+                method=scope['method'],
+                route=get_route_path(self.fastapi_app, Request(scope)),
+                status=str(status_code),
+            )
+
+
+def setup_metrics(app: FastAPI, config: dict):
+    def get_pool_size() -> Optional[float]:
+        pool = getattr(getattr(app, 'aiopg_pool', None), 'pool', None)
+        return pool.size if pool is not None else None
+
+    def get_pool_in_use() -> Optional[float]:
+        pool = getattr(getattr(app, 'aiopg_pool', None), 'pool', None)
+        return pool.size - pool.freesize if pool is not None else None
+
+    DB_POOL_SIZE.callback = get_pool_size
+    DB_POOL_IN_USE.callback = get_pool_in_use
+
+    app.add_middleware(MetricsMiddleware, fastapi_app=app)
+
+    return app
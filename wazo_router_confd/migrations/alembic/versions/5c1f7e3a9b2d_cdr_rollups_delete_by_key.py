@@ -0,0 +1,69 @@
+"""delete the emptied cdr rollups by primary key
+
+Revision ID: 5c1f7e3a9b2d
+Revises: bdbbf38dd0d6
+Create Date: 2020-01-08 10:22:47.130951
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1f7e3a9b2d'
+down_revision = 'bdbbf38dd0d6'
+branch_labels = None
+depends_on = None
+
+CDR_ROLLUPS_ADD = """
+CREATE OR REPLACE FUNCTION cdr_rollups_add(
+    uuid, integer, integer, timestamp, integer, integer
+) RETURNS void AS $$
+    INSERT INTO cdr_rollups AS rollups (
+        granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id, calls, duration
+    )
+    SELECT
+        granularity, date_trunc(granularity, $4), $1,
+        COALESCE($2, 0), COALESCE($3, 0), $6, $6 * COALESCE($5, 0)
+    FROM unnest(ARRAY['hour', 'day']) AS granularity
+    ON CONFLICT (granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id)
+    DO UPDATE SET
+        calls = rollups.calls + EXCLUDED.calls,
+        duration = rollups.duration + EXCLUDED.duration;
+    DELETE FROM cdr_rollups
+    WHERE $6 < 0 AND calls <= 0
+        AND (granularity, period) IN (
+            ('hour', date_trunc('hour', $4)), ('day', date_trunc('day', $4))
+        )
+        AND tenant_uuid = $1
+        AND carrier_trunk_id = COALESCE($2, 0)
+        AND ipbx_id = COALESCE($3, 0);
+$$ LANGUAGE sql;
+"""
+
+# the function of bdbbf38dd0d6, deleting the emptied rollups of the tenant
+PREVIOUS_CDR_ROLLUPS_ADD = """
+CREATE OR REPLACE FUNCTION cdr_rollups_add(
+    uuid, integer, integer, timestamp, integer, integer
+) RETURNS void AS $$
+    INSERT INTO cdr_rollups AS rollups (
+        granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id, calls, duration
+    )
+    SELECT
+        granularity, date_trunc(granularity, $4), $1,
+        COALESCE($2, 0), COALESCE($3, 0), $6, $6 * COALESCE($5, 0)
+    FROM unnest(ARRAY['hour', 'day']) AS granularity
+    ON CONFLICT (granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id)
+    DO UPDATE SET
+        calls = rollups.calls + EXCLUDED.calls,
+        duration = rollups.duration + EXCLUDED.duration;
+    DELETE FROM cdr_rollups WHERE tenant_uuid = $1 AND calls <= 0;
+$$ LANGUAGE sql;
+"""
+
+
+def upgrade():
+    op.execute(CDR_ROLLUPS_ADD)
+
+
+def downgrade():
+    op.execute(PREVIOUS_CDR_ROLLUPS_ADD)
@@ -0,0 +1,146 @@
+"""partition the cdrs by month of insertion
+
+Revision ID: 8e691b2f1b2d
+Revises: 819e55cac7fd
+Create Date: 2019-12-20 10:12:31.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_utils.types.uuid import UUIDType
+
+
+# revision identifiers, used by Alembic.
+revision = '8e691b2f1b2d'
+down_revision = '819e55cac7fd'
+branch_labels = None
+depends_on = None
+
+CDR_COLUMNS = (
+    "id, tenant_uuid, ipbx_id, carrier_trunk_id, source_ip, source_port, "
+    "from_uri, to_uri, call_id, call_start, duration"
+)
+
+# a partition by month of the existing cdrs
+CREATE_PARTITIONS_SQL = """
+DO $$
+DECLARE
+    month timestamp;
+BEGIN
+    FOR month IN
+        SELECT DISTINCT date_trunc('month', COALESCE(call_start, timezone('UTC', now())))
+        FROM cdrs_unpartitioned
+    LOOP
+        EXECUTE 'CREATE TABLE ' || quote_ident('cdrs_' || to_char(month, 'YYYY_MM'))
+            || ' PARTITION OF cdrs FOR VALUES FROM (' || quote_literal(month)
+            || ') TO (' || quote_literal(month + interval '1 month') || ')';
+    END LOOP;
+END $$;
+"""
+
+
+def upgrade():
+    op.execute("ALTER TABLE cdrs RENAME TO cdrs_unpartitioned;")
+    op.execute(
+        "ALTER TABLE cdrs_unpartitioned RENAME CONSTRAINT cdrs_pkey TO cdrs_unpartitioned_pkey;"
+    )
+    op.execute("ALTER INDEX ix_cdrs_id RENAME TO ix_cdrs_unpartitioned_id;")
+    # the sequence of the ids is kept
+    op.execute("ALTER SEQUENCE cdrs_id_seq OWNED BY NONE;")
+    op.create_table(
+        'cdrs',
+        sa.Column(
+            'id',
+            sa.Integer(),
+            server_default=sa.text("nextval('cdrs_id_seq'::regclass)"),
+            nullable=False,
+        ),
+        sa.Column(
+            'created_at',
+            sa.DateTime(),
+            server_default=sa.text("timezone('UTC', now())"),
+            nullable=False,
+        ),
+        sa.Column('tenant_uuid', UUIDType(), nullable=False),
+        sa.Column('ipbx_id', sa.Integer(), nullable=True),
+        sa.Column('carrier_trunk_id', sa.Integer(), nullable=True),
+        sa.Column('source_ip', sa.String(length=64), nullable=False),
+        sa.Column('source_port', sa.Integer(), nullable=False),
+        sa.Column('from_uri', sa.String(length=256), nullable=False),
+        sa.Column('to_uri', sa.String(length=256), nullable=False),
+        sa.Column('call_id', sa.String(length=256), nullable=False),
+        sa.Column('call_start', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['carrier_trunk_id'], ['carrier_trunks.id'], ondelete='CASCADE'
+        ),
+        sa.ForeignKeyConstraint(['ipbx_id'], ['ipbx.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['tenant_uuid'], ['tenants.uuid'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', 'created_at'),
+        postgresql_partition_by='RANGE (created_at)',
+    )
+    op.create_index(op.f('ix_cdrs_id'), 'cdrs', ['id'], unique=False)
+    op.create_index(
+        'ix_cdrs_tenant_uuid_call_start',
+        'cdrs',
+        ['tenant_uuid', 'call_start'],
+        unique=False,
+    )
+    op.create_index(
+        'ix_cdrs_created_at',
+        'cdrs',
+        ['created_at'],
+        unique=False,
+        postgresql_using='brin',
+    )
+    op.execute("CREATE TABLE cdrs_default PARTITION OF cdrs DEFAULT;")
+    # the existing cdrs were inserted around their call start
+    op.execute(CREATE_PARTITIONS_SQL)
+    op.execute(
+        "INSERT INTO cdrs (created_at, {0}) "
+        "SELECT COALESCE(call_start, timezone('UTC', now())), {0} "
+        "FROM cdrs_unpartitioned;".format(CDR_COLUMNS)
+    )
+    op.drop_table('cdrs_unpartitioned')
+    op.execute("ALTER SEQUENCE cdrs_id_seq OWNED BY cdrs.id;")
+
+
+def downgrade():
+    op.execute("ALTER TABLE cdrs RENAME TO cdrs_partitioned;")
+    op.execute(
+        "ALTER TABLE cdrs_partitioned RENAME CONSTRAINT cdrs_pkey TO cdrs_partitioned_pkey;"
+    )
+    op.execute("ALTER INDEX ix_cdrs_id RENAME TO ix_cdrs_partitioned_id;")
+    op.execute("ALTER SEQUENCE cdrs_id_seq OWNED BY NONE;")
+    op.create_table(
+        'cdrs',
+        sa.Column(
+            'id',
+            sa.Integer(),
+            server_default=sa.text("nextval('cdrs_id_seq'::regclass)"),
+            nullable=False,
+        ),
+        sa.Column('tenant_uuid', UUIDType(), nullable=False),
+        sa.Column('ipbx_id', sa.Integer(), nullable=True),
+        sa.Column('carrier_trunk_id', sa.Integer(), nullable=True),
+        sa.Column('source_ip', sa.String(length=64), nullable=False),
+        sa.Column('source_port', sa.Integer(), nullable=False),
+        sa.Column('from_uri', sa.String(length=256), nullable=False),
+        sa.Column('to_uri', sa.String(length=256), nullable=False),
+        sa.Column('call_id', sa.String(length=256), nullable=False),
+        sa.Column('call_start', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['carrier_trunk_id'], ['carrier_trunks.id'], ondelete='CASCADE'
+        ),
+        sa.ForeignKeyConstraint(['ipbx_id'], ['ipbx.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['tenant_uuid'], ['tenants.uuid'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_cdrs_id'), 'cdrs', ['id'], unique=False)
+    op.execute(
+        "INSERT INTO cdrs ({0}) SELECT {0} FROM cdrs_partitioned;".format(CDR_COLUMNS)
+    )
+    # the partitions are dropped along with the partitioned table
+    op.drop_table('cdrs_partitioned')
+    op.execute("ALTER SEQUENCE cdrs_id_seq OWNED BY cdrs.id;")
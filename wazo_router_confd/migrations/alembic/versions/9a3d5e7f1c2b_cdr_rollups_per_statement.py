@@ -0,0 +1,164 @@
+"""update the cdr rollups once per statement
+
+Revision ID: 9a3d5e7f1c2b
+Revises: 5c1f7e3a9b2d
+Create Date: 2020-01-13 15:02:31.418207
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3d5e7f1c2b'
+down_revision = '5c1f7e3a9b2d'
+branch_labels = None
+depends_on = None
+
+CDR_ROLLUP_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION cdr_rollups_add(
+    uuid[], integer[], integer[], timestamp[], integer[], integer[]
+) RETURNS void AS $$
+    INSERT INTO cdr_rollups AS rollups (
+        granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id, calls, duration
+    )
+    SELECT
+        granularity, date_trunc(granularity, called_at) AS period, tenant_uuid,
+        COALESCE(carrier_trunk_id, 0) AS carrier_trunk_id,
+        COALESCE(ipbx_id, 0) AS ipbx_id,
+        sum(sign), sum(sign * COALESCE(duration, 0))
+    FROM
+        unnest($1, $2, $3, $4, $5, $6)
+            AS changes(tenant_uuid, carrier_trunk_id, ipbx_id, called_at, duration, sign),
+        unnest(ARRAY['hour', 'day']) AS granularity
+    GROUP BY 1, 2, 3, 4, 5
+    HAVING sum(sign) <> 0 OR sum(sign * COALESCE(duration, 0)) <> 0
+    ORDER BY 1, 2, 3, 4, 5
+    ON CONFLICT (granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id)
+    DO UPDATE SET
+        calls = rollups.calls + EXCLUDED.calls,
+        duration = rollups.duration + EXCLUDED.duration;
+    DELETE FROM cdr_rollups
+    WHERE calls <= 0
+        AND (granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id) IN (
+            SELECT
+                granularity, date_trunc(granularity, called_at), tenant_uuid,
+                COALESCE(carrier_trunk_id, 0), COALESCE(ipbx_id, 0)
+            FROM
+                unnest($1, $2, $3, $4, $6)
+                    AS changes(tenant_uuid, carrier_trunk_id, ipbx_id, called_at, sign),
+                unnest(ARRAY['hour', 'day']) AS granularity
+            WHERE sign < 0
+        );
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION cdr_rollups_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM cdr_rollups_add(
+            array_agg(tenant_uuid), array_agg(carrier_trunk_id), array_agg(ipbx_id),
+            array_agg(COALESCE(call_start, created_at)), array_agg(duration),
+            array_agg(1)
+        ) FROM new_cdrs;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM cdr_rollups_add(
+            array_agg(tenant_uuid), array_agg(carrier_trunk_id), array_agg(ipbx_id),
+            array_agg(COALESCE(call_start, created_at)), array_agg(duration),
+            array_agg(-1)
+        ) FROM old_cdrs;
+    ELSE
+        PERFORM cdr_rollups_add(
+            array_agg(tenant_uuid), array_agg(carrier_trunk_id), array_agg(ipbx_id),
+            array_agg(COALESCE(call_start, created_at)), array_agg(duration),
+            array_agg(sign)
+        ) FROM (
+            SELECT *, -1 AS sign FROM old_cdrs
+            UNION ALL
+            SELECT *, 1 AS sign FROM new_cdrs
+        ) AS changes;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cdr_rollups_insert ON cdrs;
+CREATE TRIGGER cdr_rollups_insert AFTER INSERT ON cdrs
+    REFERENCING NEW TABLE AS new_cdrs
+    FOR EACH STATEMENT EXECUTE PROCEDURE cdr_rollups_update();
+DROP TRIGGER IF EXISTS cdr_rollups_update ON cdrs;
+CREATE TRIGGER cdr_rollups_update AFTER UPDATE ON cdrs
+    REFERENCING OLD TABLE AS old_cdrs NEW TABLE AS new_cdrs
+    FOR EACH STATEMENT EXECUTE PROCEDURE cdr_rollups_update();
+DROP TRIGGER IF EXISTS cdr_rollups_delete ON cdrs;
+CREATE TRIGGER cdr_rollups_delete AFTER DELETE ON cdrs
+    REFERENCING OLD TABLE AS old_cdrs
+    FOR EACH STATEMENT EXECUTE PROCEDURE cdr_rollups_update();
+"""
+
+# the functions and the row trigger of 5c1f7e3a9b2d
+PREVIOUS_CDR_ROLLUP_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION cdr_rollups_add(
+    uuid, integer, integer, timestamp, integer, integer
+) RETURNS void AS $$
+    INSERT INTO cdr_rollups AS rollups (
+        granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id, calls, duration
+    )
+    SELECT
+        granularity, date_trunc(granularity, $4), $1,
+        COALESCE($2, 0), COALESCE($3, 0), $6, $6 * COALESCE($5, 0)
+    FROM unnest(ARRAY['hour', 'day']) AS granularity
+    ON CONFLICT (granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id)
+    DO UPDATE SET
+        calls = rollups.calls + EXCLUDED.calls,
+        duration = rollups.duration + EXCLUDED.duration;
+    DELETE FROM cdr_rollups
+    WHERE $6 < 0 AND calls <= 0
+        AND (granularity, period) IN (
+            ('hour', date_trunc('hour', $4)), ('day', date_trunc('day', $4))
+        )
+        AND tenant_uuid = $1
+        AND carrier_trunk_id = COALESCE($2, 0)
+        AND ipbx_id = COALESCE($3, 0);
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION cdr_rollups_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM cdr_rollups_add(
+            OLD.tenant_uuid, OLD.carrier_trunk_id, OLD.ipbx_id,
+            COALESCE(OLD.call_start, OLD.created_at), OLD.duration, -1
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM cdr_rollups_add(
+            NEW.tenant_uuid, NEW.carrier_trunk_id, NEW.ipbx_id,
+            COALESCE(NEW.call_start, NEW.created_at), NEW.duration, 1
+        );
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cdr_rollups_update ON cdrs;
+CREATE TRIGGER cdr_rollups_update AFTER INSERT OR UPDATE OR DELETE ON cdrs
+    FOR EACH ROW EXECUTE PROCEDURE cdr_rollups_update();
+"""
+
+
+def upgrade():
+    op.execute("DROP TRIGGER IF EXISTS cdr_rollups_update ON cdrs;")
+    op.execute(
+        "DROP FUNCTION IF EXISTS "
+        "cdr_rollups_add(uuid, integer, integer, timestamp, integer, integer);"
+    )
+    op.execute(CDR_ROLLUP_FUNCTIONS)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS cdr_rollups_insert ON cdrs;")
+    op.execute("DROP TRIGGER IF EXISTS cdr_rollups_update ON cdrs;")
+    op.execute("DROP TRIGGER IF EXISTS cdr_rollups_delete ON cdrs;")
+    op.execute(
+        "DROP FUNCTION IF EXISTS "
+        "cdr_rollups_add(uuid[], integer[], integer[], timestamp[], integer[], integer[]);"
+    )
+    op.execute(PREVIOUS_CDR_ROLLUP_FUNCTIONS)
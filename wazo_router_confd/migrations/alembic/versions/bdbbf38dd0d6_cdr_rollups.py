@@ -0,0 +1,100 @@
+"""roll up the cdrs by hour and day
+
+Revision ID: bdbbf38dd0d6
+Revises: 8e691b2f1b2d
+Create Date: 2019-12-23 09:41:12.604512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_utils.types.uuid import UUIDType
+
+
+# revision identifiers, used by Alembic.
+revision = 'bdbbf38dd0d6'
+down_revision = '8e691b2f1b2d'
+branch_labels = None
+depends_on = None
+
+# the rollups of the existing cdrs
+CDR_ROLLUP_BACKFILL = """
+INSERT INTO cdr_rollups (
+    granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id, calls, duration
+)
+SELECT
+    granularity, date_trunc(granularity, COALESCE(call_start, created_at)),
+    tenant_uuid, COALESCE(carrier_trunk_id, 0), COALESCE(ipbx_id, 0),
+    count(*), COALESCE(sum(duration), 0)
+FROM cdrs, unnest(ARRAY['hour', 'day']) AS granularity
+GROUP BY 1, 2, 3, 4, 5;
+"""
+
+# the functions and the trigger of this revision, frozen
+CDR_ROLLUP_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION cdr_rollups_add(
+    uuid, integer, integer, timestamp, integer, integer
+) RETURNS void AS $$
+    INSERT INTO cdr_rollups AS rollups (
+        granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id, calls, duration
+    )
+    SELECT
+        granularity, date_trunc(granularity, $4), $1,
+        COALESCE($2, 0), COALESCE($3, 0), $6, $6 * COALESCE($5, 0)
+    FROM unnest(ARRAY['hour', 'day']) AS granularity
+    ON CONFLICT (granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id)
+    DO UPDATE SET
+        calls = rollups.calls + EXCLUDED.calls,
+        duration = rollups.duration + EXCLUDED.duration;
+    DELETE FROM cdr_rollups WHERE tenant_uuid = $1 AND calls <= 0;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION cdr_rollups_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM cdr_rollups_add(
+            OLD.tenant_uuid, OLD.carrier_trunk_id, OLD.ipbx_id,
+            COALESCE(OLD.call_start, OLD.created_at), OLD.duration, -1
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM cdr_rollups_add(
+            NEW.tenant_uuid, NEW.carrier_trunk_id, NEW.ipbx_id,
+            COALESCE(NEW.call_start, NEW.created_at), NEW.duration, 1
+        );
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cdr_rollups_update ON cdrs;
+CREATE TRIGGER cdr_rollups_update AFTER INSERT OR UPDATE OR DELETE ON cdrs
+    FOR EACH ROW EXECUTE PROCEDURE cdr_rollups_update();
+"""
+
+
+def upgrade():
+    op.create_table(
+        'cdr_rollups',
+        sa.Column('granularity', sa.String(length=8), nullable=False),
+        sa.Column('period', sa.DateTime(), nullable=False),
+        sa.Column('tenant_uuid', UUIDType(), nullable=False),
+        sa.Column('carrier_trunk_id', sa.Integer(), nullable=False),
+        sa.Column('ipbx_id', sa.Integer(), nullable=False),
+        sa.Column('calls', sa.Integer(), nullable=False),
+        sa.Column('duration', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint(
+            'granularity', 'period', 'tenant_uuid', 'carrier_trunk_id', 'ipbx_id'
+        ),
+    )
+    op.execute(CDR_ROLLUP_BACKFILL)
+    op.execute(CDR_ROLLUP_FUNCTIONS)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS cdr_rollups_update ON cdrs;")
+    op.execute("DROP FUNCTION IF EXISTS cdr_rollups_update();")
+    op.execute(
+        "DROP FUNCTION IF EXISTS "
+        "cdr_rollups_add(uuid, integer, integer, timestamp, integer, integer);"
+    )
+    op.drop_table('cdr_rollups')
@@ -1,9 +1,20 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from datetime import datetime
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, DateTime, Integer, String, ForeignKey
+from sqlalchemy import (
+    DDL,
+    Column,
+    DateTime,
+    Integer,
+    String,
+    ForeignKey,
+    Index,
+    event,
+    func,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy_utils import UUIDType
 
@@ -17,9 +28,20 @@ if TYPE_CHECKING:  # pragma: no cover
 
 class CDR(Base):
     __tablename__ = "cdrs"
-    __table_args__ = ()
+    # partitioned by insert time, see wazo_router_confd.cdr_partitions
+    __table_args__ = (
+        Index('ix_cdrs_tenant_uuid_call_start', 'tenant_uuid', 'call_start'),
+        Index('ix_cdrs_created_at', 'created_at', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    created_at = Column(
+        DateTime,
+        primary_key=True,
+        default=datetime.utcnow,
+        server_default=func.timezone('UTC', func.now()),
+    )
     tenant_uuid = Column(  # type: ignore
         UUIDType(), ForeignKey('tenants.uuid', ondelete='CASCADE'), nullable=False
     )
@@ -37,3 +59,13 @@ class CDR(Base):
     call_id = Column(String(256), nullable=False)
     call_start = Column(DateTime, nullable=True)
     duration = Column(Integer, nullable=True)
+
+
+# rows outside of the monthly partitions are stored in the default partition
+event.listen(
+    CDR.__table__,
+    'after_create',
+    DDL(
+        "CREATE TABLE IF NOT EXISTS cdrs_default PARTITION OF cdrs DEFAULT;"
+    ).execute_if(dialect='postgresql'),
+)
@@ -0,0 +1,120 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from sqlalchemy import DDL, BigInteger, Column, DateTime, Integer, String, event
+from sqlalchemy_utils import UUIDType
+
+from .base import Base
+
+CDR_ROLLUP_GRANULARITIES = ('hour', 'day')
+
+# the rollups are updated by triggers on the cdrs, for every insertion path,
+# and are kept when the partitions of the cdrs expire. The triggers run once
+# per statement: the changes of a batch of cdrs, from the transition tables,
+# are aggregated by rollup and applied in the order of the primary key, so
+# that concurrent batches lock the rollups in the same order. A decrement
+# deletes the rollups it emptied, by primary key.
+CDR_ROLLUP_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION cdr_rollups_add(
+    uuid[], integer[], integer[], timestamp[], integer[], integer[]
+) RETURNS void AS $$
+    INSERT INTO cdr_rollups AS rollups (
+        granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id, calls, duration
+    )
+    SELECT
+        granularity, date_trunc(granularity, called_at) AS period, tenant_uuid,
+        COALESCE(carrier_trunk_id, 0) AS carrier_trunk_id,
+        COALESCE(ipbx_id, 0) AS ipbx_id,
+        sum(sign), sum(sign * COALESCE(duration, 0))
+    FROM
+        unnest($1, $2, $3, $4, $5, $6)
+            AS changes(tenant_uuid, carrier_trunk_id, ipbx_id, called_at, duration, sign),
+        unnest(ARRAY['hour', 'day']) AS granularity
+    GROUP BY 1, 2, 3, 4, 5
+    HAVING sum(sign) <> 0 OR sum(sign * COALESCE(duration, 0)) <> 0
+    ORDER BY 1, 2, 3, 4, 5
+    ON CONFLICT (granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id)
+    DO UPDATE SET
+        calls = rollups.calls + EXCLUDED.calls,
+        duration = rollups.duration + EXCLUDED.duration;
+    DELETE FROM cdr_rollups
+    WHERE calls <= 0
+        AND (granularity, period, tenant_uuid, carrier_trunk_id, ipbx_id) IN (
+            SELECT
+                granularity, date_trunc(granularity, called_at), tenant_uuid,
+                COALESCE(carrier_trunk_id, 0), COALESCE(ipbx_id, 0)
+            FROM
+                unnest($1, $2, $3, $4, $6)
+                    AS changes(tenant_uuid, carrier_trunk_id, ipbx_id, called_at, sign),
+                unnest(ARRAY['hour', 'day']) AS granularity
+            WHERE sign < 0
+        );
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION cdr_rollups_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM cdr_rollups_add(
+            array_agg(tenant_uuid), array_agg(carrier_trunk_id), array_agg(ipbx_id),
+            array_agg(COALESCE(call_start, created_at)), array_agg(duration),
+            array_agg(1)
+        ) FROM new_cdrs;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM cdr_rollups_add(
+            array_agg(tenant_uuid), array_agg(carrier_trunk_id), array_agg(ipbx_id),
+            array_agg(COALESCE(call_start, created_at)), array_agg(duration),
+            array_agg(-1)
+        ) FROM old_cdrs;
+    ELSE
+        PERFORM cdr_rollups_add(
+            array_agg(tenant_uuid), array_agg(carrier_trunk_id), array_agg(ipbx_id),
+            array_agg(COALESCE(call_start, created_at)), array_agg(duration),
+            array_agg(sign)
+        ) FROM (
+            SELECT *, -1 AS sign FROM old_cdrs
+            UNION ALL
+            SELECT *, 1 AS sign FROM new_cdrs
+        ) AS changes;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cdr_rollups_insert ON cdrs;
+CREATE TRIGGER cdr_rollups_insert AFTER INSERT ON cdrs
+    REFERENCING NEW TABLE AS new_cdrs
+    FOR EACH STATEMENT EXECUTE PROCEDURE cdr_rollups_update();
+DROP TRIGGER IF EXISTS cdr_rollups_update ON cdrs;
+CREATE TRIGGER cdr_rollups_update AFTER UPDATE ON cdrs
+    REFERENCING OLD TABLE AS old_cdrs NEW TABLE AS new_cdrs
+    FOR EACH STATEMENT EXECUTE PROCEDURE cdr_rollups_update();
+DROP TRIGGER IF EXISTS cdr_rollups_delete ON cdrs;
+CREATE TRIGGER cdr_rollups_delete AFTER DELETE ON cdrs
+    REFERENCING OLD TABLE AS old_cdrs
+    FOR EACH STATEMENT EXECUTE PROCEDURE cdr_rollups_update();
+"""
+
+
+class CDRRollup(Base):
+    """
+    Number and total duration of the cdrs by hour or day, tenant, carrier
+    trunk and ipbx, where 0 stands for no carrier trunk or ipbx.
+    """
+
+    __tablename__ = "cdr_rollups"
+
+    granularity = Column(String(8), primary_key=True)
+    period = Column(DateTime, primary_key=True)
+    tenant_uuid = Column(UUIDType(), primary_key=True)
+    carrier_trunk_id = Column(Integer, primary_key=True, default=0)
+    ipbx_id = Column(Integer, primary_key=True, default=0)
+    calls = Column(Integer, nullable=False, default=0)
+    duration = Column(BigInteger, nullable=False, default=0)
+
+
+# once both the cdrs and their rollups exist
+event.listen(
+    Base.metadata,
+    'after_create',
+    DDL(CDR_ROLLUP_FUNCTIONS).execute_if(dialect='postgresql'),
+)
@@ -1,71 +1,635 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import asyncio
+import logging
+import os
+
 import aioredis  # type: ignore
 
+from collections import OrderedDict
 from json import loads, dumps
-from typing import Optional
+from time import monotonic, time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 from fastapi import FastAPI
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from wazo_router_confd.cache import pop_cache_tags
+from wazo_router_confd.metrics import (
+    CACHE_INVALIDATIONS,
+    CACHE_REQUESTS,
+    REDIS_COMMAND_DURATION,
+)
+from wazo_router_confd.tracing import span
+
+
+# time to live in seconds of the cached values, 0 to never expire
+REDIS_CACHE_TTL = 3600
+# time to live in seconds of the cached failed lookups, 0 to use the above
+REDIS_NEGATIVE_CACHE_TTL = 5
+
+
+# maximum number of values and time to live in seconds of the in-process cache
+LOCAL_CACHE_SIZE = 4096
+LOCAL_CACHE_TTL = 10
+# channel used to evict the values cached by every instance
+INVALIDATION_CHANNEL = 'wazo_router_confd:cache_invalidation'
+# delays in seconds between two subscriptions to the channel once closed
+SUBSCRIBE_RETRY_DELAY = 0.5
+SUBSCRIBE_MAX_RETRY_DELAY = 30
+# time in milliseconds an instance holds the lock on the keys it computes,
+# 0 disables the lock, and interval in seconds the other instances poll at
+REDIS_LOCK_TIMEOUT = 0
+REDIS_LOCK_POLL_INTERVAL = 0.02
+# maximum number of keys evicted by one command and one invalidation message
+INVALIDATION_CHUNK_SIZE = 1000
+# counter of the tag invalidations, and key of the value of the counter at
+# the last invalidation of a tag
+CACHE_GENERATION_KEY = 'wazo_router_confd:cache_generation'
+# key of the secret of the keyed hashes in the cache keys, generated by the
+# first instance and used by every instance sharing the Redis database
+CACHE_KEY_SECRET_KEY = 'wazo_router_confd:cache_key_secret'
+
+# release a lock only if still held with the same token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# count an invalidation and mark the invalidated tags with its generation
+INVALIDATE_GENERATION_SCRIPT = """
+local generation = redis.call('incr', KEYS[1])
+for i = 2, #KEYS do
+    if tonumber(ARGV[1]) > 0 then
+        redis.call('set', KEYS[i], generation, 'EX', ARGV[1])
+    else
+        redis.call('set', KEYS[i], generation)
+    end
+end
+return generation
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_tag_key(tag: str) -> str:
+    # sorted set of the keys, scored by their expiration time
+    return 'cache_tag_keys:%s' % tag
+
+
+def get_tag_generation_key(tag: str) -> str:
+    return 'cache_tag_generation:%s' % tag
+
+
+def get_lock_key(key: str) -> str:
+    return 'cache_lock:%s' % key
+
+
+class LocalCache(object):
+    """
+    Bounded least recently used cache of the decoded values, in front of
+    Redis. The values are shared and must not be modified by the callers.
+    """
+
+    maxsize: int
+    ttl: float
+    name: str
+    values: 'OrderedDict[str, Tuple[float, Any]]'
+
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL, name='local'):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.values = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self.values.get(key)
+        if item is None:
+            CACHE_REQUESTS.inc(cache=self.name, result='miss')
+            return None
+        expires_at, value = item
+        if expires_at < monotonic():
+            CACHE_REQUESTS.inc(cache=self.name, result='stale')
+            del self.values[key]
+            return None
+        CACHE_REQUESTS.inc(cache=self.name, result='hit')
+        self.values.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        ttl = min(ttl, self.ttl) if ttl else self.ttl
+        self.values[key] = (monotonic() + ttl, value)
+        self.values.move_to_end(key)
+        while len(self.values) > self.maxsize:
+            self.values.popitem(last=False)
+
+    def delete(self, keys: Iterable[str]):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def clear(self):
+        self.values.clear()
+
+
+class SingleFlight(object):
+    """
+    Coalesce the concurrent computations of the same keys in this process:
+    a key is computed by at most one task at once, the callers of the keys
+    in flight wait for its result.
+    """
+
+    tasks: Dict[str, asyncio.Future]
+
+    def __init__(self):
+        self.tasks = {}
+
+    def _forget(self, keys: List[str], task: asyncio.Future):
+        for key in keys:
+            if self.tasks.get(key) is task:
+                del self.tasks[key]
+
+    async def run(
+        self,
+        keys: List[str],
+        callback: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        tasks = {key: self.tasks.get(key) for key in keys}
+        missing_keys = [key for key, task in tasks.items() if task is None]
+        if missing_keys:
+            # the computation outlives the cancellation of the caller, the
+            # other callers may be waiting for it
+            task = asyncio.ensure_future(callback(missing_keys))
+            for key in missing_keys:
+                self.tasks[key] = tasks[key] = task
+            task.add_done_callback(lambda task: self._forget(missing_keys, task))
+        values = {}
+        for key, task in tasks.items():
+            values[key] = (await asyncio.shield(task)).get(key)
+        return values
 
 
 class Redis(object):
     uri: str
     flush_on_connect: bool
+    ttl: int
+    negative_ttl: int
+    local_cache: LocalCache
+    lock_timeout: int
+    cache_key_secret: bytes
+    shared_cache_key_secret: bool
+    single_flight: SingleFlight
     pool: aioredis.ConnectionsPool
+    subscriber: Optional[aioredis.Redis]
+    subscriber_task: Optional[asyncio.Task]
+    invalidation_waiters: Set[asyncio.Future]
+    invalidation_listeners: List[Callable[[Optional[List[str]]], None]]
 
-    def __init__(self, uri, flush_on_connect=False):
+    def __init__(
+        self,
+        uri,
+        flush_on_connect=False,
+        ttl=REDIS_CACHE_TTL,
+        negative_ttl=REDIS_NEGATIVE_CACHE_TTL,
+        local_cache_size=LOCAL_CACHE_SIZE,
+        local_cache_ttl=LOCAL_CACHE_TTL,
+        lock_timeout=REDIS_LOCK_TIMEOUT,
+        cache_key_secret=None,
+    ):
         self.uri = uri
         self.flush_on_connect = flush_on_connect
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.local_cache = LocalCache(local_cache_size, local_cache_ttl)
+        self.lock_timeout = lock_timeout
+        # replaced by the secret shared through Redis once connected
+        self.cache_key_secret = cache_key_secret or os.urandom(32)
+        self.shared_cache_key_secret = cache_key_secret is None
+        self.single_flight = SingleFlight()
+        self.subscriber = None
+        self.subscriber_task = None
+        self.invalidation_waiters = set()
+        self.invalidation_listeners = []
 
     async def connect(self):
         self.pool = await aioredis.create_redis_pool(self.uri)
+        if self.shared_cache_key_secret:
+            await self.pool.set(
+                CACHE_KEY_SECRET_KEY,
+                self.cache_key_secret,
+                exist=self.pool.SET_IF_NOT_EXIST,
+            )
+            self.cache_key_secret = await self.pool.get(CACHE_KEY_SECRET_KEY)
         if self.flush_on_connect:
             await self.flushdb()
+        if self.local_cache.maxsize > 0 or self.invalidation_listeners:
+            channel = await self._create_subscriber()
+            self.subscriber_task = asyncio.ensure_future(self._resubscribe(channel))
 
     def disconnect(self):
+        if self.subscriber_task is not None:
+            self.subscriber_task.cancel()
+        if self.subscriber is not None:
+            self.subscriber.close()
         self.pool.close()
 
+    async def _create_subscriber(self) -> aioredis.Channel:
+        self.subscriber = await aioredis.create_redis(self.uri)
+        (channel,) = await self.subscriber.subscribe(INVALIDATION_CHANNEL)
+        return channel
+
+    async def _resubscribe(self, channel: Optional[aioredis.Channel]):
+        # subscribe again with a backoff once the channel is closed, the
+        # invalidations published meanwhile are missed and handled as a flush
+        delay = SUBSCRIBE_RETRY_DELAY
+        while True:
+            if channel is not None:
+                try:
+                    await self._subscribe(channel)
+                    logger.warning("cache invalidation channel closed")
+                except (aioredis.RedisError, OSError) as e:
+                    logger.warning("cache invalidation channel failed: %s", e)
+                if self.subscriber is not None:
+                    self.subscriber.close()
+                    self.subscriber = None
+            await asyncio.sleep(delay)
+            try:
+                channel = await self._create_subscriber()
+            except (aioredis.RedisError, OSError) as e:
+                logger.warning(
+                    "fail to subscribe to the cache invalidations, retry in %s s: %s",
+                    delay,
+                    e,
+                )
+                channel = None
+                delay = min(delay * 2, SUBSCRIBE_MAX_RETRY_DELAY)
+                continue
+            logger.info("subscribed again to the cache invalidations")
+            delay = SUBSCRIBE_RETRY_DELAY
+            self._invalidate(dict(flush=True))
+
+    async def _subscribe(self, channel: aioredis.Channel):
+        # evict the values invalidated by any instance, this one included
+        while await channel.wait_message():
+            try:
+                message = await channel.get_json()
+            except ValueError as e:
+                logger.warning("invalid cache invalidation message: %s", e)
+                continue
+            self._invalidate(message)
+
+    def _invalidate(self, message: Dict[str, Any]):
+        if message.get('flush'):
+            self.local_cache.clear()
+            tags = None
+        else:
+            self.local_cache.delete(message.get('keys') or [])
+            tags = message.get('tags')
+        if message.get('flush') or tags:
+            for listener in self.invalidation_listeners:
+                listener(tags)
+        for waiter in list(self.invalidation_waiters):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def add_invalidation_listener(
+        self, listener: Callable[[Optional[List[str]]], None]
+    ):
+        """
+        Call the listener with the tags invalidated by any instance, this
+        one included, or with None once the cache is flushed.
+        """
+        self.invalidation_listeners.append(listener)
+
+    async def wait_invalidation(self, timeout: float):
+        """
+        Wait for the next invalidation published by any instance, at most
+        the timeout, which is always waited without a subscriber.
+        """
+        waiter = asyncio.get_event_loop().create_future()
+        self.invalidation_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.invalidation_waiters.discard(waiter)
+
+    async def publish_invalidation(
+        self, keys: Optional[List[str]] = None, tags: Optional[List[str]] = None
+    ):
+        message: Dict[str, Any] = dict(flush=True)
+        if keys is not None or tags is not None:
+            message = dict(keys=keys or [])
+            if tags:
+                message['tags'] = tags
+        with REDIS_COMMAND_DURATION.time(command='publish'), span('redis.publish'):
+            await self.pool.publish_json(INVALIDATION_CHANNEL, message)
+
     async def get_value(self, key: str) -> Optional[dict]:
-        value = await self.pool.get(key)
-        return loads(value) if value is not None else None
+        value = self.local_cache.get(key)
+        if value is None:
+            with REDIS_COMMAND_DURATION.time(command='get'), span('redis.get'):
+                data = await self.pool.get(key)
+            value = loads(data) if data is not None else None
+            if value is not None:
+                self.local_cache.set(key, value)
+        return value
+
+    async def set_value(
+        self, key: str, value: dict, tags: Iterable[str] = (), negative: bool = False
+    ):
+        await self.set_values({key: value}, {key: tags}, [key] if negative else [])
+
+    async def get_values(self, keys: List[str]) -> List[Optional[dict]]:
+        values = {key: self.local_cache.get(key) for key in keys}
+        missing_keys = [key for key, value in values.items() if value is None]
+        if missing_keys:
+            with REDIS_COMMAND_DURATION.time(command='mget'), span('redis.mget'):
+                results = await self.pool.mget(*missing_keys)
+            for key, data in zip(missing_keys, results):
+                if data is not None:
+                    values[key] = loads(data)
+                    self.local_cache.set(key, values[key])
+        return [values[key] for key in keys]
+
+    async def set_values(
+        self,
+        values: Dict[str, dict],
+        tags: Optional[Dict[str, Iterable[str]]] = None,
+        negative_keys: Iterable[str] = (),
+        generation: Optional[int] = None,
+    ):
+        """
+        Cache the values along with their tags. With the generation read
+        before computing the values, the values whose tags were invalidated
+        since are evicted once stored, they may be stale.
+        """
+        if not values:
+            return
+        negative_keys = set(negative_keys)
+        now = time()
+        expires_at: Dict[str, float] = {}
+        pipeline = self.pool.pipeline()
+        for key, value in values.items():
+            ttl = self.ttl
+            if key in negative_keys and self.negative_ttl:
+                ttl = self.negative_ttl
+            expires_at[key] = now + ttl if ttl else float('inf')
+            data = dumps(value, default=str)
+            pipeline.set(key, data, expire=ttl)
+            # cache what a read from Redis would return
+            self.local_cache.set(key, loads(data), ttl)
+        # index the keys by tag, to evict them when the tagged entities change
+        keys_by_tag: Dict[str, Set[str]] = {}
+        for key, key_tags in (tags or {}).items():
+            if key not in expires_at:
+                continue
+            for tag in key_tags:
+                keys_by_tag.setdefault(tag, set()).add(key)
+        for tag, keys in keys_by_tag.items():
+            tag_key = get_tag_key(tag)
+            pairs: List[Any] = []
+            for key in keys:
+                pairs.extend([expires_at[key], key])
+            pipeline.zadd(tag_key, *pairs)
+            # forget the keys expired since, a tag only indexes live keys
+            pipeline.zremrangebyscore(tag_key, max=now)
+            # a tag outlives the keys it was last added to
+            if self.ttl:
+                pipeline.expire(tag_key, max(self.ttl, self.negative_ttl))
+        # read the generations once the keys are tagged: an invalidation
+        # either sees the keys in the tags or is seen here
+        tag_list = sorted(keys_by_tag)
+        if generation is not None and tag_list:
+            pipeline.mget(*[get_tag_generation_key(tag) for tag in tag_list])
+        with REDIS_COMMAND_DURATION.time(command='pipeline'), span('redis.pipeline'):
+            results = await pipeline.execute()
+        if generation is not None and tag_list:
+            stale_keys: Set[str] = set()
+            for tag, tag_generation in zip(tag_list, results[-1]):
+                if tag_generation is not None and int(tag_generation) > generation:
+                    stale_keys.update(keys_by_tag[tag])
+            if stale_keys:
+                CACHE_INVALIDATIONS.inc(kind='stale')
+                with REDIS_COMMAND_DURATION.time(command='del'), span('redis.del'):
+                    await self.pool.delete(*sorted(stale_keys))
+                self.local_cache.delete(stale_keys)
 
-    async def set_value(self, key: str, value: dict):
-        await self.pool.set(key, dumps(value, default=str))
+    async def get_generation(self) -> int:
+        with REDIS_COMMAND_DURATION.time(command='get'), span('redis.get'):
+            generation = await self.pool.get(CACHE_GENERATION_KEY)
+        return int(generation) if generation is not None else 0
+
+    async def acquire_locks(self, keys: List[str]) -> Tuple[List[str], bytes]:
+        token = os.urandom(16)
+        if not self.lock_timeout:
+            return keys, token
+        pipeline = self.pool.pipeline()
+        for key in keys:
+            pipeline.set(
+                get_lock_key(key),
+                token,
+                pexpire=self.lock_timeout,
+                exist=self.pool.SET_IF_NOT_EXIST,
+            )
+        with REDIS_COMMAND_DURATION.time(command='pipeline'), span('redis.pipeline'):
+            results = await pipeline.execute()
+        return [key for key, result in zip(keys, results) if result], token
+
+    async def release_locks(self, keys: List[str], token: bytes):
+        if not self.lock_timeout or not keys:
+            return
+        pipeline = self.pool.pipeline()
+        for key in keys:
+            pipeline.eval(RELEASE_LOCK_SCRIPT, keys=[get_lock_key(key)], args=[token])
+        with REDIS_COMMAND_DURATION.time(command='pipeline'), span('redis.pipeline'):
+            await pipeline.execute()
+
+    async def wait_values(self, keys: List[str]) -> Dict[str, dict]:
+        # wait for the values computed by the instances holding the locks
+        values: Dict[str, dict] = {}
+        deadline = monotonic() + self.lock_timeout / 1000
+        while keys and monotonic() < deadline:
+            await asyncio.sleep(REDIS_LOCK_POLL_INTERVAL)
+            for key, value in zip(keys, await self.get_values(keys)):
+                if value is not None:
+                    values[key] = value
+            keys = [key for key in keys if key not in values]
+        return values
+
+    async def get_or_set_values(
+        self,
+        keys: List[str],
+        callback: Callable[[List[str]], Awaitable[Dict[str, Tuple[dict, Set[str]]]]],
+        is_negative: Callable[[dict], bool] = lambda value: False,
+    ) -> Dict[str, dict]:
+        """
+        Return the cached values of the keys, computing the missing ones
+        with the callback, which returns their values along with their tags.
+        A missing key is computed once, even if requested concurrently.
+        """
+        keys = list(dict.fromkeys(keys))
+        values = dict(zip(keys, await self.get_values(keys)))
+        missing_keys = [key for key, value in values.items() if value is None]
+        for key in keys:
+            CACHE_REQUESTS.inc(
+                cache=key.partition(':')[0],
+                result='miss' if values[key] is None else 'hit',
+            )
+        if missing_keys:
+            values.update(
+                await self.single_flight.run(
+                    missing_keys,
+                    lambda keys: self._compute(keys, callback, is_negative),
+                )
+            )
+        return values
+
+    async def _compute(
+        self,
+        keys: List[str],
+        callback: Callable[[List[str]], Awaitable[Dict[str, Tuple[dict, Set[str]]]]],
+        is_negative: Callable[[dict], bool],
+    ) -> Dict[str, dict]:
+        locked_keys, token = await self.acquire_locks(keys)
+        try:
+            values = await self.wait_values(
+                [key for key in keys if key not in locked_keys]
+            )
+            # compute the keys locked by this instance, and by the instances
+            # which did not compute them in time
+            missing_keys = [key for key in keys if key not in values]
+            if missing_keys:
+                generation = await self.get_generation()
+                results = await callback(missing_keys)
+                missing_values = {key: value for key, (value, _) in results.items()}
+                await self.set_values(
+                    missing_values,
+                    {key: tags for key, (_, tags) in results.items()},
+                    [
+                        key
+                        for key, value in missing_values.items()
+                        if is_negative(value)
+                    ],
+                    generation,
+                )
+                values.update(missing_values)
+        finally:
+            await self.release_locks(locked_keys, token)
+        return values
+
+    async def invalidate_tags(self, tags: Iterable[str]):
+        tag_list = sorted(tags)
+        tag_keys = [get_tag_key(tag) for tag in tag_list]
+        if not tag_keys:
+            return
+        CACHE_INVALIDATIONS.inc(kind='tags')
+        # read the live keys and drop the tags atomically, a key tagged
+        # afterwards is indexed by a new tag and evicted by its writer
+        transaction = self.pool.multi_exec()
+        now = time()
+        transaction.eval(
+            INVALIDATE_GENERATION_SCRIPT,
+            keys=[CACHE_GENERATION_KEY]
+            + [get_tag_generation_key(tag) for tag in tag_list],
+            args=[max(self.ttl, self.negative_ttl) if self.ttl else 0],
+        )
+        for tag_key in tag_keys:
+            transaction.zrangebyscore(tag_key, min=now)
+        transaction.delete(*tag_keys)
+        with REDIS_COMMAND_DURATION.time(command='multi'), span('redis.multi'):
+            results = await transaction.execute()
+        keys = list(
+            dict.fromkeys(key.decode() for members in results[1:-1] for key in members)
+        )
+        # evict in chunks, to bound the size of the commands and of the
+        # messages, the first message also carries the tags for the listeners
+        for start in range(0, max(len(keys), 1), INVALIDATION_CHUNK_SIZE):
+            end = start + INVALIDATION_CHUNK_SIZE
+            chunk = keys[start:end]
+            if chunk:
+                with REDIS_COMMAND_DURATION.time(command='del'), span('redis.del'):
+                    await self.pool.delete(*chunk)
+                self.local_cache.delete(chunk)
+            await self.publish_invalidation(chunk, tag_list if start == 0 else None)
 
     async def flushdb(self):
-        await self.pool.flushdb()
+        CACHE_INVALIDATIONS.inc(kind='flushdb')
+        with REDIS_COMMAND_DURATION.time(command='flushdb'), span('redis.flushdb'):
+            await self.pool.flushdb()
+            # the cache keys of the other instances are still hashed with it
+            if self.shared_cache_key_secret:
+                await self.pool.set(
+                    CACHE_KEY_SECRET_KEY,
+                    self.cache_key_secret,
+                    exist=self.pool.SET_IF_NOT_EXIST,
+                )
+        self.local_cache.clear()
+        await self.publish_invalidation()
 
 
 def get_redis(request: Request) -> Redis:
-    return request.state.redis
+    return getattr(request.app, 'redis')
+
+
+class CacheInvalidationMiddleware(object):
+    """
+    Evict the cached answers depending on what the request committed, before
+    its response is sent.
+    """
+
+    def __init__(self, app: ASGIApp, redis: Redis):
+        self.app = app
+        self.redis = redis
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message):
+            if message['type'] == 'http.response.start':
+                db = scope.get('state', {}).get('db')
+                if db is not None:
+                    tags = pop_cache_tags(db)
+                    if tags:
+                        await self.redis.invalidate_tags(tags)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
 
 
 def setup_redis(app: FastAPI, config: dict):
     redis_uri = config['redis_uri']
     redis = Redis(
-        redis_uri, flush_on_connect=bool(config.get('redis_flush_on_connect'))
+        redis_uri,
+        flush_on_connect=bool(config.get('redis_flush_on_connect')),
+        ttl=int(config.get('redis_cache_ttl', REDIS_CACHE_TTL) or 0),
+        negative_ttl=int(
+            config.get('redis_negative_cache_ttl', REDIS_NEGATIVE_CACHE_TTL) or 0
+        ),
+        local_cache_size=int(
+            config.get('redis_local_cache_size', LOCAL_CACHE_SIZE) or 0
+        ),
+        local_cache_ttl=int(config.get('redis_local_cache_ttl', LOCAL_CACHE_TTL) or 0),
+        lock_timeout=int(config.get('redis_lock_timeout', REDIS_LOCK_TIMEOUT) or 0),
+        cache_key_secret=(
+            config['redis_cache_key_secret'].encode('utf-8')
+            if config.get('redis_cache_key_secret')
+            else None
+        ),
     )
     setattr(app, 'redis', redis)
 
     app.add_event_handler("startup", redis.connect)
     app.add_event_handler("shutdown", redis.disconnect)
 
-    # pylint: disable= unused-variable
-    @app.middleware("http")
-    async def db_aioredis_database_middleware(request: Request, call_next):
-        response = Response("Internal server error", status_code=500)
-        request.state.redis = redis
-        response = await call_next(request)
-        if (
-            request.method not in ('HEAD', 'GET')
-            and not request.url.path.startswith('/kamailio')
-            and response.status_code >= 200
-            and response.status_code < 300
-        ):
-            await redis.flushdb()
-        return response
+    app.add_middleware(CacheInvalidationMiddleware, redis=redis)
 
     return app
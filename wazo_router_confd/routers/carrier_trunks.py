@@ -1,13 +1,17 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
 from time import time
+from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
+from wazo_router_confd.schemas import bulk as bulk_schema
 from wazo_router_confd.schemas import carrier_trunk as schema
 from wazo_router_confd.services import carrier_trunk as service
 
@@ -46,15 +50,25 @@ def create_carrier_trunk(
     return service.create_carrier_trunk(db, principal, carrier_trunk=carrier_trunk)
 
 
+@router.post("/carrier_trunks/bulk", response_model=bulk_schema.BulkResult)
+def bulk_carrier_trunks(
+    operations: List[bulk_schema.BulkOperation],
+    db: Session = Depends(get_db),
+    principal: Principal = Depends(get_principal),
+):
+    return service.bulk_carrier_trunks(db, principal, operations=operations)
+
+
 @router.get("/carrier_trunks", response_model=schema.CarrierTrunkList)
-def read_carrier_trunks(
+async def read_carrier_trunks(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    carrier_trunks = service.get_carrier_trunks(
-        db, principal, offset=offset, limit=limit
+    carrier_trunks = await service.fetch_carrier_trunks(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
     )
     return carrier_trunks
 
@@ -62,13 +76,13 @@ def read_carrier_trunks(
 @router.get(
     "/carrier_trunks/{carrier_trunk_id}", response_model=schema.CarrierTrunkRead
 )
-def read_carrier_trunk(
+async def read_carrier_trunk(
     carrier_trunk_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_carrier_trunk = service.get_carrier_trunk(
-        db, principal, carrier_trunk_id=carrier_trunk_id
+    db_carrier_trunk = await service.fetch_carrier_trunk(
+        pool, principal, carrier_trunk_id=carrier_trunk_id
     )
     if db_carrier_trunk is None:
         raise HTTPException(status_code=404, detail="Carrier Trunk not found")
@@ -1,13 +1,15 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
 from time import time
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
 from wazo_router_confd.schemas import carrier as schema
 from wazo_router_confd.services import carrier as service
 
@@ -45,23 +47,26 @@ def create_carrier(
 
 
 @router.get("/carriers", response_model=schema.CarrierList)
-def read_carriers(
+async def read_carriers(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    carriers = service.get_carriers(db, principal, offset=offset, limit=limit)
+    carriers = await service.fetch_carriers(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
+    )
     return carriers
 
 
 @router.get("/carriers/{carrier_id}", response_model=schema.Carrier)
-def read_carrier(
+async def read_carrier(
     carrier_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_carrier = service.get_carrier(db, principal, carrier_id=carrier_id)
+    db_carrier = await service.fetch_carrier(pool, principal, carrier_id=carrier_id)
     if db_carrier is None:
         raise HTTPException(status_code=404, detail="Carrier not found")
     return db_carrier
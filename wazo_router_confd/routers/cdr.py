@@ -1,11 +1,22 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
+from datetime import datetime
+
 from fastapi import APIRouter, Depends, HTTPException
+from pydantic import UUID4
 from sqlalchemy.orm import Session
+from starlette.responses import StreamingResponse
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import (
+    get_aiopg_export_pool,
+    get_aiopg_pool,
+    get_db,
+)
+from wazo_router_confd.models.cdr_rollup import CDR_ROLLUP_GRANULARITIES
 from wazo_router_confd.schemas import cdr as schema
 from wazo_router_confd.services import cdr as service
 
@@ -23,23 +34,77 @@ def create_cdr(
 
 
 @router.get("/cdrs", response_model=schema.CDRList)
-def read_cdrs(
+async def read_cdrs(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    cdrs = service.get_cdrs(db, principal, offset=offset, limit=limit)
+    cdrs = await service.fetch_cdrs(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
+    )
     return cdrs
 
 
+@router.get("/cdrs/stats", response_model=schema.CDRStatsList)
+async def read_cdr_stats(
+    granularity: str = 'hour',
+    group_by: str = 'tenant',
+    tenant_uuid: UUID4 = None,
+    start: datetime = None,
+    end: datetime = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
+    principal: Principal = Depends(get_principal),
+):
+    if granularity not in CDR_ROLLUP_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Unsupported granularity")
+    if group_by not in service.CDR_STATS_GROUP_BY:
+        raise HTTPException(status_code=400, detail="Unsupported grouping")
+    return await service.fetch_cdr_stats(
+        pool,
+        principal,
+        granularity=granularity,
+        group_by=group_by,
+        tenant_uuid=tenant_uuid,
+        start=start,
+        end=end,
+    )
+
+
+@router.get("/cdrs/export")
+async def export_cdrs(
+    format: str = 'ndjson',
+    tenant_uuid: UUID4 = None,
+    start: datetime = None,
+    end: datetime = None,
+    after_id: int = 0,
+    pool: aiopg.Pool = Depends(get_aiopg_export_pool),
+    principal: Principal = Depends(get_principal),
+):
+    if format not in service.CDR_EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+    return StreamingResponse(
+        service.export_cdrs(
+            pool,
+            principal,
+            format=format,
+            tenant_uuid=tenant_uuid,
+            start=start,
+            end=end,
+            after_id=after_id,
+        ),
+        media_type=service.CDR_EXPORT_MEDIA_TYPES[format],
+    )
+
+
 @router.get("/cdrs/{cdr_id}", response_model=schema.CDR)
-def read_cdr(
+async def read_cdr(
     cdr_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_cdr = service.get_cdr(db, principal, cdr_id=cdr_id)
+    db_cdr = await service.fetch_cdr(pool, principal, cdr_id=cdr_id)
     if db_cdr is None:
         raise HTTPException(status_code=404, detail="CDR not found")
     return db_cdr
@@ -1,13 +1,17 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
 from time import time
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
 from wazo_router_confd.schemas import did as schema
 from wazo_router_confd.services import did as service
 
@@ -44,24 +48,42 @@ def create_did(
     return service.create_did(db, principal, did=did)
 
 
+@router.post("/dids/import", response_model=schema.DIDImportResult)
+async def import_dids(
+    request: Request,
+    format: str = 'ndjson',
+    db: Session = Depends(get_db),
+    principal: Principal = Depends(get_principal),
+):
+    if format not in service.DID_IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported import format")
+    content = (await request.body()).decode('utf-8', 'replace')
+    return await run_in_threadpool(
+        service.import_dids, db, principal, content, format=format
+    )
+
+
 @router.get("/dids", response_model=schema.DIDList)
-def read_dids(
+async def read_dids(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    dids = service.get_dids(db, principal, offset=offset, limit=limit)
+    dids = await service.fetch_dids(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
+    )
     return dids
 
 
 @router.get("/dids/{did_id}", response_model=schema.DID)
-def read_did(
+async def read_did(
     did_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_did = service.get_did(db, principal, did_id=did_id)
+    db_did = await service.fetch_did(pool, principal, did_id=did_id)
     if db_did is None:
         raise HTTPException(status_code=404, detail="DID not found")
     return db_did
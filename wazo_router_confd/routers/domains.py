@@ -1,13 +1,17 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
 from time import time
+from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
+from wazo_router_confd.schemas import bulk as bulk_schema
 from wazo_router_confd.schemas import domain as schema
 from wazo_router_confd.services import domain as service
 
@@ -44,24 +48,36 @@ def create_domain(
     return service.create_domain(db, principal, domain=domain)
 
 
+@router.post("/domains/bulk", response_model=bulk_schema.BulkResult)
+def bulk_domains(
+    operations: List[bulk_schema.BulkOperation],
+    db: Session = Depends(get_db),
+    principal: Principal = Depends(get_principal),
+):
+    return service.bulk_domains(db, principal, operations=operations)
+
+
 @router.get("/domains", response_model=schema.DomainList)
-def read_domains(
+async def read_domains(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    domains = service.get_domains(db, principal, offset=offset, limit=limit)
+    domains = await service.fetch_domains(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
+    )
     return domains
 
 
 @router.get("/domains/{domain_id}", response_model=schema.Domain)
-def read_domain(
+async def read_domain(
     domain_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_domain = service.get_domain_by_id(db, principal, domain_id=domain_id)
+    db_domain = await service.fetch_domain(pool, principal, domain_id=domain_id)
     if db_domain is None:
         raise HTTPException(status_code=404, detail="Domain not found")
     return db_domain
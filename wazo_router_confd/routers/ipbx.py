@@ -1,11 +1,16 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
+from typing import List
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
+from wazo_router_confd.schemas import bulk as bulk_schema
 from wazo_router_confd.schemas import ipbx as schema
 from wazo_router_confd.services import ipbx as service
 
@@ -22,24 +27,36 @@ def create_ipbx(
     return service.create_ipbx(db, principal, ipbx=ipbx)
 
 
+@router.post("/ipbxs/bulk", response_model=bulk_schema.BulkResult)
+def bulk_ipbxs(
+    operations: List[bulk_schema.BulkOperation],
+    db: Session = Depends(get_db),
+    principal: Principal = Depends(get_principal),
+):
+    return service.bulk_ipbxs(db, principal, operations=operations)
+
+
 @router.get("/ipbxs", response_model=schema.IPBXList)
-def read_ipbxs(
+async def read_ipbxs(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    ipbxs = service.get_ipbxs(db, principal, offset=offset, limit=limit)
+    ipbxs = await service.fetch_ipbxs(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
+    )
     return ipbxs
 
 
 @router.get("/ipbxs/{ipbx_id}", response_model=schema.IPBXRead)
-def read_ipbx(
+async def read_ipbx(
     ipbx_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_ipbx = service.get_ipbx(db, principal, ipbx_id=ipbx_id)
+    db_ipbx = await service.fetch_ipbx(pool, principal, ipbx_id=ipbx_id)
     if db_ipbx is None:
         raise HTTPException(status_code=404, detail="IPBX not found")
     return db_ipbx
@@ -3,10 +3,15 @@
 
 import aiopg  # type: ignore
 
-from fastapi import APIRouter, Depends
+from typing import List
 
+from fastapi import APIRouter, Depends, Header
+from starlette.responses import Response, StreamingResponse
+
+from wazo_router_confd.cdr_buffer import CDRBuffer, get_cdr_buffer
 from wazo_router_confd.database import get_aiopg_pool
 from wazo_router_confd.redis import Redis, get_redis
+from wazo_router_confd.routing_engine import RoutingEngine, get_routing_engine
 from wazo_router_confd.schemas import kamailio as schema
 from wazo_router_confd.services import kamailio as service
 
@@ -19,15 +24,37 @@ async def kamailio_routing(
     request: schema.RoutingRequest,
     pool: aiopg.Pool = Depends(get_aiopg_pool),
     redis: Redis = Depends(get_redis),
+    engine: RoutingEngine = Depends(get_routing_engine),
 ):
-    return await service.routing(pool, redis, request=request)
+    return await service.routing(pool, redis, request=request, engine=engine)
+
+
+@router.post("/kamailio/routing/batch")
+async def kamailio_routing_batch(
+    requests: List[schema.RoutingRequest],
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
+    redis: Redis = Depends(get_redis),
+    engine: RoutingEngine = Depends(get_routing_engine),
+):
+    return await service.routing_batch(pool, redis, requests=requests, engine=engine)
 
 
 @router.post("/kamailio/cdr")
 async def kamailio_cdr(
-    request: schema.CDRRequest, pool: aiopg.Pool = Depends(get_aiopg_pool)
+    request: schema.CDRRequest,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
+    cdr_buffer: CDRBuffer = Depends(get_cdr_buffer),
 ):
-    return await service.cdr(pool, request)
+    return await service.cdr(pool, request, cdr_buffer=cdr_buffer)
+
+
+@router.post("/kamailio/cdr/batch")
+async def kamailio_cdr_batch(
+    requests: List[schema.CDRRequest],
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
+    cdr_buffer: CDRBuffer = Depends(get_cdr_buffer),
+):
+    return await service.cdr_batch(pool, requests, cdr_buffer=cdr_buffer)
 
 
 @router.post("/kamailio/auth")
@@ -35,10 +62,28 @@ async def kamailio_auth(
     request: schema.AuthRequest,
     pool: aiopg.Pool = Depends(get_aiopg_pool),
     redis: Redis = Depends(get_redis),
+    engine: RoutingEngine = Depends(get_routing_engine),
 ):
-    return await service.auth(pool, redis, request=request)
+    return await service.auth(pool, redis, request=request, engine=engine)
 
 
 @router.get("/kamailio/dbtext/uacreg")
-async def kamailio_dbtext_uacreg(pool: aiopg.Pool = Depends(get_aiopg_pool)):
-    return await service.dbtext_uacreg(pool)
+async def kamailio_dbtext_uacreg(
+    wait: int = 0,
+    if_none_match: str = Header(None),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
+    redis: Redis = Depends(get_redis),
+):
+    # the version is read before the trunks, a write in between changes it
+    etags = [etag.strip() for etag in (if_none_match or '').split(',')]
+    version = await service.get_uacreg_version(redis)
+    if wait > 0 and '"%s"' % version in etags:
+        version = await service.wait_uacreg_version(redis, version, wait)
+    headers = {'ETag': '"%s"' % version}
+    if '"%s"' % version in etags:
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(
+        service.stream_dbtext_uacreg_json(pool),
+        media_type='application/json',
+        headers=headers,
+    )
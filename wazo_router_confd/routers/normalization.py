@@ -1,13 +1,17 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
 from time import time
+from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
+from wazo_router_confd.schemas import bulk as bulk_schema
 from wazo_router_confd.schemas import normalization as schema
 from wazo_router_confd.services import normalization as service
 
@@ -49,14 +53,15 @@ def create_normalization_profile(
 
 
 @router.get("/normalization-profiles", response_model=schema.NormalizationProfileList)
-def read_normalization_profiles(
+async def read_normalization_profiles(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    normalization_profiles = service.get_normalization_profiles(
-        db, principal, offset=offset, limit=limit
+    normalization_profiles = await service.fetch_normalization_profiles(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
     )
     return normalization_profiles
 
@@ -65,13 +70,13 @@ def read_normalization_profiles(
     "/normalization-profiles/{normalization_profile_id}",
     response_model=schema.NormalizationProfile,
 )
-def read_normalization_profile(
+async def read_normalization_profile(
     normalization_profile_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_normalization_profile = service.get_normalization_profile(
-        db, principal, normalization_profile_id=normalization_profile_id
+    db_normalization_profile = await service.fetch_normalization_profile(
+        pool, principal, normalization_profile_id=normalization_profile_id
     )
     if db_normalization_profile is None:
         raise HTTPException(status_code=404, detail="Normalization profile not found")
@@ -149,15 +154,25 @@ def create_normalization_rule(
     )
 
 
+@router.post("/normalization-rules/bulk", response_model=bulk_schema.BulkResult)
+def bulk_normalization_rules(
+    operations: List[bulk_schema.BulkOperation],
+    db: Session = Depends(get_db),
+    principal: Principal = Depends(get_principal),
+):
+    return service.bulk_normalization_rules(db, principal, operations=operations)
+
+
 @router.get("/normalization-rules", response_model=schema.NormalizationRuleList)
-def read_normalization_rules(
+async def read_normalization_rules(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    normalization_rules = service.get_normalization_rules(
-        db, principal, offset=offset, limit=limit
+    normalization_rules = await service.fetch_normalization_rules(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
     )
     return normalization_rules
 
@@ -166,13 +181,13 @@ def read_normalization_rules(
     "/normalization-rules/{normalization_rule_id}",
     response_model=schema.NormalizationRule,
 )
-def read_normalization_rule(
+async def read_normalization_rule(
     normalization_rule_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_normalization_rule = service.get_normalization_rule(
-        db, principal, normalization_rule_id=normalization_rule_id
+    db_normalization_rule = await service.fetch_normalization_rule(
+        pool, principal, normalization_rule_id=normalization_rule_id
     )
     if db_normalization_rule is None:
         raise HTTPException(status_code=404, detail="Normalization rule not found")
@@ -1,11 +1,13 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
 from wazo_router_confd.schemas import routing_group as schema
 from wazo_router_confd.services import routing_group as service
 
@@ -23,26 +25,27 @@ def create_routing_group(
 
 
 @router.get("/routing-groups", response_model=schema.RoutingGroupList)
-def read_routing_groups(
+async def read_routing_groups(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    routing_groups = service.get_routing_groups(
-        db, principal, offset=offset, limit=limit
+    routing_groups = await service.fetch_routing_groups(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
     )
     return routing_groups
 
 
 @router.get("/routing-groups/{routing_group_id}", response_model=schema.RoutingGroup)
-def read_routing_group(
+async def read_routing_group(
     routing_group_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_routing_group = service.get_routing_group(
-        db, principal, routing_group_id=routing_group_id
+    db_routing_group = await service.fetch_routing_group(
+        pool, principal, routing_group_id=routing_group_id
     )
     if db_routing_group is None:
         raise HTTPException(status_code=404, detail="RoutingGroup not found")
@@ -1,11 +1,13 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
 from wazo_router_confd.schemas import routing_rule as schema
 from wazo_router_confd.services import routing_rule as service
 
@@ -23,23 +25,26 @@ def create_routing_rule(
 
 
 @router.get("/routing-rules", response_model=schema.RoutingRuleList)
-def read_routing_rules(
+async def read_routing_rules(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    routing_rules = service.get_routing_rules(db, principal, offset=offset, limit=limit)
+    routing_rules = await service.fetch_routing_rules(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
+    )
     return routing_rules
 
 
 @router.get("/routing-rules/{routing_rule_id}", response_model=schema.RoutingRule)
-def read_routing_rule(
+async def read_routing_rule(
     routing_rule_id: int,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_routing_rule = service.get_routing_rule(db, principal, routing_rule_id)
+    db_routing_rule = await service.fetch_routing_rule(pool, principal, routing_rule_id)
     if db_routing_rule is None:
         raise HTTPException(status_code=404, detail="RoutingRule not found")
     return db_routing_rule
@@ -1,8 +1,10 @@
 from fastapi import APIRouter
 
-from starlette.responses import Response
+from starlette.responses import PlainTextResponse, Response
 from starlette.status import HTTP_204_NO_CONTENT
 
+from wazo_router_confd.metrics import REGISTRY
+
 
 router = APIRouter()
 
@@ -10,3 +12,8 @@ router = APIRouter()
 @router.get("/status")
 async def status():
     return Response(status_code=HTTP_204_NO_CONTENT)
+
+
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
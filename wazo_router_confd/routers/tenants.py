@@ -1,6 +1,8 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import aiopg  # type: ignore
+
 from time import time
 
 from fastapi import APIRouter, Depends, HTTPException
@@ -8,7 +10,7 @@ from pydantic import UUID4
 from sqlalchemy.orm import Session
 
 from wazo_router_confd.auth import Principal, get_principal
-from wazo_router_confd.database import get_db
+from wazo_router_confd.database import get_aiopg_pool, get_db
 from wazo_router_confd.schemas import tenant as schema
 from wazo_router_confd.services import tenant as service
 
@@ -46,23 +48,26 @@ def create_tenant(
 
 
 @router.get("/tenants", response_model=schema.TenantList)
-def read_tenants(
+async def read_tenants(
     offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    tenants = service.get_tenants(db, principal, offset=offset, limit=limit)
+    tenants = await service.fetch_tenants(
+        pool, principal, offset=offset, limit=limit, cursor=cursor
+    )
     return tenants
 
 
 @router.get("/tenants/{tenant_uuid}", response_model=schema.Tenant)
-def read_tenant(
+async def read_tenant(
     tenant_uuid: UUID4,
-    db: Session = Depends(get_db),
+    pool: aiopg.Pool = Depends(get_aiopg_pool),
     principal: Principal = Depends(get_principal),
 ):
-    db_tenant = service.get_tenant(db, principal, tenant_uuid=tenant_uuid)
+    db_tenant = await service.fetch_tenant(pool, principal, tenant_uuid=tenant_uuid)
     if db_tenant is None:
         raise HTTPException(status_code=404, detail="Tenant not found")
     return db_tenant
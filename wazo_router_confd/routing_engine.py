@@ -0,0 +1,663 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import heapq
+import logging
+
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import aiopg  # type: ignore
+
+from fastapi import FastAPI
+from psycopg2.extras import DictCursor  # type: ignore
+from starlette.requests import Request
+
+from wazo_router_confd.schemas import kamailio as schema
+from wazo_router_confd.services import normalization as normalization_service
+from wazo_router_confd.services import password as password_service
+from wazo_router_confd.services import regex as regex_service
+from wazo_router_confd.services.kamailio import (
+    build_route,
+    build_rtjson,
+    split_uri_to_parts,
+)
+
+logger = logging.getLogger(__name__)
+
+# time in seconds a reload requested by a change of the configuration waits
+# for, to load the changes of a burst of writes at once
+ROUTING_ENGINE_RELOAD_DELAY = 0.5
+
+
+class IPBXRecord(NamedTuple):
+    id: int
+    tenant_uuid: str
+    domain: str
+    normalization_profile_id: Optional[int]
+    ip_fqdn: str
+    ip_address: Optional[str]
+    port: int
+    username: Optional[str]
+    password: Optional[str]
+    password_ha1: Optional[str]
+    realm: Optional[str]
+
+
+class CarrierTrunkRecord(NamedTuple):
+    id: int
+    tenant_uuid: str
+    normalization_profile_id: Optional[int]
+    sip_proxy: str
+    sip_proxy_port: int
+    ip_address: Optional[str]
+    auth_username: Optional[str]
+    auth_password: Optional[str]
+    realm: Optional[str]
+
+
+class DIDRecord(NamedTuple):
+    id: int
+    tenant_uuid: str
+    ipbx_id: int
+    did_regex: Optional[str]
+    did_prefix: Optional[str]
+
+
+class NormalizationProfileRecord(NamedTuple):
+    id: int
+    always_intl_prefix_plus: bool
+
+
+class NormalizationRuleRecord(NamedTuple):
+    id: int
+    profile_id: int
+    rule_type: int
+    priority: int
+    match_regex: str
+    match_prefix: str
+    replace_regex: str
+
+
+def group_by(items: Iterable[Any], key: Callable) -> Mapping[Any, Tuple[Any, ...]]:
+    groups: Dict[Any, List[Any]] = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return MappingProxyType({k: tuple(v) for k, v in groups.items()})
+
+
+def first_by(items: Iterable[Any], key: Callable) -> Mapping[Any, Any]:
+    firsts: Dict[Any, Any] = {}
+    for item in items:
+        firsts.setdefault(key(item), item)
+    return MappingProxyType(firsts)
+
+
+class DIDIndexNode(object):
+    __slots__ = ('children', 'entries')
+
+    def __init__(self):
+        self.children: Dict[str, DIDIndexNode] = {}
+        self.entries: Any = []
+
+
+class DIDIndex(object):
+    """
+    Trie of the DIDs keyed by the digits of their prefix, each entry holding
+    its precompiled regex. Lookups walk the number digit by digit and match
+    the longest prefix first, with no limit on the prefix length.
+    """
+
+    def __init__(self, dids: Iterable[DIDRecord] = ()):
+        self._root = DIDIndexNode()
+        self._size = 0
+        for did in dids:
+            if did.did_regex is None:
+                continue
+            regex = regex_service.get_safe_regex(did.did_regex)
+            if regex is None:
+                logger.warning("skipping regex for DID %d", did.id)
+                continue
+            node = self._root
+            for digit in did.did_prefix or '':
+                node = node.children.setdefault(digit, DIDIndexNode())
+            node.entries.append((did, regex))
+            self._size += 1
+        self._freeze(self._root)
+
+    def _freeze(self, node: DIDIndexNode):
+        # entries sharing the same prefix are ordered by ipbx id
+        node.entries = tuple(
+            sorted(node.entries, key=lambda x: (x[0].ipbx_id, x[0].id))
+        )
+        for child in node.children.values():
+            self._freeze(child)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def match(
+        self,
+        number: str,
+        tenant_uuid: Optional[str] = None,
+        budget: Optional[regex_service.RegexBudget] = None,
+    ) -> Optional[DIDRecord]:
+        budget = budget if budget is not None else regex_service.RegexBudget()
+        nodes = [self._root]
+        node = self._root
+        for digit in number:
+            node = node.children.get(digit)
+            if node is None:
+                break
+            nodes.append(node)
+        for node in reversed(nodes):
+            for did, regex in node.entries:
+                if tenant_uuid is not None and did.tenant_uuid != tenant_uuid:
+                    continue
+                if budget.match(regex, number):
+                    return did
+        return None
+
+
+class RoutingSnapshot(object):
+    """
+    Immutable, indexed view of the routing configuration, answering the
+    routing and auth requests without touching the database or Redis.
+    """
+
+    def __init__(
+        self,
+        ipbxs: Iterable[IPBXRecord] = (),
+        carrier_trunks: Iterable[CarrierTrunkRecord] = (),
+        dids: Iterable[DIDRecord] = (),
+        normalization_profiles: Iterable[NormalizationProfileRecord] = (),
+        normalization_rules: Iterable[NormalizationRuleRecord] = (),
+    ):
+        # ipbx indexes, every group is ordered by ipbx id
+        self.ipbxs = tuple(sorted(ipbxs, key=lambda x: x.id))
+        self.ipbxs_by_id = first_by(self.ipbxs, lambda x: x.id)
+        self.ipbxs_by_domain = group_by(self.ipbxs, lambda x: x.domain)
+        self.ipbxs_by_username = group_by(
+            filter(lambda x: x.username is not None, self.ipbxs), lambda x: x.username,
+        )
+        self.anonymous_ipbxs = tuple(
+            x for x in self.ipbxs if x.username is None and x.password_ha1 is None
+        )
+        self.tenant_uuids_by_ipbx_ip_fqdn = MappingProxyType(
+            {
+                ip_fqdn: frozenset(x.tenant_uuid for x in ipbxs)
+                for ip_fqdn, ipbxs in group_by(self.ipbxs, lambda x: x.ip_fqdn).items()
+            }
+        )
+        # carrier trunk indexes, only the first trunk by id is ever routed to
+        self.carrier_trunks = tuple(sorted(carrier_trunks, key=lambda x: x.id))
+        self.carrier_trunks_by_id = first_by(self.carrier_trunks, lambda x: x.id)
+        self.carrier_trunk_by_tenant_uuid = first_by(
+            self.carrier_trunks, lambda x: x.tenant_uuid
+        )
+        self.carrier_trunk_by_ip_address = first_by(
+            self.carrier_trunks, lambda x: x.ip_address
+        )
+        # did indexes
+        self.dids = DIDIndex(dids)
+        # normalization profiles, compiled with their rules ordered by priority
+        rules_by_profile_id = group_by(
+            sorted(normalization_rules, key=lambda x: (x.priority, x.id)),
+            lambda x: x.profile_id,
+        )
+        self.normalization_profiles_by_id = MappingProxyType(
+            {
+                profile.id: normalization_service.CompiledNormalizationProfile(
+                    profile.id,
+                    profile.always_intl_prefix_plus,
+                    [
+                        (x.rule_type, x.match_prefix, x.match_regex, x.replace_regex)
+                        for x in rules_by_profile_id.get(profile.id, ())
+                    ],
+                )
+                for profile in first_by(normalization_profiles, lambda x: x.id).values()
+            }
+        )
+
+    def normalize(
+        self,
+        number: str,
+        normalization_profile_id: Optional[int],
+        rule_type: int,
+        budget: Optional[regex_service.RegexBudget] = None,
+    ) -> str:
+        number = normalization_service.re_clean_number('', number)
+        profile = (
+            self.normalization_profiles_by_id.get(normalization_profile_id)
+            if normalization_profile_id is not None
+            else None
+        )
+        if profile is not None:
+            number = profile.normalize(number, rule_type, budget)
+        return number
+
+    def normalize_local_number_to_e164(
+        self,
+        number: str,
+        normalization_profile_id: Optional[int],
+        budget: Optional[regex_service.RegexBudget] = None,
+    ) -> str:
+        return self.normalize(number, normalization_profile_id, 1, budget)
+
+    def normalize_e164_to_local_number(
+        self,
+        number: str,
+        normalization_profile_id: Optional[int],
+        budget: Optional[regex_service.RegexBudget] = None,
+    ) -> str:
+        return self.normalize(number, normalization_profile_id, 2, budget)
+
+    def get_auth_ipbx_candidates(
+        self, domain: Optional[str], username: Optional[str]
+    ) -> Iterable[IPBXRecord]:
+        if domain:
+            return self.ipbxs_by_domain.get(domain, ())
+        if username:
+            return heapq.merge(
+                self.ipbxs_by_username.get(username, ()),
+                self.anonymous_ipbxs,
+                key=lambda x: x.id,
+            )
+        return self.ipbxs
+
+    def get_carrier_trunk_by_ip_address(
+        self, ip_address: str
+    ) -> Optional[CarrierTrunkRecord]:
+        candidates = [
+            self.carrier_trunk_by_ip_address.get(ip_address),
+            self.carrier_trunk_by_ip_address.get(None),
+        ]
+        return min(filter(None, candidates), key=lambda x: x.id, default=None)
+
+    def get_ipbx_by_domain(
+        self, domain: str, tenant_uuid: Optional[str] = None
+    ) -> Optional[IPBXRecord]:
+        for ipbx in self.ipbxs_by_domain.get(domain, ()):
+            if tenant_uuid is None or ipbx.tenant_uuid == tenant_uuid:
+                return ipbx
+        return None
+
+    def get_ipbx_by_did(
+        self,
+        number: str,
+        tenant_uuid: Optional[str] = None,
+        budget: Optional[regex_service.RegexBudget] = None,
+    ) -> Optional[IPBXRecord]:
+        did = self.dids.match(number, tenant_uuid, budget)
+        return self.ipbxs_by_id.get(did.ipbx_id) if did is not None else None
+
+    def get_carrier_trunk_by_ipbx_ip_fqdn(
+        self, ip_fqdn: Optional[str], tenant_uuid: Optional[str] = None
+    ) -> Optional[CarrierTrunkRecord]:
+        tenant_uuids = self.tenant_uuids_by_ipbx_ip_fqdn.get(ip_fqdn, frozenset())
+        if tenant_uuid is not None:
+            tenant_uuids = tenant_uuids & {tenant_uuid}
+        candidates = [self.carrier_trunk_by_tenant_uuid.get(x) for x in tenant_uuids]
+        return min(filter(None, candidates), key=lambda x: x.id, default=None)
+
+    async def auth(self, request: schema.AuthRequest) -> dict:
+        if request.source_ip or request.username:
+            for ipbx in self.get_auth_ipbx_candidates(request.domain, request.username):
+                if (
+                    request.source_ip
+                    and ipbx.ip_address is not None
+                    and ipbx.ip_address != request.source_ip
+                ):
+                    continue
+                if (
+                    request.username
+                    and ipbx.username != request.username
+                    and (ipbx.password_ha1 is not None or ipbx.username is not None)
+                ):
+                    continue
+                if (
+                    not request.password
+                    or ipbx.password
+                    and await password_service.verify_async(
+                        ipbx.password, request.password
+                    )
+                ):
+                    return dict(
+                        success=True,
+                        tenant_uuid=ipbx.tenant_uuid,
+                        ipbx_id=ipbx.id,
+                        domain=ipbx.domain,
+                        username=ipbx.username,
+                        password_ha1=ipbx.password_ha1,
+                    )
+            if request.source_ip:
+                carrier_trunk = self.get_carrier_trunk_by_ip_address(request.source_ip)
+                if carrier_trunk is not None:
+                    return dict(
+                        success=True,
+                        tenant_uuid=carrier_trunk.tenant_uuid,
+                        carrier_trunk_id=carrier_trunk.id,
+                    )
+        return dict(success=False)
+
+    async def routing(self, request: schema.RoutingRequest) -> dict:
+        # perform authorization the request, if needed
+        auth_response = (
+            schema.AuthResponse(
+                **await self.auth(
+                    schema.AuthRequest(
+                        source_ip=request.source_ip,
+                        source_port=request.source_port,
+                        domain=request.domain,
+                        username=request.username,
+                    )
+                )
+            )
+            if request.auth
+            else None
+        )
+        tenant_uuid = (
+            str(auth_response.tenant_uuid)
+            if auth_response is not None and auth_response.tenant_uuid
+            else None
+        )
+        routes = []
+        (
+            from_protocol,
+            from_local_part,
+            from_domain_name,
+            from_port_number,
+        ) = split_uri_to_parts(request.from_uri)
+        protocol, local_part, domain_name, port_number = split_uri_to_parts(
+            request.to_uri
+        )
+        # normalize according ipbx/carrier trunk source
+        normalization_profile_id = None
+        if auth_response is not None and auth_response.ipbx_id:
+            source_ipbx = self.ipbxs_by_id.get(auth_response.ipbx_id)
+            if source_ipbx is not None:
+                normalization_profile_id = source_ipbx.normalization_profile_id
+        elif auth_response is not None and auth_response.carrier_trunk_id:
+            source_carrier_trunk = self.carrier_trunks_by_id.get(
+                auth_response.carrier_trunk_id
+            )
+            if source_carrier_trunk is not None:
+                normalization_profile_id = source_carrier_trunk.normalization_profile_id
+        # bound the time spent evaluating regexes for this request
+        budget = regex_service.RegexBudget()
+        from_local_part = self.normalize_local_number_to_e164(
+            from_local_part, normalization_profile_id, budget
+        )
+        local_part = self.normalize_local_number_to_e164(
+            local_part, normalization_profile_id, budget
+        )
+        # route to the first ipbx linked to the domain, or else to the DID
+        ipbx_auth = None
+        ipbx = self.get_ipbx_by_domain(domain_name, tenant_uuid)
+        if ipbx is None:
+            ipbx = self.get_ipbx_by_did(local_part, tenant_uuid, budget)
+        if ipbx is not None:
+            normalized_from_uri = "%s%s@%s" % (
+                from_protocol,
+                self.normalize_e164_to_local_number(
+                    from_local_part, ipbx.normalization_profile_id, budget
+                ),
+                from_domain_name,
+            )
+            normalized_to_uri = "%s%s@%s" % (
+                protocol,
+                self.normalize_e164_to_local_number(
+                    local_part, ipbx.normalization_profile_id, budget
+                ),
+                domain_name,
+            )
+            routes.append(
+                build_route(
+                    "sip:%s:%s" % (ipbx.ip_fqdn, ipbx.port),
+                    request.from_name,
+                    normalized_from_uri,
+                    request.to_name,
+                    normalized_to_uri,
+                )
+            )
+            # if ipbx requires it, set the auth parameters
+            if (
+                ipbx.username is not None
+                and ipbx.password is not None
+                and ipbx.realm is not None
+            ):
+                ipbx_auth = dict(
+                    auth_username=ipbx.username,
+                    auth_password=ipbx.password,
+                    realm=ipbx.realm,
+                )
+        # route by carrier trunk if the package is coming from a known IPBX
+        carrier_trunk_auth = None
+        carrier_trunk = self.get_carrier_trunk_by_ipbx_ip_fqdn(
+            request.source_ip, tenant_uuid
+        )
+        if carrier_trunk is not None:
+            normalized_from_uri = "%s%s@%s%s" % (
+                from_protocol,
+                self.normalize_e164_to_local_number(
+                    from_local_part, carrier_trunk.normalization_profile_id, budget
+                ),
+                from_domain_name,
+                from_port_number,
+            )
+            normalized_to_uri = "%s%s@%s%s" % (
+                protocol,
+                self.normalize_e164_to_local_number(
+                    local_part, carrier_trunk.normalization_profile_id, budget
+                ),
+                domain_name,
+                port_number,
+            )
+            routes.append(
+                build_route(
+                    "sip:%s:%s"
+                    % (carrier_trunk.sip_proxy, carrier_trunk.sip_proxy_port),
+                    request.from_name,
+                    normalized_from_uri,
+                    request.to_name,
+                    normalized_to_uri,
+                )
+            )
+            # if carrier trunk is registered, set the auth parameters
+            if (
+                carrier_trunk.auth_username is not None
+                and carrier_trunk.auth_password is not None
+                and carrier_trunk.realm is not None
+            ):
+                carrier_trunk_auth = dict(
+                    auth_username=carrier_trunk.auth_username,
+                    auth_password=carrier_trunk.auth_password,
+                    realm=carrier_trunk.realm,
+                )
+        return {
+            "auth": dict(auth_response) if auth_response else None,
+            "rtjson": build_rtjson(routes, carrier_trunk_auth, ipbx_auth),
+        }
+
+
+async def load_routing_snapshot(pool: aiopg.Pool) -> RoutingSnapshot:
+    async with pool.acquire() as conn:
+        async with conn.cursor(cursor_factory=DictCursor) as cur:
+            # read all the tables from the same consistent database snapshot
+            await cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+            try:
+                await cur.execute(
+                    "SELECT ipbx.id, ipbx.tenant_uuid, domains.domain, "
+                    "ipbx.normalization_profile_id, ipbx.ip_fqdn, ipbx.ip_address, "
+                    "ipbx.port, ipbx.username, ipbx.password, ipbx.password_ha1, ipbx.realm "
+                    "FROM ipbx JOIN domains ON (ipbx.domain_id = domains.id);"
+                )
+                ipbxs = [
+                    IPBXRecord(**dict(row, tenant_uuid=str(row['tenant_uuid'])))
+                    for row in await cur.fetchall()
+                ]
+                await cur.execute(
+                    "SELECT carrier_trunks.id, carriers.tenant_uuid, "
+                    "carrier_trunks.normalization_profile_id, carrier_trunks.sip_proxy, "
+                    "carrier_trunks.sip_proxy_port, carrier_trunks.ip_address, "
+                    "carrier_trunks.auth_username, carrier_trunks.auth_password, "
+                    "carrier_trunks.realm "
+                    "FROM carrier_trunks JOIN carriers ON (carrier_trunks.carrier_id = carriers.id);"
+                )
+                carrier_trunks = [
+                    CarrierTrunkRecord(**dict(row, tenant_uuid=str(row['tenant_uuid'])))
+                    for row in await cur.fetchall()
+                ]
+                await cur.execute(
+                    "SELECT dids.id, ipbx.tenant_uuid, dids.ipbx_id, dids.did_regex, dids.did_prefix "
+                    "FROM dids JOIN ipbx ON (dids.ipbx_id = ipbx.id);"
+                )
+                dids = [
+                    DIDRecord(**dict(row, tenant_uuid=str(row['tenant_uuid'])))
+                    for row in await cur.fetchall()
+                ]
+                await cur.execute(
+                    "SELECT id, always_intl_prefix_plus FROM normalization_profiles;"
+                )
+                normalization_profiles = [
+                    NormalizationProfileRecord(**row) for row in await cur.fetchall()
+                ]
+                await cur.execute(
+                    "SELECT id, profile_id, rule_type, priority, match_regex, match_prefix, replace_regex "
+                    "FROM normalization_rules;"
+                )
+                normalization_rules = [
+                    NormalizationRuleRecord(**row) for row in await cur.fetchall()
+                ]
+            finally:
+                await cur.execute("COMMIT;")
+    return RoutingSnapshot(
+        ipbxs=ipbxs,
+        carrier_trunks=carrier_trunks,
+        dids=dids,
+        normalization_profiles=normalization_profiles,
+        normalization_rules=normalization_rules,
+    )
+
+
+class RoutingEngine(object):
+    snapshot: Optional[RoutingSnapshot]
+    refresh_interval: int
+
+    def __init__(
+        self,
+        refresh_interval: int = 0,
+        reload_delay: float = ROUTING_ENGINE_RELOAD_DELAY,
+    ):
+        self.snapshot = None
+        self.refresh_interval = refresh_interval
+        self.reload_delay = reload_delay
+        self._pool: Optional[aiopg.Pool] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._requested_version = 0
+        self._loaded_version = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._reload_pending = False
+        self._reload_task: Optional[asyncio.Task] = None
+
+    async def connect(self, pool: aiopg.Pool):
+        self._pool = pool
+        self._lock = asyncio.Lock()
+        await self.reload()
+        if self.refresh_interval > 0:
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+
+    def disconnect(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            self._reload_task = None
+
+    async def reload(self):
+        # coalesce concurrent reload requests: a reload requested while
+        # another one is running only triggers a single new load
+        self._requested_version += 1
+        version = self._requested_version
+        assert self._lock is not None, "routing engine is not connected"
+        async with self._lock:
+            if self._loaded_version >= version:
+                return
+            version = self._requested_version
+            snapshot = await load_routing_snapshot(self._pool)
+            # swap atomically, requests in flight keep the previous snapshot
+            self.snapshot = snapshot
+            self._loaded_version = version
+        logger.debug("Routing snapshot reloaded (version %d)", version)
+
+    def request_reload(self, tags: Optional[List[str]] = None):
+        """
+        Reload the snapshot in the background, once the writes of a burst
+        are done: called with the cache tags invalidated by any instance,
+        which all denote a change of the configuration, or None on a flush.
+        """
+        if self._lock is None:
+            return
+        self._reload_pending = True
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.ensure_future(self._delayed_reload())
+
+    async def _delayed_reload(self):
+        # a change notified during a reload triggers one more
+        while self._reload_pending:
+            await asyncio.sleep(self.reload_delay)
+            self._reload_pending = False
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.warning("fail to reload the routing snapshot: %s", e)
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.warning("fail to reload the routing snapshot: %s", e)
+
+    async def routing(self, request: schema.RoutingRequest) -> dict:
+        assert self.snapshot is not None
+        return await self.snapshot.routing(request)
+
+    async def auth(self, request: schema.AuthRequest) -> dict:
+        assert self.snapshot is not None
+        return await self.snapshot.auth(request)
+
+
+def get_routing_engine(request: Request) -> Optional[RoutingEngine]:
+    return getattr(request.app, 'routing_engine', None)
+
+
+def setup_routing_engine(app: FastAPI, config: dict):
+    engine = RoutingEngine(
+        refresh_interval=int(config.get('routing_engine_refresh_interval') or 0)
+    )
+    setattr(app, 'routing_engine', engine)
+
+    async def startup():
+        await engine.connect(getattr(app, 'aiopg_pool').pool)
+
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", engine.disconnect)
+
+    # reload once the configuration is changed, through any instance
+    getattr(app, 'redis').add_invalidation_listener(engine.request_reload)
+
+    return app
@@ -0,0 +1,29 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, validator
+
+BULK_ACTIONS = ('create', 'update', 'delete')
+
+
+class BulkOperation(BaseModel):
+    action: str
+    id: Optional[int] = None
+    data: Optional[Dict[str, Any]] = None
+
+    @validator('action')
+    def check_action(cls, action):
+        if action not in BULK_ACTIONS:
+            raise ValueError('action must be one of %s' % ', '.join(BULK_ACTIONS))
+        return action
+
+
+class BulkOperationResult(BaseModel):
+    action: str
+    id: int
+
+
+class BulkResult(BaseModel):
+    items: List[BulkOperationResult]
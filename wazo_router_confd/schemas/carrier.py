@@ -27,3 +27,4 @@ class CarrierUpdate(BaseModel):
 
 class CarrierList(BaseModel):
     items: List[Carrier]
+    next: Optional[str] = None
@@ -84,3 +84,4 @@ class CarrierTrunkUpdate(BaseModel):
 
 class CarrierTrunkList(BaseModel):
     items: List[CarrierTrunkRead]
+    next: Optional[str] = None
@@ -47,3 +47,18 @@ class CDRUpdate(BaseModel):
 
 class CDRList(BaseModel):
     items: List[CDR]
+    next: Optional[str] = None
+
+
+class CDRStats(BaseModel):
+    period: datetime
+    tenant_uuid: UUID4
+    carrier_trunk_id: Optional[int] = None
+    ipbx_id: Optional[int] = None
+    calls: int
+    total_minutes: float
+    average_duration: float
+
+
+class CDRStatsList(BaseModel):
+    items: List[CDRStats]
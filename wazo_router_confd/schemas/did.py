@@ -3,7 +3,17 @@
 
 from typing import Optional, List
 
-from pydantic import BaseModel, constr, UUID4
+from pydantic import BaseModel, constr, validator, UUID4
+
+from wazo_router_confd.services import regex as regex_service
+
+
+def validate_did_regex(did_regex: Optional[str]) -> Optional[str]:
+    if did_regex is not None:
+        error = regex_service.get_regex_error(did_regex)
+        if error is not None:
+            raise ValueError(error)
+    return did_regex
 
 
 class DID(BaseModel):
@@ -23,6 +33,10 @@ class DIDCreate(BaseModel):
     carrier_trunk_id: int
     did_regex: Optional[constr(max_length=256)] = None  # type: ignore
 
+    @validator('did_regex')
+    def check_did_regex(cls, did_regex):
+        return validate_did_regex(did_regex)
+
 
 class DIDUpdate(BaseModel):
     tenant_uuid: Optional[UUID4]
@@ -30,6 +44,21 @@ class DIDUpdate(BaseModel):
     carrier_trunk_id: int
     did_regex: Optional[constr(max_length=256)] = None  # type: ignore
 
+    @validator('did_regex')
+    def check_did_regex(cls, did_regex):
+        return validate_did_regex(did_regex)
+
 
 class DIDList(BaseModel):
     items: List[DID]
+    next: Optional[str] = None
+
+
+class DIDImportError(BaseModel):
+    line: int
+    message: str
+
+
+class DIDImportResult(BaseModel):
+    created: int
+    errors: List[DIDImportError]
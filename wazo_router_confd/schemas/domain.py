@@ -27,3 +27,4 @@ class DomainUpdate(BaseModel):
 
 class DomainList(BaseModel):
     items: List[Domain]
+    next: Optional[str] = None
@@ -74,3 +74,4 @@ class IPBXUpdate(BaseModel):
 
 class IPBXList(BaseModel):
     items: List[IPBXRead]
+    next: Optional[str] = None
@@ -3,7 +3,27 @@
 
 from typing import Optional, List
 
-from pydantic import BaseModel, constr, UUID4
+from pydantic import BaseModel, constr, validator, UUID4
+
+from wazo_router_confd.services import regex as regex_service
+
+
+def validate_match_regex(match_regex: str) -> str:
+    error = regex_service.get_regex_error(match_regex)
+    if error is not None:
+        raise ValueError(error)
+    return match_regex
+
+
+def validate_replace_regex(replace_regex: str, values: dict) -> str:
+    # the match regex is missing from values if it failed validation
+    if values.get('match_regex') is not None:
+        error = regex_service.get_replacement_error(
+            values['match_regex'], replace_regex
+        )
+        if error is not None:
+            raise ValueError(error)
+    return replace_regex
 
 
 class NormalizationProfile(BaseModel):
@@ -45,6 +65,7 @@ class NormalizationProfileUpdate(BaseModel):
 
 class NormalizationProfileList(BaseModel):
     items: List[NormalizationProfile]
+    next: Optional[str] = None
 
 
 class NormalizationRule(BaseModel):
@@ -66,6 +87,14 @@ class NormalizationRuleCreate(BaseModel):
     match_regex: constr(max_length=256)  # type: ignore
     replace_regex: constr(max_length=256)  # type: ignore
 
+    @validator('match_regex')
+    def check_match_regex(cls, match_regex):
+        return validate_match_regex(match_regex)
+
+    @validator('replace_regex')
+    def check_replace_regex(cls, replace_regex, values):
+        return validate_replace_regex(replace_regex, values)
+
 
 class NormalizationRuleUpdate(BaseModel):
     profile_id: int
@@ -74,6 +103,15 @@ class NormalizationRuleUpdate(BaseModel):
     match_regex: constr(max_length=256)  # type: ignore
     replace_regex: constr(max_length=256)  # type: ignore
 
+    @validator('match_regex')
+    def check_match_regex(cls, match_regex):
+        return validate_match_regex(match_regex)
+
+    @validator('replace_regex')
+    def check_replace_regex(cls, replace_regex, values):
+        return validate_replace_regex(replace_regex, values)
+
 
 class NormalizationRuleList(BaseModel):
     items: List[NormalizationRule]
+    next: Optional[str] = None
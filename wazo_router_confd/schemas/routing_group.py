@@ -27,3 +27,4 @@ class RoutingGroupUpdate(BaseModel):
 
 class RoutingGroupList(BaseModel):
     items: List[RoutingGroup]
+    next: Optional[str] = None
@@ -36,3 +36,4 @@ class RoutingRuleUpdate(BaseModel):
 
 class RoutingRuleList(BaseModel):
     items: List[RoutingRule]
+    next: Optional[str] = None
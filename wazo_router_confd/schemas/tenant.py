@@ -3,7 +3,7 @@
 
 from pydantic import BaseModel, constr, UUID4
 
-from typing import List
+from typing import List, Optional
 
 
 class Tenant(BaseModel):
@@ -25,3 +25,4 @@ class TenantUpdate(BaseModel):
 
 class TenantList(BaseModel):
     items: List[Tenant]
+    next: Optional[str] = None
@@ -0,0 +1,173 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from typing import Any, Callable, Dict, List, Optional, Set, Type
+from uuid import UUID
+
+from fastapi import HTTPException
+from pydantic import BaseModel, UUID4, ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query, Session
+
+from wazo_router_confd.auth import Principal
+from wazo_router_confd.cache import add_cache_tags, get_instance_cache_tags
+from wazo_router_confd.schemas import bulk as schema
+from wazo_router_confd.services import tenant as tenant_service
+from wazo_router_confd.services.did import get_validation_message
+
+
+def get_tenant_uuid_getter(
+    db: Session, principal: Principal
+) -> Callable[[Optional[UUID]], UUID4]:
+    # the tenants are resolved once for all the operations
+    tenant_uuids: Dict[Optional[UUID], UUID4] = {}
+
+    def get_tenant_uuid(tenant_uuid: Optional[UUID]) -> UUID4:
+        if tenant_uuid not in tenant_uuids:
+            tenant_uuids[tenant_uuid] = tenant_service.get_uuid(
+                principal, db, tenant_uuid
+            )
+        return tenant_uuids[tenant_uuid]
+
+    return get_tenant_uuid
+
+
+def get_insert_values(instance: Any) -> Dict[str, Any]:
+    # every row of a multi-row INSERT has the same columns
+    values = {}
+    for column in instance.__table__.columns:
+        if column.primary_key:
+            continue
+        value = getattr(instance, column.key)
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        values[column.key] = value
+    return values
+
+
+def apply_bulk_operations(
+    db: Session,
+    model: Any,
+    query: Query,
+    operations: List[schema.BulkOperation],
+    create_schema: Type[BaseModel],
+    update_schema: Type[BaseModel],
+    build: Callable[[Any], Any],
+    update: Callable[[Any, Any], None],
+    unique: Any = None,
+) -> schema.BulkResult:
+    """
+    Apply the operations in a single transaction, all or none of them: the
+    creations with one multi-row INSERT, the deletions with one DELETE, and
+    the updates in one flush of the rows loaded with one SELECT, from the
+    query of the entities the principal may change. The build and update
+    callbacks raise a ValueError for an invalid operation.
+    """
+    errors: Dict[int, str] = {}
+    creates: Dict[int, Any] = {}
+    updates: Dict[int, Any] = {}
+    update_ids: Dict[int, int] = {}
+    deletes: Dict[int, int] = {}
+    for index, operation in enumerate(operations):
+        if operation.action == 'create':
+            try:
+                creates[index] = create_schema(**(operation.data or {}))
+            except ValidationError as e:
+                errors[index] = get_validation_message(e)
+        elif operation.id is None:
+            errors[index] = "id: field required"
+        elif operation.id in set(update_ids.values()) | set(deletes.values()):
+            errors[index] = "id: %s already changed by the batch" % operation.id
+        elif operation.action == 'update':
+            update_ids[index] = operation.id
+            try:
+                updates[index] = update_schema(**(operation.data or {}))
+            except ValidationError as e:
+                errors[index] = get_validation_message(e)
+        else:
+            deletes[index] = operation.id
+    # the values to keep unique, against the database and within the batch
+    if unique is not None:
+        values = {getattr(data, unique.key) for data in creates.values()}
+        existing = {
+            value for (value,) in query.with_entities(unique).filter(unique.in_(values))
+        }
+        for index, data in creates.items():
+            value = getattr(data, unique.key)
+            if value is None:
+                continue
+            if value in existing:
+                errors[index] = "%s: Duplicated %s" % (unique.key, unique.key)
+            existing.add(value)
+    instances: Dict[int, Any] = {}
+    for index, data in creates.items():
+        if index in errors:
+            continue
+        try:
+            instances[index] = build(data)
+        except ValueError as e:
+            errors[index] = str(e)
+        except HTTPException as e:
+            errors[index] = "tenant_uuid: %s" % e.detail
+    ids = set(update_ids.values()) | set(deletes.values())
+    targets = {target.id: target for target in query.filter(model.id.in_(ids))}
+    for index, id_ in list(update_ids.items()) + list(deletes.items()):
+        if id_ not in targets:
+            errors[index] = "id: %s not found" % id_
+    for index, data in updates.items():
+        if index in errors:
+            continue
+        try:
+            update(targets[update_ids[index]], data)
+        except ValueError as e:
+            errors[index] = str(e)
+    if errors:
+        db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=[
+                {"index": index, "message": message}
+                for index, message in sorted(errors.items())
+            ],
+        )
+    tags: Set[str] = set()
+    try:
+        if deletes:
+            for id_ in deletes.values():
+                target = targets[id_]
+                tags.update(get_instance_cache_tags(db, target))
+                # the database cascades the deletion to the dependent entities
+                if getattr(target, 'tenant_uuid', None) is not None:
+                    tags.add('tenant:%s' % target.tenant_uuid)
+                db.expunge(target)
+            db.query(model).filter(model.id.in_(list(deletes.values()))).delete(
+                synchronize_session=False
+            )
+        if instances:
+            table = model.__table__
+            rows = db.execute(
+                table.insert()
+                .values([get_insert_values(x) for x in instances.values()])
+                .returning(table.c.id)
+            )
+            # the rows are returned in the order of the values
+            for instance, (id_,) in zip(instances.values(), rows.fetchall()):
+                instance.id = id_
+                tags.update(get_instance_cache_tags(db, instance))
+        # evict once the cache of the rows written outside of the ORM, the
+        # updates are tagged by their flush
+        add_cache_tags(db, tags)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e.orig).strip())
+    items = []
+    for index, operation in enumerate(operations):
+        if index in instances:
+            id_ = instances[index].id
+        elif index in update_ids:
+            id_ = update_ids[index]
+        else:
+            id_ = deletes[index]
+        items.append(schema.BulkOperationResult(action=operation.action, id=id_))
+    return schema.BulkResult(items=items)
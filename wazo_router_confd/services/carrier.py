@@ -1,19 +1,35 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from sqlalchemy.orm import Session
+from typing import Any, Dict, Optional
+
+import aiopg  # type: ignore
+
+from sqlalchemy.orm import Query, Session
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_one
 from wazo_router_confd.models.carrier import Carrier
 from wazo_router_confd.schemas import carrier as schema
+from wazo_router_confd.services.pagination import fetch_page
 from wazo_router_confd.services import tenant as tenant_service
 
 
-def get_carrier(db: Session, principal: Principal, carrier_id: int) -> Carrier:
-    db_carrier = db.query(Carrier).filter(Carrier.id == carrier_id)
+def query_carrier(principal: Principal, carrier_id: int) -> Query:
+    query = Query(Carrier).filter(Carrier.id == carrier_id)
     if principal is not None and principal.tenant_uuids:
-        db_carrier = db_carrier.filter(Carrier.tenant_uuid.in_(principal.tenant_uuids))
-    return db_carrier.first()
+        query = query.filter(Carrier.tenant_uuid.in_(principal.tenant_uuids))
+    return query
+
+
+def get_carrier(db: Session, principal: Principal, carrier_id: int) -> Carrier:
+    return query_carrier(principal, carrier_id).with_session(db).first()
+
+
+async def fetch_carrier(
+    pool: aiopg.Pool, principal: Principal, carrier_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(pool, query_carrier(principal, carrier_id))
 
 
 def get_carrier_by_name(db: Session, principal: Principal, name: str) -> Carrier:
@@ -23,14 +39,20 @@ def get_carrier_by_name(db: Session, principal: Principal, name: str) -> Carrier
     return db_carrier.first()
 
 
-def get_carriers(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_carriers(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.CarrierList:
-    items = db.query(Carrier)
+    items = Query(Carrier)
     if principal is not None and principal.tenant_uuid:
         items = items.filter(Carrier.tenant_uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.CarrierList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, Carrier.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.CarrierList(items=items, next=next_cursor)
 
 
 def create_carrier(
@@ -1,29 +1,59 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from sqlalchemy.orm import Session
+import csv
+import io
+import json
+
+from datetime import datetime, timedelta
+from uuid import UUID
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import aiopg  # type: ignore
+
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_all, fetch_one
 from wazo_router_confd.models.cdr import CDR
+from wazo_router_confd.models.cdr_rollup import CDRRollup
 from wazo_router_confd.schemas import cdr as schema
+from wazo_router_confd.services.pagination import fetch_page
 from wazo_router_confd.services import tenant as tenant_service
 
 
-def get_cdr(db: Session, principal: Principal, cdr_id: int) -> CDR:
-    db_cdr = db.query(CDR).filter(CDR.id == cdr_id)
+def query_cdr(principal: Principal, cdr_id: int) -> Query:
+    query = Query(CDR).filter(CDR.id == cdr_id)
     if principal is not None and principal.tenant_uuids:
-        db_cdr = db_cdr.filter(CDR.tenant_uuid.in_(principal.tenant_uuids))
-    return db_cdr.first()
+        query = query.filter(CDR.tenant_uuid.in_(principal.tenant_uuids))
+    return query
+
+
+def get_cdr(db: Session, principal: Principal, cdr_id: int) -> CDR:
+    return query_cdr(principal, cdr_id).with_session(db).first()
 
 
-def get_cdrs(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_cdr(
+    pool: aiopg.Pool, principal: Principal, cdr_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(pool, query_cdr(principal, cdr_id))
+
+
+async def fetch_cdrs(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.CDRList:
-    items = db.query(CDR)
+    items = Query(CDR)
     if principal is not None and principal.tenant_uuid:
         items = items.filter(CDR.tenant_uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.CDRList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, CDR.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.CDRList(items=items, next=next_cursor)
 
 
 def create_cdr(db: Session, principal: Principal, cdr: schema.CDRCreate) -> CDR:
@@ -68,3 +98,169 @@ def delete_cdr(db: Session, principal: Principal, cdr_id: int) -> CDR:
         db.delete(db_cdr)
         db.commit()
     return db_cdr
+
+
+CDR_STATS_GROUP_BY = {
+    'tenant': None,
+    'carrier_trunk': CDRRollup.carrier_trunk_id,
+    'ipbx': CDRRollup.ipbx_id,
+}
+
+
+async def fetch_cdr_stats(
+    pool: aiopg.Pool,
+    principal: Principal,
+    granularity: str = 'hour',
+    group_by: str = 'tenant',
+    tenant_uuid: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> schema.CDRStatsList:
+    # read from the rollups, whatever the number of cdrs
+    columns = [CDRRollup.period, CDRRollup.tenant_uuid]
+    if CDR_STATS_GROUP_BY[group_by] is not None:
+        columns.append(CDR_STATS_GROUP_BY[group_by])
+    query = Query(
+        [
+            *columns,
+            func.sum(CDRRollup.calls).label('calls'),
+            func.sum(CDRRollup.duration).label('duration'),
+        ]
+    ).filter(CDRRollup.granularity == granularity)
+    if principal is not None and principal.tenant_uuids:
+        query = query.filter(CDRRollup.tenant_uuid.in_(principal.tenant_uuids))
+    if tenant_uuid is not None:
+        query = query.filter(CDRRollup.tenant_uuid == tenant_uuid)
+    if start is not None:
+        query = query.filter(CDRRollup.period >= start)
+    if end is not None:
+        query = query.filter(CDRRollup.period < end)
+    items = []
+    for row in await fetch_all(pool, query.group_by(*columns).order_by(*columns)):
+        calls, duration = row['calls'], row['duration']
+        items.append(
+            schema.CDRStats(
+                period=row['period'],
+                tenant_uuid=row['tenant_uuid'],
+                carrier_trunk_id=row.get('carrier_trunk_id') or None,
+                ipbx_id=row.get('ipbx_id') or None,
+                calls=calls,
+                total_minutes=duration / 60,
+                average_duration=duration / calls if calls else 0,
+            )
+        )
+    return schema.CDRStatsList(items=items)
+
+
+# columns of the exported CDRs, ordered by id so that an export can be resumed
+# after the last id received
+CDR_EXPORT_COLUMNS = (
+    'id',
+    'tenant_uuid',
+    'source_ip',
+    'source_port',
+    'from_uri',
+    'to_uri',
+    'call_id',
+    'call_start',
+    'duration',
+)
+CDR_EXPORT_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+# rows fetched from the server-side cursor at once
+CDR_EXPORT_BATCH_SIZE = 1000
+# a CDR is inserted once its call ended, created_at is at least its call
+# start, give or take the clock skew between Kamailio and the database
+CDR_EXPORT_CLOCK_SKEW = timedelta(days=1)
+
+
+def get_cdr_export_query(
+    principal: Principal,
+    tenant_uuid: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after_id: int = 0,
+) -> Tuple[str, list]:
+    conditions = ["id > %s"]
+    params: list = [after_id]
+    tenant_uuids: Optional[List[str]] = None
+    if principal is not None and principal.tenant_uuids:
+        tenant_uuids = [str(uuid) for uuid in principal.tenant_uuids]
+    if tenant_uuid is not None:
+        tenant_uuids = (
+            [str(tenant_uuid)]
+            if tenant_uuids is None or str(tenant_uuid) in tenant_uuids
+            else []
+        )
+    if tenant_uuids is not None:
+        conditions.append("tenant_uuid = ANY(%s::uuid[])")
+        params.append(tenant_uuids)
+    if start is not None:
+        conditions.append("call_start >= %s")
+        params.append(start)
+        # bound the partition key too, to skip the partitions of older CDRs
+        conditions.append("created_at >= %s")
+        params.append(start - CDR_EXPORT_CLOCK_SKEW)
+    if end is not None:
+        conditions.append("call_start < %s")
+        params.append(end)
+    query = "SELECT %s FROM cdrs WHERE %s ORDER BY id" % (
+        ', '.join(CDR_EXPORT_COLUMNS),
+        ' AND '.join(conditions),
+    )
+    return query, params
+
+
+def format_cdr_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def format_cdrs(rows: List[tuple], format: str = 'ndjson') -> str:
+    if format == 'csv':
+        output = io.StringIO()
+        csv.writer(output).writerows(
+            [format_cdr_value(value) for value in row] for row in rows
+        )
+        return output.getvalue()
+    return ''.join(
+        json.dumps(
+            dict(zip(CDR_EXPORT_COLUMNS, (format_cdr_value(value) for value in row)))
+        )
+        + '\n'
+        for row in rows
+    )
+
+
+async def export_cdrs(
+    pool: aiopg.Pool,
+    principal: Principal,
+    format: str = 'ndjson',
+    tenant_uuid: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after_id: int = 0,
+    batch_size: int = CDR_EXPORT_BATCH_SIZE,
+) -> AsyncIterator[str]:
+    query, params = get_cdr_export_query(principal, tenant_uuid, start, end, after_id)
+    if format == 'csv':
+        yield format_cdrs([CDR_EXPORT_COLUMNS], format)
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            # the rows are fetched in batches from a server-side cursor, which
+            # only lives inside of a transaction
+            await cur.execute("BEGIN;")
+            try:
+                await cur.execute(
+                    "DECLARE cdr_export NO SCROLL CURSOR FOR %s;" % query, params
+                )
+                while True:
+                    await cur.execute("FETCH FORWARD %d FROM cdr_export;" % batch_size)
+                    rows = await cur.fetchall()
+                    if not rows:
+                        break
+                    yield format_cdrs(rows, format)
+            finally:
+                await cur.execute("ROLLBACK;")
@@ -1,26 +1,46 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import re
+import csv
+import io
+import json
 
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-from sqlalchemy.orm import Session
+import aiopg  # type: ignore
+import psycopg2  # type: ignore
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.orm import Query, Session
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_one
+from wazo_router_confd.cache import add_cache_tags
+from wazo_router_confd.models.carrier_trunk import CarrierTrunk
 from wazo_router_confd.models.did import DID
+from wazo_router_confd.models.ipbx import IPBX
 from wazo_router_confd.schemas import did as schema
+from wazo_router_confd.services.pagination import fetch_page
+from wazo_router_confd.services import regex as regex_service
 from wazo_router_confd.services import tenant as tenant_service
 
 
-re_did_prefix_from_regex = re.compile('[^0-9]')
+def query_did(principal: Principal, did_id: int) -> Query:
+    query = Query(DID).filter(DID.id == did_id)
+    if principal is not None and principal.tenant_uuids:
+        query = query.filter(DID.tenant_uuid.in_(principal.tenant_uuids))
+    return query
 
 
 def get_did(db: Session, principal: Principal, did_id: int) -> DID:
-    db_did = db.query(DID).filter(DID.id == did_id)
-    if principal is not None and principal.tenant_uuids:
-        db_did = db_did.filter(DID.tenant_uuid.in_(principal.tenant_uuids))
-    return db_did.first()
+    return query_did(principal, did_id).with_session(db).first()
+
+
+async def fetch_did(
+    pool: aiopg.Pool, principal: Principal, did_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(pool, query_did(principal, did_id))
 
 
 def get_did_by_regex(db: Session, principal: Principal, regex: Optional[str]) -> DID:
@@ -30,23 +50,24 @@ def get_did_by_regex(db: Session, principal: Principal, regex: Optional[str]) ->
     return db_did.first()
 
 
-def get_dids(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_dids(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.DIDList:
-    items = db.query(DID)
+    items = Query(DID)
     if principal is not None and principal.tenant_uuid:
         items = items.filter(DID.tenant_uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.DIDList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, DID.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.DIDList(items=items, next=next_cursor)
 
 
 def get_did_prefix_from_regex(did_regex: Optional[str] = None) -> str:
-    did_prefix = (
-        re_did_prefix_from_regex.split(did_regex.lstrip('^'))[0]
-        if did_regex is not None
-        else ''
-    )
-    return did_prefix
+    return regex_service.get_literal_prefix(did_regex)
 
 
 def create_did(db: Session, principal: Principal, did: schema.DIDCreate) -> DID:
@@ -93,3 +114,146 @@ def delete_did(db: Session, principal: Principal, did_id: int) -> DID:
         db.delete(db_did)
         db.commit()
     return db_did
+
+
+DID_IMPORT_FORMATS = ('ndjson', 'csv')
+DID_IMPORT_COPY_SQL = (
+    "COPY dids (tenant_uuid, ipbx_id, carrier_trunk_id, did_regex, did_prefix) "
+    "FROM STDIN WITH (FORMAT csv);"
+)
+
+
+def get_copy_csv_value(value: Any) -> str:
+    # for COPY, an unquoted empty field is NULL and a quoted one is ''
+    if value is None:
+        return ''
+    if isinstance(value, int):
+        return str(value)
+    return '"%s"' % str(value).replace('"', '""')
+
+
+def get_copy_csv_row(values: List[Any]) -> str:
+    return ','.join(get_copy_csv_value(value) for value in values) + '\n'
+
+
+def get_did_import_rows(
+    content: str, format: str = 'ndjson'
+) -> Iterator[Tuple[int, Union[dict, str]]]:
+    # line number and fields of every row, or the error of an unreadable row
+    if format == 'csv':
+        reader = csv.DictReader(io.StringIO(content))
+        for row in reader:
+            yield reader.line_num, {
+                key: value or None for key, value in row.items() if key is not None
+            }
+        return
+    for line, data in enumerate(content.splitlines(), 1):
+        if not data.strip():
+            continue
+        try:
+            row = json.loads(data)
+        except ValueError as e:
+            yield line, "invalid JSON: %s" % e
+            continue
+        yield line, row if isinstance(row, dict) else "not a JSON object"
+
+
+def get_validation_message(error: ValidationError) -> str:
+    return '; '.join(
+        '%s: %s' % ('.'.join(map(str, x['loc'])), x['msg']) for x in error.errors()
+    )
+
+
+def import_dids(
+    db: Session, principal: Principal, content: str, format: str = 'ndjson'
+) -> schema.DIDImportResult:
+    """
+    Validate every row, then load the valid ones at once with COPY, in a
+    single transaction. The invalid rows are returned with their errors.
+    """
+    errors: List[schema.DIDImportError] = []
+    dids: List[Tuple[int, schema.DIDCreate]] = []
+    for line, row in get_did_import_rows(content, format):
+        if isinstance(row, str):
+            errors.append(schema.DIDImportError(line=line, message=row))
+            continue
+        try:
+            dids.append((line, schema.DIDCreate(**row)))
+        except ValidationError as e:
+            errors.append(
+                schema.DIDImportError(line=line, message=get_validation_message(e))
+            )
+    # the tenants, ipbxs and carrier trunks are checked once for all the rows
+    tenant_uuids: Dict[Any, Union[Any, HTTPException]] = {}
+    for _, did in dids:
+        if did.tenant_uuid not in tenant_uuids:
+            try:
+                tenant_uuids[did.tenant_uuid] = tenant_service.get_uuid(
+                    principal, db, did.tenant_uuid
+                )
+            except HTTPException as e:
+                tenant_uuids[did.tenant_uuid] = e
+    ipbxs = set(
+        db.query(IPBX.tenant_uuid, IPBX.id).filter(
+            IPBX.id.in_({did.ipbx_id for _, did in dids})
+        )
+    )
+    carrier_trunk_ids = {
+        carrier_trunk_id
+        for (carrier_trunk_id,) in db.query(CarrierTrunk.id).filter(
+            CarrierTrunk.id.in_({did.carrier_trunk_id for _, did in dids})
+        )
+    }
+    did_regexes = set(
+        db.query(DID.tenant_uuid, DID.did_regex).filter(
+            DID.did_regex.in_({did.did_regex for _, did in dids if did.did_regex})
+        )
+    )
+    output = io.StringIO()
+    did_prefixes: Set[str] = set()
+    created = 0
+    for line, did in dids:
+        tenant_uuid = tenant_uuids[did.tenant_uuid]
+        if isinstance(tenant_uuid, HTTPException):
+            message = "tenant_uuid: %s" % tenant_uuid.detail
+        elif (tenant_uuid, did.ipbx_id) not in ipbxs:
+            message = "ipbx_id: no ipbx %s in tenant %s" % (did.ipbx_id, tenant_uuid)
+        elif did.carrier_trunk_id not in carrier_trunk_ids:
+            message = "carrier_trunk_id: no carrier trunk %s" % did.carrier_trunk_id
+        elif did.did_regex is not None and (tenant_uuid, did.did_regex) in did_regexes:
+            message = "did_regex: Duplicated did_regex"
+        else:
+            did_prefix = get_did_prefix_from_regex(did.did_regex)
+            output.write(
+                get_copy_csv_row(
+                    [
+                        str(tenant_uuid),
+                        did.ipbx_id,
+                        did.carrier_trunk_id,
+                        did.did_regex,
+                        did_prefix,
+                    ]
+                )
+            )
+            if did.did_regex is not None:
+                did_regexes.add((tenant_uuid, did.did_regex))
+            did_prefixes.add(did_prefix)
+            created += 1
+            continue
+        errors.append(schema.DIDImportError(line=line, message=message))
+    if created:
+        output.seek(0)
+        try:
+            with db.connection().connection.cursor() as cur:
+                cur.copy_expert(DID_IMPORT_COPY_SQL, output)
+        except psycopg2.IntegrityError as e:
+            # e.g. a DID created concurrently
+            db.rollback()
+            raise HTTPException(status_code=409, detail=str(e).strip())
+        # evict the routing answers of the DIDs loaded outside of the ORM
+        add_cache_tags(
+            db, ['did_prefix:%s' % did_prefix for did_prefix in did_prefixes]
+        )
+        db.commit()
+    errors.sort(key=lambda error: error.line)
+    return schema.DIDImportResult(created=created, errors=errors)
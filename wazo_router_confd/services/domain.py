@@ -1,19 +1,37 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from sqlalchemy.orm import Session
+from typing import Any, Dict, List, Optional
+
+import aiopg  # type: ignore
+
+from sqlalchemy.orm import Query, Session
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_one
 from wazo_router_confd.models.domain import Domain
+from wazo_router_confd.schemas import bulk as bulk_schema
 from wazo_router_confd.schemas import domain as schema
+from wazo_router_confd.services import bulk as bulk_service
+from wazo_router_confd.services.pagination import fetch_page
 from wazo_router_confd.services import tenant as tenant_service
 
 
-def get_domain_by_id(db: Session, principal: Principal, domain_id: int) -> Domain:
-    db_domain = db.query(Domain).filter(Domain.id == domain_id)
+def query_domain(principal: Principal, domain_id: int) -> Query:
+    query = Query(Domain).filter(Domain.id == domain_id)
     if principal is not None and principal.tenant_uuids:
-        db_domain = db_domain.filter(Domain.tenant_uuid.in_(principal.tenant_uuids))
-    return db_domain.first()
+        query = query.filter(Domain.tenant_uuid.in_(principal.tenant_uuids))
+    return query
+
+
+def get_domain_by_id(db: Session, principal: Principal, domain_id: int) -> Domain:
+    return query_domain(principal, domain_id).with_session(db).first()
+
+
+async def fetch_domain(
+    pool: aiopg.Pool, principal: Principal, domain_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(pool, query_domain(principal, domain_id))
 
 
 def get_domain(db: Session, principal: Principal, domain: str) -> Domain:
@@ -23,40 +41,50 @@ def get_domain(db: Session, principal: Principal, domain: str) -> Domain:
     return db_domain.first()
 
 
-def get_domains(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_domains(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.DomainList:
-    items = db.query(Domain)
+    items = Query(Domain)
     if principal is not None and principal.tenant_uuid:
         items = items.filter(Domain.tenant_uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.DomainList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, Domain.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.DomainList(items=items, next=next_cursor)
+
+
+def build_domain(domain: schema.DomainCreate) -> Domain:
+    return Domain(domain=domain.domain, tenant_uuid=domain.tenant_uuid)
 
 
 def create_domain(
     db: Session, principal: Principal, domain: schema.DomainCreate
 ) -> Domain:
     domain.tenant_uuid = tenant_service.get_uuid(principal, db, domain.tenant_uuid)
-    db_domain = Domain(domain=domain.domain, tenant_uuid=domain.tenant_uuid)
+    db_domain = build_domain(domain)
     db.add(db_domain)
     db.commit()
     db.refresh(db_domain)
     return db_domain
 
 
+def apply_domain_update(db_domain: Domain, domain: schema.DomainUpdate):
+    db_domain.domain = domain.domain if domain.domain is not None else db_domain.domain
+    db_domain.tenant_uuid = (
+        domain.tenant_uuid if domain.tenant_uuid is not None else db_domain.tenant_uuid
+    )
+
+
 def update_domain(
     db: Session, principal: Principal, domain_id: int, domain: schema.DomainUpdate
 ) -> Domain:
     db_domain = get_domain_by_id(db, principal, domain_id)
     if db_domain is not None:
-        db_domain.domain = (
-            domain.domain if domain.domain is not None else db_domain.domain
-        )
-        db_domain.tenant_uuid = (
-            domain.tenant_uuid
-            if domain.tenant_uuid is not None
-            else db_domain.tenant_uuid
-        )
+        apply_domain_update(db_domain, domain)
         db.commit()
         db.refresh(db_domain)
     return db_domain
@@ -68,3 +96,28 @@ def delete_domain(db: Session, principal: Principal, domain_id: int) -> Domain:
         db.delete(db_domain)
         db.commit()
     return db_domain
+
+
+def bulk_domains(
+    db: Session, principal: Principal, operations: List[bulk_schema.BulkOperation]
+) -> bulk_schema.BulkResult:
+    get_tenant_uuid = bulk_service.get_tenant_uuid_getter(db, principal)
+
+    def build(domain: schema.DomainCreate) -> Domain:
+        domain.tenant_uuid = get_tenant_uuid(domain.tenant_uuid)
+        return build_domain(domain)
+
+    query = db.query(Domain)
+    if principal is not None and principal.tenant_uuids:
+        query = query.filter(Domain.tenant_uuid.in_(principal.tenant_uuids))
+    return bulk_service.apply_bulk_operations(
+        db,
+        Domain,
+        query,
+        operations,
+        schema.DomainCreate,
+        schema.DomainUpdate,
+        build,
+        apply_domain_update,
+        unique=Domain.domain,
+    )
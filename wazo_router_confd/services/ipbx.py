@@ -1,37 +1,59 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from sqlalchemy.orm import Session
+from typing import Any, Dict, List, Optional
+
+import aiopg  # type: ignore
+
+from sqlalchemy.orm import Query, Session
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_one
 from wazo_router_confd.models.domain import Domain
 from wazo_router_confd.models.ipbx import IPBX
+from wazo_router_confd.schemas import bulk as bulk_schema
 from wazo_router_confd.schemas import ipbx as schema
+from wazo_router_confd.services import bulk as bulk_service
+from wazo_router_confd.services.pagination import fetch_page
 from wazo_router_confd.services import password as password_service
 from wazo_router_confd.services import tenant as tenant_service
 
 
-def get_ipbx(db: Session, principal: Principal, ipbx_id: int) -> IPBX:
-    db_ipbx = db.query(IPBX).filter(IPBX.id == ipbx_id)
+def query_ipbx(principal: Principal, ipbx_id: int) -> Query:
+    query = Query(IPBX).filter(IPBX.id == ipbx_id)
     if principal is not None and principal.tenant_uuids:
-        db_ipbx = db_ipbx.filter(IPBX.tenant_uuid.in_(principal.tenant_uuids))
-    return db_ipbx.first()
+        query = query.filter(IPBX.tenant_uuid.in_(principal.tenant_uuids))
+    return query
+
+
+def get_ipbx(db: Session, principal: Principal, ipbx_id: int) -> IPBX:
+    return query_ipbx(principal, ipbx_id).with_session(db).first()
 
 
-def get_ipbxs(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_ipbx(
+    pool: aiopg.Pool, principal: Principal, ipbx_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(pool, query_ipbx(principal, ipbx_id))
+
+
+async def fetch_ipbxs(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.IPBXList:
-    items = db.query(IPBX)
+    items = Query(IPBX)
     if principal is not None and principal.tenant_uuid:
         items = items.filter(IPBX.tenant_uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.IPBXList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, IPBX.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.IPBXList(items=items, next=next_cursor)
 
 
-def create_ipbx(db: Session, principal: Principal, ipbx: schema.IPBXCreate) -> IPBX:
-    ipbx.tenant_uuid = tenant_service.get_uuid(principal, db, ipbx.tenant_uuid)
-    domain = db.query(Domain).filter(Domain.id == ipbx.domain_id).first()
-    db_ipbx = IPBX(
+def build_ipbx(ipbx: schema.IPBXCreate, domain: Domain) -> IPBX:
+    return IPBX(
         tenant_uuid=ipbx.tenant_uuid,
         domain_id=ipbx.domain_id,
         normalization_profile_id=ipbx.normalization_profile_id,
@@ -47,49 +69,55 @@ def create_ipbx(db: Session, principal: Principal, ipbx: schema.IPBXCreate) -> I
         ),
         realm=ipbx.realm,
     )
+
+
+def create_ipbx(db: Session, principal: Principal, ipbx: schema.IPBXCreate) -> IPBX:
+    ipbx.tenant_uuid = tenant_service.get_uuid(principal, db, ipbx.tenant_uuid)
+    domain = db.query(Domain).filter(Domain.id == ipbx.domain_id).first()
+    db_ipbx = build_ipbx(ipbx, domain)
     db.add(db_ipbx)
     db.commit()
     db.refresh(db_ipbx)
     return db_ipbx
 
 
+def apply_ipbx_update(db: Session, db_ipbx: IPBX, ipbx: schema.IPBXUpdate):
+    db_ipbx.tenant_uuid = (
+        ipbx.tenant_uuid if ipbx.tenant_uuid is not None else db_ipbx.tenant_uuid
+    )
+    db_ipbx.domain_id = (
+        ipbx.domain_id if ipbx.domain_id is not None else db_ipbx.domain_id
+    )
+    db_ipbx.normalization_profile_id = (
+        ipbx.normalization_profile_id
+        if ipbx.normalization_profile_id is not None
+        else db_ipbx.normalization_profile_id
+    )
+    db_ipbx.customer = ipbx.customer if ipbx.customer is not None else db_ipbx.customer
+    db_ipbx.ip_fqdn = ipbx.ip_fqdn if ipbx.ip_fqdn is not None else db_ipbx.ip_fqdn
+    db_ipbx.port = ipbx.port if ipbx.port is not None else db_ipbx.port
+    db_ipbx.ip_address = (
+        ipbx.ip_address if ipbx.ip_address is not None else db_ipbx.ip_address
+    )
+    db_ipbx.registered = (
+        ipbx.registered if ipbx.registered is not None else db_ipbx.registered
+    )
+    db_ipbx.username = ipbx.username if ipbx.username is not None else db_ipbx.username
+    if ipbx.password is not None:
+        domain = db.query(Domain).filter(Domain.id == ipbx.domain_id).first()
+        db_ipbx.password = password_service.hash(ipbx.password)
+        db_ipbx.password_ha1 = password_service.hash_ha1(
+            ipbx.username, domain.domain, ipbx.password
+        )
+    db_ipbx.realm = ipbx.realm if ipbx.realm is not None else db_ipbx.realm
+
+
 def update_ipbx(
     db: Session, principal: Principal, ipbx_id: int, ipbx: schema.IPBXUpdate
 ) -> IPBX:
     db_ipbx = get_ipbx(db, principal, ipbx_id)
     if db_ipbx is not None:
-        db_ipbx.tenant_uuid = (
-            ipbx.tenant_uuid if ipbx.tenant_uuid is not None else db_ipbx.tenant_uuid
-        )
-        db_ipbx.domain_id = (
-            ipbx.domain_id if ipbx.domain_id is not None else db_ipbx.domain_id
-        )
-        db_ipbx.normalization_profile_id = (
-            ipbx.normalization_profile_id
-            if ipbx.normalization_profile_id is not None
-            else db_ipbx.normalization_profile_id
-        )
-        db_ipbx.customer = (
-            ipbx.customer if ipbx.customer is not None else db_ipbx.customer
-        )
-        db_ipbx.ip_fqdn = ipbx.ip_fqdn if ipbx.ip_fqdn is not None else db_ipbx.ip_fqdn
-        db_ipbx.port = ipbx.port if ipbx.port is not None else db_ipbx.port
-        db_ipbx.ip_address = (
-            ipbx.ip_address if ipbx.ip_address is not None else db_ipbx.ip_address
-        )
-        db_ipbx.registered = (
-            ipbx.registered if ipbx.registered is not None else db_ipbx.registered
-        )
-        db_ipbx.username = (
-            ipbx.username if ipbx.username is not None else db_ipbx.username
-        )
-        if ipbx.password is not None:
-            domain = db.query(Domain).filter(Domain.id == ipbx.domain_id).first()
-            db_ipbx.password = password_service.hash(ipbx.password)
-            db_ipbx.password_ha1 = password_service.hash_ha1(
-                ipbx.username, domain.domain, ipbx.password
-            )
-        db_ipbx.realm = ipbx.realm if ipbx.realm is not None else db_ipbx.realm
+        apply_ipbx_update(db, db_ipbx, ipbx)
         db.commit()
         db.refresh(db_ipbx)
     return db_ipbx
@@ -101,3 +129,37 @@ def delete_ipbx(db: Session, principal: Principal, ipbx_id: int) -> IPBX:
         db.delete(db_ipbx)
         db.commit()
     return db_ipbx
+
+
+def bulk_ipbxs(
+    db: Session, principal: Principal, operations: List[bulk_schema.BulkOperation]
+) -> bulk_schema.BulkResult:
+    get_tenant_uuid = bulk_service.get_tenant_uuid_getter(db, principal)
+    domains: Dict[int, Optional[Domain]] = {}
+
+    def build(ipbx: schema.IPBXCreate) -> IPBX:
+        ipbx.tenant_uuid = get_tenant_uuid(ipbx.tenant_uuid)
+        if ipbx.domain_id not in domains:
+            domains[ipbx.domain_id] = (
+                db.query(Domain).filter(Domain.id == ipbx.domain_id).first()
+            )
+        if domains[ipbx.domain_id] is None:
+            raise ValueError("domain_id: no domain %s" % ipbx.domain_id)
+        return build_ipbx(ipbx, domains[ipbx.domain_id])
+
+    def update(db_ipbx: IPBX, ipbx: schema.IPBXUpdate):
+        apply_ipbx_update(db, db_ipbx, ipbx)
+
+    query = db.query(IPBX)
+    if principal is not None and principal.tenant_uuids:
+        query = query.filter(IPBX.tenant_uuid.in_(principal.tenant_uuids))
+    return bulk_service.apply_bulk_operations(
+        db,
+        IPBX,
+        query,
+        operations,
+        schema.IPBXCreate,
+        schema.IPBXUpdate,
+        build,
+        update,
+    )
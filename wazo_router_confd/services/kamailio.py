@@ -1,23 +1,47 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import asyncio
+import hmac
+import json
+import os
 import re
 
+from copy import deepcopy
+from time import monotonic
+
 import aiopg  # type: ignore
 
-from typing import Any, Callable, List, Optional, Tuple
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from psycopg2.extras import DictCursor  # type: ignore
+from pydantic import ValidationError
 
-from wazo_router_confd.models.normalization import NormalizationProfile
 from wazo_router_confd.redis import Redis
 from wazo_router_confd.schemas import kamailio as schema
 from wazo_router_confd.schemas import cdr as cdr_schema
 from wazo_router_confd.services import password as password_service
 from wazo_router_confd.services import normalization as normalization_service
+from wazo_router_confd.services import regex as regex_service
+from wazo_router_confd.tracing import span
+
+if TYPE_CHECKING:  # pragma: no cover
+    from wazo_router_confd.cdr_buffer import CDRBuffer  # noqa
+    from wazo_router_confd.routing_engine import RoutingEngine  # noqa
 
 re_protocol_local_part_and_domain = re.compile(
-    r'^([^:]+:)?([^@]+)@([^@:]+)(:[0-9]+)?$'
+    r'^([^:]+:)?([^@]+)@([^@:;?]+)(:[0-9]+)?([;?].*)?$'
 ).match
 
 
@@ -25,361 +49,618 @@ def split_uri_to_parts(uri: str) -> Tuple[str, str, str, str]:
     m = re_protocol_local_part_and_domain(uri)
     if m is None:
         return ('', '', '', '')
-    protocol, local_part, domain_name, port_number = m.groups()
+    protocol, local_part, domain_name, port_number, _ = m.groups()
     return (protocol or '', local_part, domain_name, port_number or '')
 
 
+def build_route(
+    dst_uri: str,
+    from_name: Optional[str],
+    from_uri: str,
+    to_name: Optional[str],
+    to_uri: str,
+) -> dict:
+    return {
+        "dst_uri": dst_uri,
+        "path": "",
+        "socket": "",
+        "headers": {
+            "from": {"display": from_name, "uri": from_uri},
+            "to": {"display": to_name, "uri": to_uri},
+            "extra": "",
+        },
+        "branch_flags": 8,
+        "fr_timer": 5000,
+        "fr_inv_timer": 30000,
+    }
+
+
+def build_rtjson(
+    routes: List[dict],
+    carrier_trunk_auth: Optional[dict] = None,
+    ipbx_auth: Optional[dict] = None,
+) -> dict:
+    # build the JSON document, compatible with the rtjson Kamailio module form
+    rtjson = (
+        {"success": True, "version": "1.0", "routing": "serial", "routes": routes}
+        if routes
+        else {"success": False}
+    )
+    # update with carrier trunk auth parameters, if set
+    if carrier_trunk_auth is not None:
+        rtjson.update(carrier_trunk_auth)
+    # update with ipbx auth parameters, if set
+    elif ipbx_auth is not None:
+        rtjson.update(ipbx_auth)
+    return rtjson
+
+
+def get_canonical_uri(uri: str) -> str:
+    # the uri parameters and headers do not affect the routing
+    protocol, local_part, domain_name, port_number = split_uri_to_parts(uri)
+    return "%s%s@%s%s" % (protocol, local_part, domain_name, port_number)
+
+
+def get_password_digest(password: str, secret: bytes) -> str:
+    # keyed by the secret every instance sharing the cache uses
+    return hmac.new(secret, password.encode(), 'sha256').hexdigest()
+
+
+def is_negative_routing_response(value: dict) -> bool:
+    return not (value.get('rtjson') or {}).get('success')
+
+
+def is_negative_auth_response(value: dict) -> bool:
+    return not value.get('success')
+
+
+def set_routing_display_names(value: dict, request: schema.RoutingRequest) -> dict:
+    # the display names are not part of the cache key, fill in the requested ones
+    value = deepcopy(value)
+    for route in (value.get('rtjson') or {}).get('routes', []):
+        route['headers']['from']['display'] = request.from_name
+        route['headers']['to']['display'] = request.to_name
+    return value
+
+
 async def get_cached_dict_from_redis(
-    redis: Redis, redis_key: str, callback: Callable
+    redis: Redis,
+    redis_key: str,
+    callback: Callable,
+    is_negative: Callable[[dict], bool] = lambda value: False,
 ) -> Optional[dict]:
-    value = await redis.get_value(redis_key)
-    if value is None:
-        value = await callback()
-        await redis.set_value(redis_key, value)
-    return value
+    async def compute(keys: List[str]) -> Dict[str, Tuple[dict, Set[str]]]:
+        # the callback returns the value along with its cache tags
+        return {redis_key: await callback()}
 
+    values = await redis.get_or_set_values([redis_key], compute, is_negative)
+    return values[redis_key]
 
-async def get_normalization_profile_by_id(
-    conn: Any, redis: Redis, normalization_profile_id: int
-) -> Optional[NormalizationProfile]:
-    redis_key = 'normalization_profiles:%s' % normalization_profile_id
 
-    async def callback() -> dict:
-        async with conn.cursor(cursor_factory=DictCursor) as cur:
-            await cur.execute(
-                "SELECT * from normalization_profiles WHERE id = %s;",
-                [normalization_profile_id],
-            )
-            row = await cur.fetchone()
-            return (
-                dict(
-                    name=row['name'],
-                    country_code=row['country_code'],
-                    area_code=row['area_code'],
-                    intl_prefix=row['intl_prefix'],
-                    ld_prefix=row['ld_prefix'],
-                    always_intl_prefix_plus=row['always_intl_prefix_plus'],
-                    always_ld=row['always_ld'],
-                )
-                if row is not None
-                else {}
-            )
+# normalization profiles, with their rules ordered by priority
+ROUTING_PROFILES_SQL = (
+    "SELECT normalization_profiles.id, normalization_profiles.always_intl_prefix_plus, "
+    "COALESCE(("
+    "SELECT json_agg(json_build_object("
+    "'rule_type', normalization_rules.rule_type, "
+    "'match_prefix', normalization_rules.match_prefix, "
+    "'match_regex', normalization_rules.match_regex, "
+    "'replace_regex', normalization_rules.replace_regex"
+    ") ORDER BY normalization_rules.priority, normalization_rules.id) "
+    "FROM normalization_rules "
+    "WHERE normalization_rules.profile_id = normalization_profiles.id"
+    "), '[]') AS rules "
+    "FROM normalization_profiles "
+    "WHERE normalization_profiles.id IN ({profile_ids})"
+)
 
-    profile = await get_cached_dict_from_redis(redis, redis_key, callback)
-    normalization_profile = (
-        NormalizationProfile(
-            name=profile['name'],
-            country_code=profile['country_code'],
-            area_code=profile['area_code'],
-            intl_prefix=profile['intl_prefix'],
-            ld_prefix=profile['ld_prefix'],
-            always_intl_prefix_plus=profile['always_intl_prefix_plus'],
-            always_ld=profile['always_ld'],
-        )
-        if profile is not None and profile.get('country_code')
-        else None
+# ipbxs linked to the DIDs matching a prefix of the number, longest prefix first
+ROUTING_DID_IPBXS_SQL = (
+    "SELECT json_agg(did_ipbx ORDER BY length(did_ipbx.did_prefix) DESC, "
+    "did_ipbx.id, did_ipbx.did_id) AS ipbxs "
+    "FROM ("
+    "SELECT ipbx.*, dids.id AS did_id, dids.did_regex, dids.did_prefix "
+    "FROM ipbx JOIN dids ON (dids.ipbx_id = ipbx.id) "
+    "WHERE dids.did_prefix IN ("
+    "SELECT left(lookups.number, i) FROM generate_series(0, length(lookups.number)) AS i"
+    ") AND dids.did_regex IS NOT NULL "
+    "AND (lookups.tenant_uuid IS NULL OR ipbx.tenant_uuid = lookups.tenant_uuid)"
+    "{where}"
+    ") AS did_ipbx"
+)
+
+# one row of candidates for each lookup, in the order of the lookups
+ROUTING_SQL = (
+    "WITH lookups AS ("
+    "SELECT * FROM unnest("
+    "%(source_ipbx_ids)s::integer[], %(source_carrier_trunk_ids)s::integer[], "
+    "%(domains)s::varchar[], %(numbers)s::varchar[], %(source_ips)s::varchar[], "
+    "%(tenant_uuids)s::uuid[]"
+    ") WITH ORDINALITY AS lookups("
+    "source_ipbx_id, source_carrier_trunk_id, domain, number, source_ip, tenant_uuid, "
+    "position)"
+    "), candidates AS ("
+    "SELECT lookups.position, source.normalization_profile_id AS source_profile_id, "
+    "domain_ipbx.ipbx AS domain_ipbx, did_ipbxs.ipbxs AS did_ipbxs, "
+    "carrier_trunk.carrier_trunk, "
+    "(SELECT json_agg(DISTINCT ipbx.tenant_uuid) FROM ipbx "
+    "WHERE ipbx.ip_fqdn = lookups.source_ip) AS source_tenant_uuids "
+    "FROM lookups "
+    "LEFT JOIN LATERAL ("
+    "SELECT ipbx.normalization_profile_id FROM ipbx "
+    "WHERE ipbx.id = lookups.source_ipbx_id "
+    "UNION ALL "
+    "SELECT carrier_trunks.normalization_profile_id FROM carrier_trunks "
+    "WHERE carrier_trunks.id = lookups.source_carrier_trunk_id "
+    "LIMIT 1"
+    ") AS source ON TRUE "
+    "LEFT JOIN LATERAL ("
+    "SELECT row_to_json(ipbx) AS ipbx "
+    "FROM ipbx JOIN domains ON (ipbx.domain_id = domains.id) "
+    "WHERE domains.domain = lookups.domain "
+    "AND (lookups.tenant_uuid IS NULL OR ipbx.tenant_uuid = lookups.tenant_uuid) "
+    "ORDER BY ipbx.id LIMIT 1"
+    ") AS domain_ipbx ON TRUE "
+    "LEFT JOIN LATERAL ("
+    + ROUTING_DID_IPBXS_SQL.format(where=" AND domain_ipbx.ipbx IS NULL")
+    + ") AS did_ipbxs ON TRUE "
+    "LEFT JOIN LATERAL ("
+    "SELECT row_to_json(carrier_trunks) AS carrier_trunk "
+    "FROM carrier_trunks JOIN carriers ON (carrier_trunks.carrier_id = carriers.id) "
+    "JOIN ipbx ON (ipbx.tenant_uuid = carriers.tenant_uuid) "
+    "WHERE ipbx.ip_fqdn = lookups.source_ip "
+    "AND (lookups.tenant_uuid IS NULL OR carriers.tenant_uuid = lookups.tenant_uuid) "
+    "ORDER BY carrier_trunks.id LIMIT 1"
+    ") AS carrier_trunk ON TRUE"
+    "), profiles AS ("
+    + ROUTING_PROFILES_SQL.format(
+        profile_ids="SELECT source_profile_id FROM candidates "
+        "UNION ALL "
+        "SELECT (domain_ipbx->>'normalization_profile_id')::integer FROM candidates "
+        "UNION ALL "
+        "SELECT (json_array_elements(did_ipbxs)->>'normalization_profile_id')::integer "
+        "FROM candidates "
+        "UNION ALL "
+        "SELECT (carrier_trunk->>'normalization_profile_id')::integer FROM candidates"
     )
-    return normalization_profile
+    + ") SELECT "
+    "(SELECT json_agg(candidates ORDER BY position) FROM candidates) AS candidates, "
+    "(SELECT json_agg(profiles) FROM profiles) AS profiles;"
+)
 
+# DID candidates only, for the numbers rewritten by the source normalization
+ROUTING_DID_SQL = (
+    "WITH lookups AS ("
+    "SELECT * FROM unnest(%(numbers)s::varchar[], %(tenant_uuids)s::uuid[]) "
+    "WITH ORDINALITY AS lookups(number, tenant_uuid, position)"
+    "), candidates AS ("
+    "SELECT lookups.position, did_ipbxs.ipbxs AS did_ipbxs "
+    "FROM lookups "
+    "LEFT JOIN LATERAL ("
+    + ROUTING_DID_IPBXS_SQL.format(where="")
+    + ") AS did_ipbxs ON TRUE"
+    "), profiles AS ("
+    + ROUTING_PROFILES_SQL.format(
+        profile_ids="SELECT (json_array_elements(did_ipbxs)->>'normalization_profile_id')::integer "
+        "FROM candidates"
+    )
+    + ") SELECT "
+    "(SELECT json_agg(candidates ORDER BY position) FROM candidates) AS candidates, "
+    "(SELECT json_agg(profiles) FROM profiles) AS profiles;"
+)
 
-async def routing(
-    pool: aiopg.Pool, redis: Redis, request: schema.RoutingRequest
-) -> schema.RoutingResponse:
-    redis_key = 'kamailio_routing:%s:%s_%s_%s_%s' % (
+
+class RoutingLookup(NamedTuple):
+    source_ipbx_id: Optional[int]
+    source_carrier_trunk_id: Optional[int]
+    domain: str
+    number: str
+    source_ip: Optional[str]
+    tenant_uuid: Optional[str]
+
+
+async def get_routing_candidates(
+    conn: Any, lookups: List[RoutingLookup]
+) -> Tuple[List[dict], Dict[int, dict]]:
+    """
+    Fetch in a single statement, for each lookup, the source normalization
+    profile, the ipbx linked to the domain, the ipbxs linked to the DIDs
+    matching the number and the outbound carrier trunk, along with all the
+    normalization profiles they use.
+    """
+    args = dict(
+        source_ipbx_ids=[x.source_ipbx_id for x in lookups],
+        source_carrier_trunk_ids=[x.source_carrier_trunk_id for x in lookups],
+        domains=[x.domain for x in lookups],
+        numbers=[x.number for x in lookups],
+        source_ips=[x.source_ip for x in lookups],
+        tenant_uuids=[x.tenant_uuid for x in lookups],
+    )
+    async with conn.cursor(cursor_factory=DictCursor) as cur:
+        await cur.execute(ROUTING_SQL, args)
+        row = await cur.fetchone()
+    return (
+        row['candidates'] or [],
+        {x['id']: x for x in row['profiles'] or []},
+    )
+
+
+async def get_did_routing_candidates(
+    conn: Any, lookups: List[RoutingLookup]
+) -> Tuple[List[dict], Dict[int, dict]]:
+    args = dict(
+        numbers=[x.number for x in lookups],
+        tenant_uuids=[x.tenant_uuid for x in lookups],
+    )
+    async with conn.cursor(cursor_factory=DictCursor) as cur:
+        await cur.execute(ROUTING_DID_SQL, args)
+        row = await cur.fetchone()
+    return (
+        row['candidates'] or [],
+        {x['id']: x for x in row['profiles'] or []},
+    )
+
+
+def get_routing_redis_key(request: schema.RoutingRequest) -> str:
+    # the source port, the display names and the uri parameters are left out,
+    # the domain and username only matter if the request is authenticated
+    return 'kamailio_routing:%s:%s:%s:%s' % (
+        request.source_ip or '*',
+        "%s_%s" % (request.domain or '*', request.username or '*')
+        if request.auth
+        else '*',
+        get_canonical_uri(request.from_uri),
+        get_canonical_uri(request.to_uri),
+    )
+
+
+def get_auth_redis_key(request: schema.AuthRequest, secret: bytes) -> str:
+    # the source port is left out, the password is hashed
+    return 'kamailio_auth:%s:%s_%s:%s' % (
         request.source_ip or '*',
-        request.source_port or 5060,
         request.domain or '*',
         request.username or '*',
-        request.to_uri or '*',
+        get_password_digest(request.password, secret) if request.password else '*',
     )
 
-    async def callback() -> dict:
-        # perform authorization the request, if needed
-        auth_response = (
-            await auth(
-                pool,
-                redis,
-                request=schema.AuthRequest(
-                    source_ip=request.source_ip,
-                    source_port=request.source_port,
-                    domain=request.domain,
-                    username=request.username,
-                ),
+
+def get_auth_cache_tags(request: schema.AuthRequest, response: dict) -> Set[str]:
+    tags = {'auth_domain:%s' % (request.domain or '*')}
+    if request.source_ip:
+        tags.update(['auth_trunk_ip:%s' % request.source_ip, 'auth_trunk_ip:*'])
+    if response.get('ipbx_id'):
+        tags.add('ipbx:%s' % response['ipbx_id'])
+    if response.get('carrier_trunk_id'):
+        tags.add('carrier_trunk:%s' % response['carrier_trunk_id'])
+    if response.get('tenant_uuid'):
+        tags.add('tenant:%s' % response['tenant_uuid'])
+    return tags
+
+
+def build_routing_response(
+    request: schema.RoutingRequest,
+    auth_response: Optional[schema.AuthResponse],
+    lookup: RoutingLookup,
+    candidates: dict,
+    profiles: Dict[int, dict],
+    from_local_part: str,
+    local_part: str,
+    budget: regex_service.RegexBudget,
+) -> Tuple[dict, Set[str]]:
+    # routing
+    routes = []
+    from_protocol, _, from_domain_name, from_port_number = split_uri_to_parts(
+        request.from_uri
+    )
+    protocol, _, domain_name, port_number = split_uri_to_parts(request.to_uri)
+    # cache tags of the inputs the routing depends on
+    tags = {'domain:%s' % domain_name}
+    if candidates['source_profile_id'] is not None:
+        tags.add('normalization_profile:%s' % candidates['source_profile_id'])
+    # route to the ipbx linked to the domain, or else to the first DID matching
+    ipbx = candidates['domain_ipbx']
+    if ipbx is None:
+        tags.update(
+            'did_prefix:%s' % number[:i]
+            for number in {lookup.number, local_part}
+            for i in range(0, len(number) + 1)
+        )
+        with span('routing.did_regex'):
+            # the regexes failing the validation of the API never match
+            for did_ipbx in candidates['did_ipbxs'] or []:
+                if budget.match(did_ipbx['did_regex'], local_part):
+                    ipbx = did_ipbx
+                    break
+    # build a route for the ipbx
+    ipbx_auth = None
+    if ipbx is not None:
+        tags.update(['ipbx:%s' % ipbx['id'], 'tenant:%s' % ipbx['tenant_uuid']])
+        if ipbx['normalization_profile_id'] is not None:
+            tags.add('normalization_profile:%s' % ipbx['normalization_profile_id'])
+        normalization_profile = profiles.get(ipbx['normalization_profile_id'])
+        # normalize from uri
+        normalized_local_part = normalization_service.normalize_number(
+            from_local_part, 2, normalization_profile, budget=budget
+        )
+        normalized_from_uri = "%s%s@%s" % (
+            from_protocol,
+            normalized_local_part,
+            from_domain_name,
+        )
+        # normalize to uri
+        normalized_local_part = normalization_service.normalize_number(
+            local_part, 2, normalization_profile, budget=budget
+        )
+        normalized_to_uri = "%s%s@%s" % (protocol, normalized_local_part, domain_name)
+        #
+        routes.append(
+            build_route(
+                "sip:%s:%s" % (ipbx['ip_fqdn'], ipbx['port']),
+                request.from_name,
+                normalized_from_uri,
+                request.to_name,
+                normalized_to_uri,
             )
-            if request.auth
-            else None
         )
-        async with pool.acquire() as conn:
-            # routing
-            routes = []
-            # get the domain name from the to uri
-            (
-                from_protocol,
-                from_local_part,
-                from_domain_name,
-                from_port_number,
-            ) = split_uri_to_parts(request.from_uri)
-            protocol, local_part, domain_name, port_number = split_uri_to_parts(
-                request.to_uri
+        # if ipbx requires it, set the auth parameters
+        if (
+            ipbx['username'] is not None
+            and ipbx['password'] is not None
+            and ipbx['realm'] is not None
+        ):
+            ipbx_auth = dict(
+                auth_username=ipbx['username'],
+                auth_password=ipbx['password'],
+                realm=ipbx['realm'],
             )
-            # normalize according ipbx/carrier trunk source
-            normalization_profile = None
-            if auth_response is not None and auth_response.ipbx_id:
-                sql = "SELECT ipbx.* " "FROM ipbx " "WHERE ipbx.id = %s"
-                async with conn.cursor(cursor_factory=DictCursor) as cur:
-                    await cur.execute(sql, [auth_response.ipbx_id])
-                    ipbx = await cur.fetchone()
-                    if (
-                        ipbx is not None
-                        and ipbx['normalization_profile_id'] is not None
-                    ):
-                        normalization_profile = await get_normalization_profile_by_id(
-                            conn, redis, ipbx['normalization_profile_id']
-                        )
-            elif auth_response is not None and auth_response.carrier_trunk_id:
-                sql = (
-                    "SELECT carrier_trunks.* "
-                    "FROM carrier_trunks "
-                    "WHERE carrier_trunks.id = %s"
-                )
-                async with conn.cursor(cursor_factory=DictCursor) as cur:
-                    await cur.execute(sql, [auth_response.carrier_trunk_id])
-                    carrier_trunk = await cur.fetchone()
-                    if (
-                        carrier_trunk is not None
-                        and carrier_trunk['normalization_profile_id'] is not None
-                    ):
-                        normalization_profile = await get_normalization_profile_by_id(
-                            conn, redis, carrier_trunk['normalization_profile_id']
-                        )
-            from_local_part = await normalization_service.normalize_local_number_to_e164(
-                conn, from_local_part, profile=normalization_profile
+    # route by carrier trunk if the package is coming from a known IPBX
+    carrier_trunk_auth = None
+    carrier_trunk = candidates['carrier_trunk']
+    if request.source_ip:
+        tags.add('source_ip:%s' % request.source_ip)
+    for tenant_uuid in candidates['source_tenant_uuids'] or []:
+        tags.add('tenant_trunks:%s' % tenant_uuid)
+    if carrier_trunk is not None:
+        tags.update(
+            [
+                'carrier_trunk:%s' % carrier_trunk['id'],
+                'tenant:%s' % carrier_trunk['tenant_uuid'],
+            ]
+        )
+        if carrier_trunk['normalization_profile_id'] is not None:
+            tags.add(
+                'normalization_profile:%s' % carrier_trunk['normalization_profile_id']
             )
-            local_part = await normalization_service.normalize_local_number_to_e164(
-                conn, local_part, profile=normalization_profile
+        normalization_profile = profiles.get(carrier_trunk['normalization_profile_id'])
+        # normalize from uri
+        normalized_local_part = normalization_service.normalize_number(
+            from_local_part, 2, normalization_profile, budget=budget
+        )
+        normalized_from_uri = "%s%s@%s%s" % (
+            from_protocol,
+            normalized_local_part,
+            from_domain_name,
+            from_port_number,
+        )
+        # normalize to uri
+        normalized_local_part = normalization_service.normalize_number(
+            local_part, 2, normalization_profile, budget=budget
+        )
+        normalized_to_uri = "%s%s@%s%s" % (
+            protocol,
+            normalized_local_part,
+            domain_name,
+            port_number,
+        )
+        #
+        routes.append(
+            build_route(
+                "sip:%s:%s"
+                % (carrier_trunk['sip_proxy'], carrier_trunk['sip_proxy_port']),
+                request.from_name,
+                normalized_from_uri,
+                request.to_name,
+                normalized_to_uri,
             )
-            # get all the ipbxs linked to that domain
-            where = ["domains.domain = %s"]
-            where_args: List[Any] = [domain_name]
-            # filter by tenant, if the request is authenticated
-            if auth_response is not None and auth_response.tenant_uuid:
-                where.append("ipbx.tenant_uuid = %s")
-                where_args.append(auth_response.tenant_uuid)
-            # get the list of ipbx, ordered by id
-            ipbxs = []
-            sql = (
-                "SELECT ipbx.* "
-                "FROM ipbx JOIN domains ON (ipbx.domain_id = domains.id) "
-                "WHERE %s ORDER BY ipbx.id LIMIT 1;" % " AND ".join(where)
+        )
+        # if carrier trunk is registered, set the auth parameters
+        if (
+            carrier_trunk['auth_username'] is not None
+            and carrier_trunk['auth_password'] is not None
+            and carrier_trunk['realm'] is not None
+        ):
+            carrier_trunk_auth = dict(
+                auth_username=carrier_trunk['auth_username'],
+                auth_password=carrier_trunk['auth_password'],
+                realm=carrier_trunk['realm'],
             )
-            async with conn.cursor(cursor_factory=DictCursor) as cur:
-                await cur.execute(sql, where_args)
-                ipbx = await cur.fetchone()
-                if ipbx is not None:
-                    ipbxs.append(ipbx)
-            # get all the ipbxs linked to that DID
-            prefixes = [local_part[:i] for i in range(0, min(10, len(local_part)))]
-            where = ["dids.did_prefix = ANY(%s)"]
-            where_args = [prefixes]
-            # filter by tenant, if the request is authenticated
-            if auth_response is not None and auth_response.tenant_uuid:
-                where.append("ipbx.tenant_uuid = %s")
-                where_args.append(auth_response.tenant_uuid)
-            # get the list of ipbx, ordered by id
-            sql = (
-                "SELECT ipbx.*, dids.did_regex "
-                "FROM ipbx JOIN dids ON (dids.ipbx_id = ipbx.id) "
-                "WHERE %s ORDER BY ipbx.id;" % " AND ".join(where)
+    # return
+    response = {
+        "auth": dict(auth_response) if auth_response else None,
+        "rtjson": build_rtjson(routes, carrier_trunk_auth, ipbx_auth),
+    }
+    return response, tags
+
+
+async def resolve_routing(
+    pool: aiopg.Pool, redis: Redis, requests: List[schema.RoutingRequest]
+) -> List[Tuple[dict, Set[str]]]:
+    # perform authorization of the requests, if needed
+    auth_requests = [
+        schema.AuthRequest(
+            source_ip=request.source_ip,
+            source_port=request.source_port,
+            domain=request.domain,
+            username=request.username,
+        )
+        if request.auth
+        else None
+        for request in requests
+    ]
+    auth_responses: List[Optional[schema.AuthResponse]] = [None] * len(requests)
+    auth_positions = [i for i, request in enumerate(requests) if request.auth]
+    with span('routing.auth'):
+        auth_results = await asyncio.gather(
+            *[auth(pool, redis, request=auth_requests[i]) for i in auth_positions]
+        )
+    for i, auth_response in zip(auth_positions, auth_results):
+        auth_responses[i] = auth_response
+    # get the domain name and the number from the to uri
+    lookups = []
+    for request, auth_response in zip(requests, auth_responses):
+        _, local_part, domain_name, _ = split_uri_to_parts(request.to_uri)
+        lookups.append(
+            RoutingLookup(
+                source_ipbx_id=auth_response.ipbx_id if auth_response else None,
+                source_carrier_trunk_id=(
+                    auth_response.carrier_trunk_id
+                    if auth_response and not auth_response.ipbx_id
+                    else None
+                ),
+                domain=domain_name,
+                number=normalization_service.re_clean_number('', local_part),
+                source_ip=request.source_ip,
+                tenant_uuid=(
+                    str(auth_response.tenant_uuid)
+                    if auth_response and auth_response.tenant_uuid
+                    else None
+                ),
             )
-            async with conn.cursor(cursor_factory=DictCursor) as cur:
-                await cur.execute(sql, where_args)
-                async for ipbx in cur:
-                    if re.match(ipbx['did_regex'], local_part):
-                        ipbxs.append(ipbx)
-                        break
-            # build a route for each ipbx
-            ipbx_auth = None
-            for ipbx in ipbxs:
-                # normalize from uri
-                normalization_profile = None
-                if ipbx['normalization_profile_id'] is not None:
-                    normalization_profile = await get_normalization_profile_by_id(
-                        conn, redis, ipbx['normalization_profile_id']
+        )
+    async with pool.acquire() as conn:
+        with span('routing.db_candidates'):
+            candidates, profiles = await get_routing_candidates(conn, lookups)
+        # bound the time spent evaluating regexes for each request, once the
+        # candidates are fetched
+        budgets = [regex_service.RegexBudget() for request in requests]
+        # normalize according ipbx/carrier trunk source
+        from_local_parts = []
+        local_parts = []
+        with span('routing.source_normalization'):
+            for request, lookup, request_candidates, budget in zip(
+                requests, lookups, candidates, budgets
+            ):
+                source_profile = profiles.get(request_candidates['source_profile_id'])
+                _, from_local_part, _, _ = split_uri_to_parts(request.from_uri)
+                from_local_parts.append(
+                    normalization_service.normalize_number(
+                        from_local_part, 1, source_profile, budget=budget
                     )
-                normalized_local_part = await normalization_service.normalize_e164_to_local_number(
-                    conn, from_local_part, profile=normalization_profile
-                )
-                normalized_from_uri = "%s%s@%s" % (
-                    from_protocol,
-                    normalized_local_part,
-                    from_domain_name,
                 )
-                # normalize to uri
-                normalized_local_part = await normalization_service.normalize_e164_to_local_number(
-                    conn, local_part, profile=normalization_profile
-                )
-                normalized_to_uri = "%s%s@%s" % (
-                    protocol,
-                    normalized_local_part,
-                    domain_name,
+                local_parts.append(
+                    normalization_service.normalize_number(
+                        lookup.number, 1, source_profile, budget=budget
+                    )
                 )
-                #
-                routes.append(
-                    {
-                        "dst_uri": "sip:%s:%s" % (ipbx['ip_fqdn'], ipbx['port']),
-                        "path": "",
-                        "socket": "",
-                        "headers": {
-                            "from": {
-                                "display": request.from_name,
-                                "uri": normalized_from_uri,
-                            },
-                            "to": {
-                                "display": request.to_name,
-                                "uri": normalized_to_uri,
-                            },
-                            "extra": "",
-                        },
-                        "branch_flags": 8,
-                        "fr_timer": 5000,
-                        "fr_inv_timer": 30000,
-                    }
+        # the DIDs were looked up before the numbers were normalized
+        positions = [
+            i
+            for i, (lookup, local_part) in enumerate(zip(lookups, local_parts))
+            if local_part != lookup.number and candidates[i]['domain_ipbx'] is None
+        ]
+        if positions:
+            with span('routing.db_did_candidates'):
+                did_candidates, did_profiles = await get_did_routing_candidates(
+                    conn,
+                    [lookups[i]._replace(number=local_parts[i]) for i in positions],
                 )
-                # if ipbx requires it, set the auth parameters
-                if (
-                    ipbx['username'] is not None
-                    and ipbx['password'] is not None
-                    and ipbx['realm'] is not None
-                ):
-                    ipbx_auth = dict(
-                        auth_username=ipbx['username'],
-                        auth_password=ipbx['password'],
-                        realm=ipbx['realm'],
-                    )
-                # we stop at the first ipbx found
-                break
-            # route by carrier trunk if the package is coming from a known IPBX
-            where = ["ipbx.ip_fqdn = %s"]
-            where_args = [request.source_ip]
-            # filter by tenant, if the request is authenticated
-            if auth_response is not None and auth_response.tenant_uuid:
-                where.append("carriers.tenant_uuid = %s")
-                where_args.append(auth_response.tenant_uuid)
-            # get the list of carrier trunks, ordered by id
-            carrier_trunk_auth = None
-            sql = (
-                "SELECT carrier_trunks.* "
-                "FROM carrier_trunks JOIN carriers ON (carrier_trunks.carrier_id = carriers.id) "
-                "JOIN ipbx ON (ipbx.tenant_uuid = carriers.tenant_uuid) "
-                "WHERE %s ORDER BY carrier_trunks.id LIMIT 1;" % " AND ".join(where)
+            for i, x in zip(positions, did_candidates):
+                candidates[i]['did_ipbxs'] = x['did_ipbxs']
+            profiles.update(did_profiles)
+    # build the routes, once the connection is released
+    responses = []
+    with span('routing.build'):
+        for i, request in enumerate(requests):
+            response, tags = build_routing_response(
+                request,
+                auth_responses[i],
+                lookups[i],
+                candidates[i],
+                profiles,
+                from_local_parts[i],
+                local_parts[i],
+                budgets[i],
             )
-            async with conn.cursor(cursor_factory=DictCursor) as cur:
-                await cur.execute(sql, where_args)
-                carrier_trunk = await cur.fetchone()
-                if carrier_trunk is not None:
-                    # normalize from uri
-                    normalization_profile = None
-                    if carrier_trunk['normalization_profile_id'] is not None:
-                        normalization_profile = await get_normalization_profile_by_id(
-                            conn, redis, carrier_trunk['normalization_profile_id']
-                        )
-                    normalized_local_part = await normalization_service.normalize_e164_to_local_number(
-                        conn, from_local_part, profile=normalization_profile
-                    )
-                    normalized_from_uri = "%s%s@%s%s" % (
-                        from_protocol,
-                        normalized_local_part,
-                        from_domain_name,
-                        from_port_number,
-                    )
-                    # normalize to uri
-                    normalized_local_part = await normalization_service.normalize_e164_to_local_number(
-                        conn, local_part, profile=normalization_profile
-                    )
-                    normalized_to_uri = "%s%s@%s%s" % (
-                        protocol,
-                        normalized_local_part,
-                        domain_name,
-                        port_number,
-                    )
-                    #
-                    routes.append(
-                        {
-                            "dst_uri": "sip:%s:%s"
-                            % (
-                                carrier_trunk['sip_proxy'],
-                                carrier_trunk['sip_proxy_port'],
-                            ),
-                            "path": "",
-                            "socket": "",
-                            "headers": {
-                                "from": {
-                                    "display": request.from_name,
-                                    "uri": normalized_from_uri,
-                                },
-                                "to": {
-                                    "display": request.to_name,
-                                    "uri": normalized_to_uri,
-                                },
-                                "extra": "",
-                            },
-                            "branch_flags": 8,
-                            "fr_timer": 5000,
-                            "fr_inv_timer": 30000,
-                        }
-                    )
-                    # if carrier trunk is registered, set the auth parameters
-                    if (
-                        carrier_trunk['auth_username'] is not None
-                        and carrier_trunk['auth_password'] is not None
-                        and carrier_trunk['realm'] is not None
-                    ):
-                        carrier_trunk_auth = dict(
-                            auth_username=carrier_trunk['auth_username'],
-                            auth_password=carrier_trunk['auth_password'],
-                            realm=carrier_trunk['realm'],
-                        )
-            # build the JSON document, compatible with the rtjson Kamailio module form
-            rtjson = (
-                {
-                    "success": True,
-                    "version": "1.0",
-                    "routing": "serial",
-                    "routes": routes,
-                }
-                if routes
-                else {"success": False}
-            )
-            # update with carrier trunk auth parameters, if set
-            if carrier_trunk_auth is not None:
-                rtjson.update(carrier_trunk_auth)
-            # update with ipbx auth parameters, if set
-            elif ipbx_auth is not None:
-                rtjson.update(ipbx_auth)
-            # return
-            return {
-                "auth": dict(auth_response) if auth_response else None,
-                "rtjson": rtjson,
-            }
+            auth_request, auth_response = auth_requests[i], auth_responses[i]
+            if auth_request is not None and auth_response is not None:
+                tags.update(get_auth_cache_tags(auth_request, dict(auth_response)))
+            responses.append((response, tags))
+    return responses
+
+
+async def routing(
+    pool: aiopg.Pool,
+    redis: Redis,
+    request: schema.RoutingRequest,
+    engine: Optional['RoutingEngine'] = None,
+) -> schema.RoutingResponse:
+    # answer from the in-memory routing snapshot, if enabled and loaded
+    if engine is not None and engine.snapshot is not None:
+        return schema.RoutingResponse(**await engine.routing(request))
+    redis_key = get_routing_redis_key(request)
+
+    async def callback() -> Tuple[dict, Set[str]]:
+        responses = await resolve_routing(pool, redis, [request])
+        return responses[0]
 
     # return the routing and auth responses
     routing_response = (
-        await get_cached_dict_from_redis(redis, redis_key, callback) or {}
+        await get_cached_dict_from_redis(
+            redis, redis_key, callback, is_negative_routing_response
+        )
+        or {}
+    )
+    return schema.RoutingResponse(
+        **set_routing_display_names(routing_response, request)
+    )
+
+
+async def routing_batch(
+    pool: aiopg.Pool,
+    redis: Redis,
+    requests: List[schema.RoutingRequest],
+    engine: Optional['RoutingEngine'] = None,
+) -> List[schema.RoutingResponse]:
+    # answer from the in-memory routing snapshot, if enabled and loaded
+    if engine is not None and engine.snapshot is not None:
+        return [
+            schema.RoutingResponse(**await engine.routing(request))
+            for request in requests
+        ]
+    # requests sharing the same key share the same response
+    redis_keys = [get_routing_redis_key(request) for request in requests]
+    unique_requests = dict(zip(reversed(redis_keys), reversed(requests)))
+
+    async def callback(keys: List[str]) -> Dict[str, Tuple[dict, Set[str]]]:
+        # resolve all the cache misses at once
+        responses = await resolve_routing(
+            pool, redis, [unique_requests[key] for key in keys]
+        )
+        return dict(zip(keys, responses))
+
+    cached_responses = await redis.get_or_set_values(
+        redis_keys, callback, is_negative_routing_response
     )
-    return schema.RoutingResponse(**routing_response)
+    return [
+        schema.RoutingResponse(
+            **set_routing_display_names(cached_responses[key], request)
+        )
+        for key, request in zip(redis_keys, requests)
+    ]
 
 
 async def auth(
-    pool: aiopg.Pool, redis: Redis, request: schema.AuthRequest
+    pool: aiopg.Pool,
+    redis: Redis,
+    request: schema.AuthRequest,
+    engine: Optional['RoutingEngine'] = None,
 ) -> schema.AuthResponse:
-    redis_key = 'kamailio_auth:%s:%s_%s_%s' % (
-        request.source_ip or '*',
-        request.source_port or 5060,
-        request.domain or '*',
-        request.username or '*',
-    )
+    # answer from the in-memory routing snapshot, if enabled and loaded
+    if engine is not None and engine.snapshot is not None:
+        return schema.AuthResponse(**await engine.auth(request))
+    redis_key = get_auth_redis_key(request, redis.cache_key_secret)
 
-    async def callback() -> dict:
+    async def lookup() -> dict:
         if request.source_ip or request.username:
             async with pool.acquire() as conn:
                 where = ["1 = 1"]
@@ -401,15 +682,19 @@ async def auth(
                     "WHERE %s ORDER BY ipbx.id;" % " AND ".join(where)
                 )
                 async with conn.cursor(cursor_factory=DictCursor) as cur:
-                    await cur.execute(sql, where_args)
+                    with span('auth.db_ipbx'):
+                        await cur.execute(sql, where_args)
                     async for ipbx in cur:
-                        if (
-                            not request.password
-                            or ipbx['password']
-                            and password_service.verify(
-                                ipbx['password'], request.password
-                            )
-                        ):
+                        if not request.password:
+                            verified = True
+                        elif ipbx['password']:
+                            with span('auth.password_verify'):
+                                verified = await password_service.verify_async(
+                                    ipbx['password'], request.password
+                                )
+                        else:
+                            verified = False
+                        if verified:
                             return dict(
                                 success=True,
                                 tenant_uuid=ipbx['tenant_uuid'],
@@ -427,8 +712,9 @@ async def auth(
                         "ORDER BY carrier_trunks.id LIMIT 1;"
                     )
                     async with conn.cursor(cursor_factory=DictCursor) as cur:
-                        await cur.execute(sql, [request.source_ip])
-                        carrier_trunk = await cur.fetchone()
+                        with span('auth.db_carrier_trunk'):
+                            await cur.execute(sql, [request.source_ip])
+                            carrier_trunk = await cur.fetchone()
                         if carrier_trunk is not None:
                             return dict(
                                 success=True,
@@ -437,95 +723,204 @@ async def auth(
                             )
         return dict(success=False)
 
-    auth_response = await get_cached_dict_from_redis(redis, redis_key, callback) or {
-        'success': False
-    }
+    async def callback() -> Tuple[dict, Set[str]]:
+        response = await lookup()
+        return response, get_auth_cache_tags(request, response)
+
+    auth_response = await get_cached_dict_from_redis(
+        redis, redis_key, callback, is_negative_auth_response
+    ) or {'success': False}
     return schema.AuthResponse(**auth_response)
 
 
-async def cdr(pool: aiopg.Pool, request: schema.CDRRequest) -> dict:
+# insert the CDRs of the known tenants, returning these tenants
+CDR_INSERT_SQL = (
+    "WITH inserted AS ("
+    "INSERT INTO cdrs (tenant_uuid, source_ip, source_port, from_uri, to_uri, call_id, call_start, duration) "
+    "SELECT cdrs.* FROM unnest("
+    "%s::uuid[], %s::varchar[], %s::integer[], %s::varchar[], %s::varchar[], "
+    "%s::varchar[], %s::timestamptz[], %s::integer[]"
+    ") AS cdrs (tenant_uuid, source_ip, source_port, from_uri, to_uri, call_id, call_start, duration) "
+    "JOIN tenants ON tenants.uuid = cdrs.tenant_uuid "
+    "RETURNING cdrs.tenant_uuid"
+    ") SELECT DISTINCT tenant_uuid FROM inserted;"
+)
+CDR_TENANTS_SQL = "SELECT uuid FROM tenants WHERE uuid = ANY(%s::uuid[]);"
+
+
+def get_cdr_create(request: schema.CDRRequest) -> Optional[cdr_schema.CDRCreate]:
+    try:
+        return cdr_schema.CDRCreate(
+            tenant_uuid=request.tenant_uuid,
+            source_ip=request.source_ip,
+            source_port=request.source_port,
+            from_uri=request.from_uri,
+            to_uri=request.to_uri,
+            call_id=request.call_id,
+            call_start=request.call_start,
+            duration=request.duration,
+        )
+    except ValidationError:
+        return None
+
+
+async def insert_cdrs(
+    conn: aiopg.Connection, cdrs: List[cdr_schema.CDRCreate]
+) -> Set[str]:
+    """
+    Insert the CDRs in a single statement, skipping the CDRs of unknown
+    tenants, and return the tenants whose CDRs were inserted.
+    """
+    if not cdrs:
+        return set()
+    async with conn.cursor() as cur:
+        await cur.execute(
+            CDR_INSERT_SQL,
+            [
+                [str(cdr.tenant_uuid) if cdr.tenant_uuid else None for cdr in cdrs],
+                [cdr.source_ip for cdr in cdrs],
+                [cdr.source_port for cdr in cdrs],
+                [cdr.from_uri for cdr in cdrs],
+                [cdr.to_uri for cdr in cdrs],
+                [cdr.call_id for cdr in cdrs],
+                [cdr.call_start for cdr in cdrs],
+                [cdr.duration for cdr in cdrs],
+            ],
+        )
+        return {str(tenant_uuid) for (tenant_uuid,) in await cur.fetchall()}
+
+
+async def get_cdr_tenant_uuids(
+    conn: aiopg.Connection, cdrs: List[cdr_schema.CDRCreate]
+) -> Set[str]:
+    """
+    Return the existing tenants among the tenants of the CDRs.
+    """
+    tenant_uuids = {str(cdr.tenant_uuid) for cdr in cdrs if cdr.tenant_uuid}
+    if not tenant_uuids:
+        return set()
+    async with conn.cursor() as cur:
+        await cur.execute(CDR_TENANTS_SQL, [sorted(tenant_uuids)])
+        return {str(tenant_uuid) for (tenant_uuid,) in await cur.fetchall()}
+
+
+async def cdr(
+    pool: aiopg.Pool,
+    request: schema.CDRRequest,
+    cdr_buffer: Optional['CDRBuffer'] = None,
+) -> dict:
+    responses = await cdr_batch(pool, [request], cdr_buffer)
+    return responses[0]
+
+
+async def cdr_batch(
+    pool: aiopg.Pool,
+    requests: List[schema.CDRRequest],
+    cdr_buffer: Optional['CDRBuffer'] = None,
+) -> List[dict]:
+    cdrs = [get_cdr_create(request) for request in requests]
+    valid_cdrs = [cdr for cdr in cdrs if cdr is not None]
     async with pool.acquire() as conn:
-        async with conn.cursor(cursor_factory=DictCursor) as cur:
-            await cur.execute(
-                "SELECT * FROM tenants WHERE uuid = %s;", [request.tenant_uuid]
+        if cdr_buffer is not None:
+            # acknowledged once buffered, the CDRs of unknown tenants are
+            # rejected as on the direct insertion
+            tenant_uuids = await get_cdr_tenant_uuids(conn, valid_cdrs)
+            cdr_buffer.add(
+                [cdr for cdr in valid_cdrs if str(cdr.tenant_uuid) in tenant_uuids]
             )
-            tenant = await cur.fetchone()
-            if tenant is None:
-                return {"success": False, "cdr": None}
-            cdr = cdr_schema.CDRCreate(
-                tenant_uuid=tenant['uuid'],
-                source_ip=request.source_ip,
-                source_port=request.source_port,
-                from_uri=request.from_uri,
-                to_uri=request.to_uri,
-                call_id=request.call_id,
-                call_start=request.call_start,
-                duration=request.duration,
-            )
-            await cur.execute(
-                "INSERT INTO cdrs (tenant_uuid, source_ip, source_port, from_uri, to_uri, call_id, call_start, duration) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s);",
+        else:
+            tenant_uuids = await insert_cdrs(conn, valid_cdrs)
+    return [
+        {"success": True, "cdr": cdr}
+        if cdr is not None and str(cdr.tenant_uuid) in tenant_uuids
+        else {"success": False, "cdr": None}
+        for cdr in cdrs
+    ]
+
+
+UACREG_COLUMNS = " ".join(
+    [
+        "l_uuid(string)",
+        "l_username(string)",
+        "l_domain(string)",
+        "r_username(string)",
+        "r_domain(string)",
+        "realm(string)",
+        "auth_username(string)",
+        "auth_password(string)",
+        "auth_proxy(string)",
+        "expires(int)",
+        "flags(int)",
+        "reg_delay(int)",
+    ]
+)
+# cached version of the uacreg dbtext, changed by any write to the trunks
+UACREG_VERSION_KEY = 'dbtext_uacreg:version'
+# longest wait in seconds of a long-poll, and interval of its checks when
+# the invalidations are not received
+UACREG_MAX_WAIT = 60
+UACREG_POLL_INTERVAL = 1
+
+
+def get_uacreg_line(carrier_trunk: dict) -> str:
+    return (
+        ":".join(
+            map(
+                lambda x: x.replace(":", "\\:"),
                 [
-                    cdr.tenant_uuid,
-                    cdr.source_ip,
-                    cdr.source_port,
-                    cdr.from_uri,
-                    cdr.to_uri,
-                    cdr.call_id,
-                    cdr.call_start,
-                    cdr.duration,
+                    "%s" % carrier_trunk['id'],
+                    carrier_trunk['auth_username'],
+                    carrier_trunk['from_domain'],
+                    carrier_trunk['auth_username'],
+                    carrier_trunk['from_domain'],
+                    carrier_trunk['realm'],
+                    carrier_trunk['auth_username'],
+                    carrier_trunk['auth_password'],
+                    "sip:%s" % carrier_trunk['registrar_proxy'],
+                    str(carrier_trunk['expire_seconds']),
+                    "16",
+                    "0",
                 ],
             )
-            return {"success": True, "cdr": cdr}
-
-
-async def dbtext_uacreg(pool: aiopg.Pool) -> schema.DBText:
-    content = []
-    content.append(
-        " ".join(
-            [
-                "l_uuid(string)",
-                "l_username(string)",
-                "l_domain(string)",
-                "r_username(string)",
-                "r_domain(string)",
-                "realm(string)",
-                "auth_username(string)",
-                "auth_password(string)",
-                "auth_proxy(string)",
-                "expires(int)",
-                "flags(int)",
-                "reg_delay(int)",
-            ]
         )
         + "\n"
     )
+
+
+async def get_uacreg_version(redis: Redis) -> str:
+    async def get_version(keys: List[str]) -> Dict[str, Tuple[dict, Set[str]]]:
+        return {
+            key: (dict(version=os.urandom(8).hex()), {'carrier_trunks'}) for key in keys
+        }
+
+    values = await redis.get_or_set_values([UACREG_VERSION_KEY], get_version)
+    return values[UACREG_VERSION_KEY]['version']
+
+
+async def wait_uacreg_version(redis: Redis, version: str, wait: float) -> str:
+    # long-poll until the version differs from the one of the caller
+    deadline = monotonic() + min(wait, UACREG_MAX_WAIT)
+    current_version = await get_uacreg_version(redis)
+    while current_version == version and monotonic() < deadline:
+        await redis.wait_invalidation(min(deadline - monotonic(), UACREG_POLL_INTERVAL))
+        current_version = await get_uacreg_version(redis)
+    return current_version
+
+
+async def stream_dbtext_uacreg(pool: aiopg.Pool) -> AsyncIterator[str]:
+    yield UACREG_COLUMNS + "\n"
     async with pool.acquire() as conn:
         async with conn.cursor(cursor_factory=DictCursor) as cur:
             await cur.execute(
                 "SELECT * FROM carrier_trunks WHERE registered = true ORDER BY id;"
             )
             async for carrier_trunk in cur:
-                content.append(
-                    ":".join(
-                        map(
-                            lambda x: x.replace(":", "\\:"),
-                            [
-                                "%s" % carrier_trunk['id'],
-                                carrier_trunk['auth_username'],
-                                carrier_trunk['from_domain'],
-                                carrier_trunk['auth_username'],
-                                carrier_trunk['from_domain'],
-                                carrier_trunk['realm'],
-                                carrier_trunk['auth_username'],
-                                carrier_trunk['auth_password'],
-                                "sip:%s" % carrier_trunk['registrar_proxy'],
-                                str(carrier_trunk['expire_seconds']),
-                                "16",
-                                "0",
-                            ],
-                        )
-                    )
-                    + "\n"
-                )
-    return schema.DBText(content="".join(content))
+                yield get_uacreg_line(carrier_trunk)
+
+
+async def stream_dbtext_uacreg_json(pool: aiopg.Pool) -> AsyncIterator[str]:
+    # the content of schema.DBText, encoded line by line
+    yield '{"content": "'
+    async for line in stream_dbtext_uacreg(pool):
+        yield json.dumps(line)[1:-1]
+    yield '"}'
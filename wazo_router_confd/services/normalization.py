@@ -1,48 +1,79 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import logging
 import re
+import string
 
-from typing import Any, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Pattern, Tuple
+
+import aiopg  # type: ignore
 
 from psycopg2.extras import DictCursor  # type: ignore
 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Query, Session
 
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_one
 from wazo_router_confd.models.normalization import (
     NormalizationProfile,
     NormalizationRule,
 )
+from wazo_router_confd.schemas import bulk as bulk_schema
 from wazo_router_confd.schemas import normalization as schema
+from wazo_router_confd.services import bulk as bulk_service
+from wazo_router_confd.services.pagination import fetch_page
+from wazo_router_confd.services import regex as regex_service
 from wazo_router_confd.services import tenant as tenant_service
 
 
 re_clean_number = re.compile('[^0-9a-zA-Z]').sub
-re_match_prefix_from_regex = re.compile('[^0-9a-zA-Z]')
+
+logger = logging.getLogger(__name__)
 
 
 def get_match_prefix_from_regex(match_regex: Optional[str] = None) -> str:
-    did_prefix = (
-        re_match_prefix_from_regex.split(match_regex.lstrip('^'))[0]
-        if match_regex is not None
-        else ''
+    return regex_service.get_literal_prefix(
+        match_regex, string.digits + string.ascii_letters
     )
-    return did_prefix
 
 
-def get_normalization_profile(
-    db: Session, principal: Principal, normalization_profile_id: int
-) -> NormalizationProfile:
-    db_normalization_profile = db.query(NormalizationProfile).filter(
+def get_number_prefixes(number: str) -> List[str]:
+    # every prefix, up to the whole number, as the DID prefixes
+    return [number[:i] for i in range(0, len(number) + 1)]
+
+
+def query_normalization_profile(
+    principal: Principal, normalization_profile_id: int
+) -> Query:
+    query = Query(NormalizationProfile).filter(
         NormalizationProfile.id == normalization_profile_id
     )
     if principal is not None and principal.tenant_uuids:
-        db_normalization_profile = db_normalization_profile.filter(
+        query = query.filter(
             NormalizationProfile.tenant_uuid.in_(principal.tenant_uuids)
         )
-    return db_normalization_profile.first()
+    return query
+
+
+def get_normalization_profile(
+    db: Session, principal: Principal, normalization_profile_id: int
+) -> NormalizationProfile:
+    return (
+        query_normalization_profile(principal, normalization_profile_id)
+        .with_session(db)
+        .first()
+    )
+
+
+async def fetch_normalization_profile(
+    pool: aiopg.Pool, principal: Principal, normalization_profile_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(
+        pool, query_normalization_profile(principal, normalization_profile_id)
+    )
 
 
 def get_normalization_profile_by_name(
@@ -58,14 +89,20 @@ def get_normalization_profile_by_name(
     return db_normalization_profile.first()
 
 
-def get_normalization_profiles(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_normalization_profiles(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.NormalizationProfileList:
-    items = db.query(NormalizationProfile)
+    items = Query(NormalizationProfile)
     if principal is not None and principal.tenant_uuid:
         items = items.filter(NormalizationProfile.tenant_uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.NormalizationProfileList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, NormalizationProfile.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.NormalizationProfileList(items=items, next=next_cursor)
 
 
 def create_normalization_profile(
@@ -159,17 +196,33 @@ def delete_normalization_profile(
     return db_normalization_profile
 
 
-def get_normalization_rule(
-    db: Session, principal: Principal, normalization_rule_id: int
-) -> NormalizationRule:
-    db_normalization_rule = db.query(NormalizationRule).filter(
+def query_normalization_rule(principal: Principal, normalization_rule_id: int) -> Query:
+    query = Query(NormalizationRule).filter(
         NormalizationRule.id == normalization_rule_id
     )
     if principal is not None and principal.tenant_uuids:
-        db_normalization_rule = db_normalization_rule.join(NormalizationProfile).filter(
+        query = query.join(NormalizationProfile).filter(
             NormalizationProfile.tenant_uuid.in_(principal.tenant_uuids)
         )
-    return db_normalization_rule.first()
+    return query
+
+
+def get_normalization_rule(
+    db: Session, principal: Principal, normalization_rule_id: int
+) -> NormalizationRule:
+    return (
+        query_normalization_rule(principal, normalization_rule_id)
+        .with_session(db)
+        .first()
+    )
+
+
+async def fetch_normalization_rule(
+    pool: aiopg.Pool, principal: Principal, normalization_rule_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(
+        pool, query_normalization_rule(principal, normalization_rule_id)
+    )
 
 
 def get_normalization_rule_by_match_regex(
@@ -185,27 +238,28 @@ def get_normalization_rule_by_match_regex(
     return db_normalization_rule.first()
 
 
-def get_normalization_rules(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_normalization_rules(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.NormalizationRuleList:
-    items = db.query(NormalizationRule)
+    items = Query(NormalizationRule)
     if principal is not None and principal.tenant_uuid:
         items = items.join(NormalizationProfile).filter(
             NormalizationProfile.tenant_uuid == principal.tenant_uuid
         )
-    items = items.offset(offset).limit(limit).all()
-    return schema.NormalizationRuleList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, NormalizationRule.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.NormalizationRuleList(items=items, next=next_cursor)
 
 
-def create_normalization_rule(
-    db: Session,
-    principal: Principal,
+def build_normalization_rule(
     normalization_rule: schema.NormalizationRuleCreate,
 ) -> NormalizationRule:
-    profile = get_normalization_profile(db, principal, normalization_rule.profile_id)
-    if profile is None:
-        return None
-    db_normalization_rule = NormalizationRule(
+    return NormalizationRule(
         profile_id=normalization_rule.profile_id,
         rule_type=normalization_rule.rule_type,
         priority=normalization_rule.priority,
@@ -213,12 +267,57 @@ def create_normalization_rule(
         match_prefix=get_match_prefix_from_regex(normalization_rule.match_regex),
         replace_regex=normalization_rule.replace_regex,
     )
+
+
+def create_normalization_rule(
+    db: Session,
+    principal: Principal,
+    normalization_rule: schema.NormalizationRuleCreate,
+) -> NormalizationRule:
+    profile = get_normalization_profile(db, principal, normalization_rule.profile_id)
+    if profile is None:
+        return None
+    db_normalization_rule = build_normalization_rule(normalization_rule)
     db.add(db_normalization_rule)
     db.commit()
     db.refresh(db_normalization_rule)
     return db_normalization_rule
 
 
+def apply_normalization_rule_update(
+    db_normalization_rule: NormalizationRule,
+    normalization_rule: schema.NormalizationRuleUpdate,
+):
+    db_normalization_rule.profile_id = (
+        normalization_rule.profile_id
+        if normalization_rule.profile_id is not None
+        else db_normalization_rule.profile_id
+    )
+    db_normalization_rule.rule_type = (
+        normalization_rule.rule_type
+        if normalization_rule.rule_type is not None
+        else db_normalization_rule.rule_type
+    )
+    db_normalization_rule.priority = (
+        normalization_rule.priority
+        if normalization_rule.priority is not None
+        else db_normalization_rule.priority
+    )
+    db_normalization_rule.match_regex = (
+        normalization_rule.match_regex
+        if normalization_rule.match_regex is not None
+        else db_normalization_rule.match_regex
+    )
+    db_normalization_rule.match_prefix = get_match_prefix_from_regex(
+        db_normalization_rule.match_regex
+    )
+    db_normalization_rule.replace_regex = (
+        normalization_rule.replace_regex
+        if normalization_rule.replace_regex is not None
+        else db_normalization_rule.replace_regex
+    )
+
+
 def update_normalization_rule(
     db: Session,
     principal: Principal,
@@ -227,34 +326,7 @@ def update_normalization_rule(
 ) -> NormalizationRule:
     db_normalization_rule = get_normalization_rule(db, principal, normalization_rule_id)
     if db_normalization_rule is not None:
-        db_normalization_rule.profile_id = (
-            normalization_rule.profile_id
-            if normalization_rule.profile_id is not None
-            else db_normalization_rule.profile_id
-        )
-        db_normalization_rule.rule_type = (
-            normalization_rule.rule_type
-            if normalization_rule.rule_type is not None
-            else db_normalization_rule.rule_type
-        )
-        db_normalization_rule.priority = (
-            normalization_rule.priority
-            if normalization_rule.priority is not None
-            else db_normalization_rule.priority
-        )
-        db_normalization_rule.match_regex = (
-            normalization_rule.match_regex
-            if normalization_rule.match_regex is not None
-            else db_normalization_rule.match_regex
-        )
-        db_normalization_rule.match_prefix = get_match_prefix_from_regex(
-            db_normalization_rule.match_regex
-        )
-        db_normalization_rule.replace_regex = (
-            normalization_rule.replace_regex
-            if normalization_rule.replace_regex is not None
-            else db_normalization_rule.replace_regex
-        )
+        apply_normalization_rule_update(db_normalization_rule, normalization_rule)
         db.commit()
         db.refresh(db_normalization_rule)
     return db_normalization_rule
@@ -270,51 +342,186 @@ def delete_normalization_rule(
     return db_normalization_rule
 
 
+def bulk_normalization_rules(
+    db: Session, principal: Principal, operations: List[bulk_schema.BulkOperation]
+) -> bulk_schema.BulkResult:
+    profiles: Dict[int, Optional[NormalizationProfile]] = {}
+
+    def build(normalization_rule: schema.NormalizationRuleCreate) -> NormalizationRule:
+        profile_id = normalization_rule.profile_id
+        if profile_id not in profiles:
+            profiles[profile_id] = get_normalization_profile(db, principal, profile_id)
+        if profiles[profile_id] is None:
+            raise ValueError("profile_id: no normalization profile %s" % profile_id)
+        return build_normalization_rule(normalization_rule)
+
+    query = db.query(NormalizationRule)
+    if principal is not None and principal.tenant_uuids:
+        query = query.join(NormalizationProfile).filter(
+            NormalizationProfile.tenant_uuid.in_(principal.tenant_uuids)
+        )
+    return bulk_service.apply_bulk_operations(
+        db,
+        NormalizationRule,
+        query,
+        operations,
+        schema.NormalizationRuleCreate,
+        schema.NormalizationRuleUpdate,
+        build,
+        apply_normalization_rule_update,
+        unique=NormalizationRule.match_regex,
+    )
+
+
+class CompiledNormalizationRule(NamedTuple):
+    regex: Pattern
+    replace_regex: str
+
+
+class CompiledNormalizationProfile(object):
+    """
+    Rules of a normalization profile by type, in order of priority, with
+    their regexes compiled and their positions indexed by match prefix.
+    """
+
+    id: int
+    always_intl_prefix_plus: bool
+    rules: Dict[int, List[CompiledNormalizationRule]]
+    positions_by_prefix: Dict[int, Dict[str, List[int]]]
+
+    def __init__(
+        self,
+        profile_id: int,
+        always_intl_prefix_plus: bool,
+        rules: Iterable[Tuple[int, str, str, str]] = (),
+    ):
+        self.id = profile_id
+        self.always_intl_prefix_plus = always_intl_prefix_plus
+        self.rules = {}
+        self.positions_by_prefix = {}
+        for rule_type, match_prefix, match_regex, replace_regex in rules:
+            # the rules stored before the validation of the API are skipped
+            regex = regex_service.get_safe_regex(match_regex)
+            if regex is None:
+                logger.warning(
+                    "skipping regex %r of normalization profile %s",
+                    match_regex,
+                    profile_id,
+                )
+                continue
+            type_rules = self.rules.setdefault(rule_type, [])
+            self.positions_by_prefix.setdefault(rule_type, {}).setdefault(
+                match_prefix, []
+            ).append(len(type_rules))
+            type_rules.append(CompiledNormalizationRule(regex, replace_regex))
+
+    def get_rules(self, number: str, rule_type: int) -> List[CompiledNormalizationRule]:
+        positions_by_prefix = self.positions_by_prefix.get(rule_type)
+        if not positions_by_prefix:
+            return []
+        positions: List[int] = []
+        for prefix in get_number_prefixes(number):
+            positions.extend(positions_by_prefix.get(prefix, ()))
+        type_rules = self.rules[rule_type]
+        return [type_rules[position] for position in sorted(positions)]
+
+    def normalize(
+        self,
+        number: str,
+        rule_type: int,
+        budget: Optional[regex_service.RegexBudget] = None,
+    ) -> str:
+        budget = budget if budget is not None else regex_service.RegexBudget()
+        for rule in self.get_rules(number, rule_type):
+            number = budget.sub(rule.regex, rule.replace_regex, number)
+        if rule_type == 2 and self.always_intl_prefix_plus:
+            number = "+%s" % number
+        return number
+
+
+@lru_cache(maxsize=1024)
+def compile_normalization_profile(
+    profile_id: int,
+    always_intl_prefix_plus: bool,
+    rules: Tuple[Tuple[int, str, str, str], ...],
+) -> CompiledNormalizationProfile:
+    # a profile is compiled again only once its rules change
+    return CompiledNormalizationProfile(profile_id, always_intl_prefix_plus, rules)
+
+
+def get_compiled_normalization_profile(profile: dict) -> CompiledNormalizationProfile:
+    # profile holds its rules of every type, already ordered by priority
+    return compile_normalization_profile(
+        profile['id'],
+        bool(profile['always_intl_prefix_plus']),
+        tuple(
+            (
+                rule['rule_type'],
+                rule['match_prefix'],
+                rule['match_regex'],
+                rule['replace_regex'],
+            )
+            for rule in profile['rules']
+        ),
+    )
+
+
+async def get_normalization_profile_rules(
+    conn: Any, profile: NormalizationProfile
+) -> dict:
+    sql = (
+        "SELECT rule_type, match_prefix, match_regex, replace_regex "
+        "FROM normalization_rules "
+        "WHERE profile_id = %s "
+        "ORDER BY priority, id;"
+    )
+    async with conn.cursor(cursor_factory=DictCursor) as cur:
+        await cur.execute(sql, [profile.id])
+        rules = [dict(rule) for rule in await cur.fetchall()]
+    return dict(
+        id=profile.id,
+        always_intl_prefix_plus=profile.always_intl_prefix_plus,
+        rules=rules,
+    )
+
+
 async def normalize_local_number_to_e164(
-    conn: Any, number: str, profile: Optional[NormalizationProfile] = None
+    conn: Any,
+    number: str,
+    profile: Optional[NormalizationProfile] = None,
+    budget: Optional[regex_service.RegexBudget] = None,
 ) -> str:
-    number = re_clean_number('', number)
-    if profile is not None:
-        prefixes = [number[:i] for i in range(0, min(10, len(number)))]
-        sql = (
-            "SELECT match_regex, replace_regex "
-            "FROM normalization_rules "
-            "WHERE profile_id = %s AND rule_type = 1 AND match_prefix = ANY(%s) "
-            "ORDER BY priority, id;"
-        )
-        rules = []
-        async with conn.cursor(cursor_factory=DictCursor) as cur:
-            await cur.execute(sql, [profile.id, prefixes])
-            async for rule in cur:
-                rules.append(rule)
-        number = normalize_apply_rules(number, rules)
-    return number
+    profile_rules = (
+        await get_normalization_profile_rules(conn, profile)
+        if profile is not None
+        else None
+    )
+    return normalize_number(number, 1, profile_rules, budget=budget)
 
 
 async def normalize_e164_to_local_number(
-    conn: Any, number: str, profile: Optional[NormalizationProfile] = None
+    conn: Any,
+    number: str,
+    profile: Optional[NormalizationProfile] = None,
+    budget: Optional[regex_service.RegexBudget] = None,
+) -> str:
+    profile_rules = (
+        await get_normalization_profile_rules(conn, profile)
+        if profile is not None
+        else None
+    )
+    return normalize_number(number, 2, profile_rules, budget=budget)
+
+
+def normalize_number(
+    number: str,
+    rule_type: int,
+    profile: Optional[dict] = None,
+    budget: Optional[regex_service.RegexBudget] = None,
 ) -> str:
     number = re_clean_number('', number)
     if profile is not None:
-        prefixes = [number[:i] for i in range(0, min(10, len(number)))]
-        sql = (
-            "SELECT match_regex, replace_regex "
-            "FROM normalization_rules "
-            "WHERE profile_id = %s AND rule_type = 2 AND match_prefix = ANY(%s) "
-            "ORDER BY priority, id;"
+        number = get_compiled_normalization_profile(profile).normalize(
+            number, rule_type, budget
         )
-        rules = []
-        async with conn.cursor(cursor_factory=DictCursor) as cur:
-            await cur.execute(sql, [profile.id, prefixes])
-            async for rule in cur:
-                rules.append(rule)
-        number = normalize_apply_rules(number, rules)
-        if profile.always_intl_prefix_plus:
-            number = "+%s" % number
-    return number
-
-
-def normalize_apply_rules(number: str, rules: List[dict]) -> str:
-    for rule in rules:
-        number = re.sub(rule['match_regex'], rule['replace_regex'], number)
     return number
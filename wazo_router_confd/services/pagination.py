@@ -0,0 +1,85 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import base64
+import binascii
+import json
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiopg  # type: ignore
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Query
+
+from wazo_router_confd.database import fetch_all
+
+
+def encode_cursor(value: Any) -> str:
+    data = json.dumps([str(value) if not isinstance(value, int) else value])
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        (value,) = json.loads(data.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value
+
+
+def get_page_query(
+    query: Query,
+    key: Any,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> Query:
+    query = query.order_by(key)
+    if cursor is not None:
+        query = query.filter(key > decode_cursor(cursor))
+    elif offset:
+        query = query.offset(offset)
+    # one more row tells if there is a next page
+    return query.limit(limit + 1)
+
+
+def get_page(
+    items: List[Any], limit: int, get_key: Callable[[Any], Any]
+) -> Tuple[List[Any], Optional[str]]:
+    if len(items) <= limit or limit <= 0:
+        return items[: max(limit, 0)], None
+    items = items[:limit]
+    return items, encode_cursor(get_key(items[-1]))
+
+
+def paginate(
+    query: Query,
+    key: Any,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Get a page of the query ordered by its unique key, after the cursor
+    when given, else after the offset, with the cursor of the next page.
+    """
+    items = get_page_query(query, key, offset, limit, cursor).all()
+    return get_page(items, limit, lambda item: getattr(item, key.key))
+
+
+async def fetch_page(
+    pool: aiopg.Pool,
+    query: Query,
+    key: Any,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get a page of the query, built without a session, as paginate does but
+    on the aiopg pool, with the rows as dicts.
+    """
+    items = await fetch_all(pool, get_page_query(query, key, offset, limit, cursor))
+    return get_page(items, limit, lambda item: item[key.key])
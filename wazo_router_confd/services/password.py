@@ -1,9 +1,25 @@
 from typing import Optional
 
+import asyncio
 import binascii
 import hashlib
+import hmac
 import os
 
+from concurrent.futures import Executor, ProcessPoolExecutor
+from time import monotonic
+
+from fastapi import FastAPI
+
+from wazo_router_confd.metrics import PASSWORD_VERIFY_DURATION
+from wazo_router_confd.redis import LocalCache
+
+# number of processes verifying the passwords, 0 verifies them in threads
+PASSWORD_VERIFY_WORKERS = min(os.cpu_count() or 1, 4)
+# time to live in seconds of the successful verifications, 0 disables the cache
+PASSWORD_VERIFY_CACHE_TTL = 30
+PASSWORD_VERIFY_CACHE_SIZE = 4096
+
 
 def hash(password: Optional[str]) -> Optional[str]:
     if password is None:
@@ -31,3 +47,84 @@ def verify(stored_password: str, provided_password: str) -> bool:
     )
     pwdhash_str = binascii.hexlify(pwdhash).decode('ascii')
     return pwdhash_str == stored_password
+
+
+class PasswordVerifier(object):
+    """
+    Verify the passwords off the event loop, with at most one verification
+    per worker at once, and remember the successful verifications for a
+    short time, by a keyed hash of the credentials.
+    """
+
+    workers: int
+    cache: LocalCache
+    executor: Optional[Executor]
+    semaphore: Optional[asyncio.Semaphore]
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_VERIFY_WORKERS,
+        cache_ttl: int = PASSWORD_VERIFY_CACHE_TTL,
+        cache_size: int = PASSWORD_VERIFY_CACHE_SIZE,
+    ):
+        self.workers = workers
+        self.cache = LocalCache(cache_size, cache_ttl, name='password')
+        self.cache_key_secret = os.urandom(32)
+        self.executor = None
+        self.semaphore = None
+
+    def get_cache_key(self, stored_password: str, provided_password: str) -> str:
+        credentials = "%s\0%s" % (stored_password, provided_password)
+        return hmac.new(
+            self.cache_key_secret, credentials.encode('utf-8'), hashlib.sha256
+        ).hexdigest()
+
+    async def verify(self, stored_password: str, provided_password: str) -> bool:
+        cache_key = self.get_cache_key(stored_password, provided_password)
+        if self.cache.get(cache_key):
+            return True
+        # created lazily, to be bound to the running loop and forked on demand
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(max(self.workers, 1))
+        if self.executor is None and self.workers > 0:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        async with self.semaphore:
+            start = monotonic()
+            result = await asyncio.get_event_loop().run_in_executor(
+                self.executor, verify, stored_password, provided_password
+            )
+            PASSWORD_VERIFY_DURATION.observe(
+                monotonic() - start, result='success' if result else 'failure'
+            )
+        if result:
+            self.cache.set(cache_key, True)
+        return result
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.semaphore = None
+        self.cache.clear()
+
+
+verifier = PasswordVerifier()
+
+
+async def verify_async(stored_password: str, provided_password: str) -> bool:
+    return await verifier.verify(stored_password, provided_password)
+
+
+def setup_password_verifier(app: FastAPI, config: dict):
+    global verifier
+    verifier.close()
+    verifier = PasswordVerifier(
+        workers=int(
+            config.get('password_verify_workers', PASSWORD_VERIFY_WORKERS) or 0
+        ),
+        cache_ttl=int(
+            config.get('password_verify_cache_ttl', PASSWORD_VERIFY_CACHE_TTL) or 0
+        ),
+    )
+    app.add_event_handler("shutdown", verifier.close)
+    return app
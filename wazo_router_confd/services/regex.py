@@ -0,0 +1,249 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+import re
+
+from functools import lru_cache
+from time import monotonic
+from typing import Any, Optional, Pattern, Union
+
+try:
+    import re._parser as sre_parse  # type: ignore
+except ImportError:  # pragma: no cover
+    import sre_parse  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# maximum number of regex evaluations and time spent matching regexes, per request
+REGEX_BUDGET_MAX_EVALUATIONS = 256
+REGEX_BUDGET_MAX_SECONDS = 0.05
+# numbers longer than this are never matched against a regex
+REGEX_MAX_SUBJECT_LENGTH = 128
+# regexes longer than this are never evaluated, as the DID regexes of the API
+REGEX_MAX_PATTERN_LENGTH = 256
+# maximum number of ways the variable repetitions and alternatives of a regex
+# may split a number, bounding the backtracking of a single evaluation: one
+# unbounded repetition and a few optional parts, not e.g. [0-9]*[0-9]*
+REGEX_MAX_PATHS = 2048
+
+REPEAT_OPCODES = tuple(
+    getattr(sre_parse, name)
+    for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_parse, name)
+)
+GROUPREF_OPCODES = tuple(
+    getattr(sre_parse, name)
+    for name in ('GROUPREF', 'GROUPREF_EXISTS', 'GROUPREF_IGNORE')
+    if hasattr(sre_parse, name)
+)
+
+
+@lru_cache(maxsize=4096)
+def compile_regex(pattern: str) -> Pattern:
+    return re.compile(pattern)
+
+
+def _get_first_literal(subpattern: Any) -> Optional[int]:
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            return av
+        if op is sre_parse.SUBPATTERN:
+            return _get_first_literal(av[-1])
+        return None
+    return None
+
+
+def _get_regex_error(subpattern: Any, repeated: bool = False) -> Optional[str]:
+    for op, av in subpattern:
+        if op in GROUPREF_OPCODES:
+            return "backreferences are not allowed"
+        elif op in REPEAT_OPCODES:
+            min_repeat, max_repeat, item = av
+            # a variable repetition nested in another repetition can backtrack
+            # exponentially, e.g. (a+)+ or (a{1,3})*
+            if repeated and min_repeat != max_repeat:
+                return "nested quantifiers are not allowed"
+            error = _get_regex_error(item, repeated or max_repeat > 1)
+            if error is not None:
+                return error
+        elif op is sre_parse.BRANCH:
+            alternatives = av[1]
+            if repeated:
+                first_literals = [_get_first_literal(x) for x in alternatives]
+                if None in first_literals or len(set(first_literals)) != len(
+                    first_literals
+                ):
+                    return "repeated alternatives must start with distinct characters"
+            for alternative in alternatives:
+                error = _get_regex_error(alternative, repeated)
+                if error is not None:
+                    return error
+        elif op is sre_parse.SUBPATTERN:
+            error = _get_regex_error(av[-1], repeated)
+            if error is not None:
+                return error
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            error = _get_regex_error(av[1], repeated)
+            if error is not None:
+                return error
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            error = _get_regex_error(av, repeated)
+            if error is not None:
+                return error
+    return None
+
+
+def _get_regex_paths(subpattern: Any) -> int:
+    paths = 1
+    for op, av in subpattern:
+        if op in REPEAT_OPCODES:
+            min_repeat, max_repeat, item = av
+            if max_repeat == sre_parse.MAXREPEAT:
+                max_repeat = REGEX_MAX_SUBJECT_LENGTH
+            span = max(min(max_repeat, REGEX_MAX_SUBJECT_LENGTH) - min_repeat, 0) + 1
+            paths *= span * _get_regex_paths(item)
+        elif op is sre_parse.BRANCH:
+            paths *= sum(_get_regex_paths(x) for x in av[1])
+        elif op is sre_parse.SUBPATTERN:
+            paths *= _get_regex_paths(av[-1])
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            paths *= _get_regex_paths(av[1])
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            paths *= _get_regex_paths(av)
+    return paths
+
+
+def get_regex_error(pattern: str) -> Optional[str]:
+    """
+    Return the reason why a regex is rejected, or None if it can be safely
+    evaluated in bounded time on the routing path.
+    """
+    try:
+        subpattern = sre_parse.parse(pattern)
+        compile_regex(pattern)
+    except (re.error, OverflowError, RecursionError) as e:
+        return "invalid regex: %s" % e
+    error = _get_regex_error(subpattern)
+    if error is None and _get_regex_paths(subpattern) > REGEX_MAX_PATHS:
+        # e.g. the adjacent repetitions of ^[0-9]*[0-9]*[0-9]*a$, whose
+        # backtracking is polynomial in the length of the number
+        error = "too many variable repetitions"
+    return error
+
+
+@lru_cache(maxsize=4096)
+def get_safe_regex(pattern: str) -> Optional[Pattern]:
+    """
+    Return the compiled regex, or None if it must not be evaluated on the
+    routing path, e.g. a regex stored before the validation of the API.
+    """
+    if len(pattern) > REGEX_MAX_PATTERN_LENGTH:
+        logger.warning("skipping regex of %d characters", len(pattern))
+        return None
+    error = get_regex_error(pattern)
+    if error is not None:
+        logger.warning("skipping regex %r: %s", pattern, error)
+        return None
+    return compile_regex(pattern)
+
+
+def get_replacement_error(pattern: str, replacement: str) -> Optional[str]:
+    try:
+        # the replacement template is parsed even if nothing is substituted
+        compile_regex(pattern).sub(replacement, '')
+    except (re.error, IndexError) as e:
+        return "invalid replacement: %s" % e
+    return None
+
+
+def get_literal_prefix(pattern: Optional[str], charset: str = '0123456789') -> str:
+    """
+    Return the literal characters any string matched by the regex starts with.
+    """
+    if pattern is None:
+        return ''
+    try:
+        subpattern = sre_parse.parse(pattern)
+    except (re.error, OverflowError, RecursionError):
+        return ''
+    prefix, _ = _get_literal_prefix(subpattern, charset)
+    return prefix
+
+
+def _get_literal_prefix(subpattern: Any, charset: str) -> Any:
+    prefix = ''
+    for op, av in subpattern:
+        if op is sre_parse.AT and av is sre_parse.AT_BEGINNING and not prefix:
+            continue
+        elif op is sre_parse.LITERAL and chr(av) in charset:
+            prefix += chr(av)
+        elif op is sre_parse.SUBPATTERN:
+            group_prefix, complete = _get_literal_prefix(av[-1], charset)
+            prefix += group_prefix
+            if not complete:
+                return prefix, False
+        else:
+            return prefix, False
+    return prefix, True
+
+
+class RegexBudget(object):
+    """
+    Per-request budget of regex evaluations: once exhausted, the remaining
+    matches fail and the substitutions leave the number untouched. Only the
+    time spent evaluating the regexes is counted, not the time spent waiting
+    for the database between two evaluations. The budget is checked before
+    each evaluation, and only the regexes passing get_regex_error, whose
+    backtracking is bounded by REGEX_MAX_PATHS, are evaluated: it is overrun
+    by one bounded evaluation at most.
+    """
+
+    def __init__(
+        self,
+        max_evaluations: int = REGEX_BUDGET_MAX_EVALUATIONS,
+        max_seconds: float = REGEX_BUDGET_MAX_SECONDS,
+    ):
+        self.evaluations = 0
+        self.max_evaluations = max_evaluations
+        self.seconds = 0.0
+        self.max_seconds = max_seconds
+        self.exhausted = False
+
+    def consume(self, subject: str) -> bool:
+        if self.exhausted:
+            return False
+        self.evaluations += 1
+        if self.evaluations > self.max_evaluations or self.seconds > self.max_seconds:
+            logger.warning(
+                "regex budget exhausted after %d evaluations", self.evaluations - 1
+            )
+            self.exhausted = True
+            return False
+        return len(subject) <= REGEX_MAX_SUBJECT_LENGTH
+
+    def match(self, regex: Union[str, Pattern], subject: str) -> Any:
+        if not self.consume(subject):
+            return None
+        start = monotonic()
+        try:
+            if isinstance(regex, str):
+                regex = get_safe_regex(regex)
+                if regex is None:
+                    return None
+            return regex.match(subject)
+        finally:
+            self.seconds += monotonic() - start
+
+    def sub(self, regex: Union[str, Pattern], replacement: str, subject: str) -> str:
+        if not self.consume(subject):
+            return subject
+        start = monotonic()
+        try:
+            if isinstance(regex, str):
+                regex = get_safe_regex(regex)
+                if regex is None:
+                    return subject
+            return regex.sub(replacement, subject)
+        finally:
+            self.seconds += monotonic() - start
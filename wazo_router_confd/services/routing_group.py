@@ -1,35 +1,53 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from sqlalchemy.orm import Session
+from typing import Any, Dict, Optional
+
+import aiopg  # type: ignore
+
+from sqlalchemy.orm import Query, Session
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_one
 from wazo_router_confd.models.routing_group import RoutingGroup
 from wazo_router_confd.schemas import routing_group as schema
+from wazo_router_confd.services.pagination import fetch_page
 from wazo_router_confd.services import tenant as tenant_service
 
 
+def query_routing_group(principal: Principal, routing_group_id: int) -> Query:
+    query = Query(RoutingGroup).filter(RoutingGroup.id == routing_group_id)
+    if principal is not None and principal.tenant_uuids:
+        query = query.filter(RoutingGroup.tenant_uuid.in_(principal.tenant_uuids))
+    return query
+
+
 def get_routing_group(
     db: Session, principal: Principal, routing_group_id: int
 ) -> RoutingGroup:
-    db_routing_group = db.query(RoutingGroup).filter(
-        RoutingGroup.id == routing_group_id
-    )
-    if principal is not None and principal.tenant_uuids:
-        db_routing_group = db_routing_group.filter(
-            RoutingGroup.tenant_uuid.in_(principal.tenant_uuids)
-        )
-    return db_routing_group.first()
+    return query_routing_group(principal, routing_group_id).with_session(db).first()
+
 
+async def fetch_routing_group(
+    pool: aiopg.Pool, principal: Principal, routing_group_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(pool, query_routing_group(principal, routing_group_id))
 
-def get_routing_groups(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+
+async def fetch_routing_groups(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.RoutingGroupList:
-    items = db.query(RoutingGroup)
+    items = Query(RoutingGroup)
     if principal is not None and principal.tenant_uuid:
         items = items.filter(RoutingGroup.tenant_uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.RoutingGroupList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, RoutingGroup.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.RoutingGroupList(items=items, next=next_cursor)
 
 
 def create_routing_group(
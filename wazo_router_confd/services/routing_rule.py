@@ -1,34 +1,54 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from sqlalchemy.orm import Session
+from typing import Any, Dict, Optional
+
+import aiopg  # type: ignore
+
+from sqlalchemy.orm import Query, Session
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_one
 from wazo_router_confd.models.ipbx import IPBX
 from wazo_router_confd.models.routing_rule import RoutingRule
 from wazo_router_confd.schemas import routing_rule as schema
+from wazo_router_confd.services.pagination import fetch_page
 from wazo_router_confd.services import carrier_trunk as carrier_trunk_service
 
 
+def query_routing_rule(principal: Principal, routing_rule_id: int) -> Query:
+    query = Query(RoutingRule).filter(RoutingRule.id == routing_rule_id)
+    if principal is not None and principal.tenant_uuids:
+        query = query.join(IPBX).filter(IPBX.tenant_uuid.in_(principal.tenant_uuids))
+    return query
+
+
 def get_routing_rule(
     db: Session, principal: Principal, routing_rule_id: int
 ) -> RoutingRule:
-    db_routing_rule = db.query(RoutingRule).filter(RoutingRule.id == routing_rule_id)
-    if principal is not None and principal.tenant_uuids:
-        db_routing_rule = db_routing_rule.join(IPBX).filter(
-            IPBX.tenant_uuid.in_(principal.tenant_uuids)
-        )
-    return db_routing_rule.first()
+    return query_routing_rule(principal, routing_rule_id).with_session(db).first()
+
+
+async def fetch_routing_rule(
+    pool: aiopg.Pool, principal: Principal, routing_rule_id: int
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(pool, query_routing_rule(principal, routing_rule_id))
 
 
-def get_routing_rules(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_routing_rules(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.RoutingRuleList:
-    items = db.query(RoutingRule)
+    items = Query(RoutingRule)
     if principal is not None and principal.tenant_uuid:
         items = items.join(IPBX).filter(IPBX.tenant_uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.RoutingRuleList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, RoutingRule.id, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.RoutingRuleList(items=items, next=next_cursor)
 
 
 def create_routing_rule(
@@ -3,22 +3,36 @@
 
 from json import dumps
 from pydantic import UUID4
-from typing import Optional
+from typing import Any, Dict, Optional
 from uuid import uuid4, UUID
 
+import aiopg  # type: ignore
+
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Query, Session
 
 from wazo_router_confd.auth import Principal
+from wazo_router_confd.database import fetch_one
 from wazo_router_confd.models.tenant import Tenant
 from wazo_router_confd.schemas import tenant as schema
+from wazo_router_confd.services.pagination import fetch_page
 
 
-def get_tenant(db: Session, principal: Principal, tenant_uuid: UUID4) -> Tenant:
-    tenant = db.query(Tenant).filter(Tenant.uuid == tenant_uuid)
+def query_tenant(principal: Principal, tenant_uuid: UUID4) -> Query:
+    query = Query(Tenant).filter(Tenant.uuid == tenant_uuid)
     if principal is not None and principal.tenant_uuids:
-        tenant = tenant.filter(Tenant.uuid.in_(principal.tenant_uuids))
-    return tenant.first()
+        query = query.filter(Tenant.uuid.in_(principal.tenant_uuids))
+    return query
+
+
+def get_tenant(db: Session, principal: Principal, tenant_uuid: UUID4) -> Tenant:
+    return query_tenant(principal, tenant_uuid).with_session(db).first()
+
+
+async def fetch_tenant(
+    pool: aiopg.Pool, principal: Principal, tenant_uuid: UUID4
+) -> Optional[Dict[str, Any]]:
+    return await fetch_one(pool, query_tenant(principal, tenant_uuid))
 
 
 def get_tenant_by_name(db: Session, principal: Principal, name: str) -> Tenant:
@@ -32,14 +46,20 @@ def get_tenant_by_uuid(db: Session, uuid: str) -> Tenant:
     return db.query(Tenant).filter(Tenant.uuid == uuid).first()
 
 
-def get_tenants(
-    db: Session, principal: Principal, offset: int = 0, limit: int = 100
+async def fetch_tenants(
+    pool: aiopg.Pool,
+    principal: Principal,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> schema.TenantList:
-    items = db.query(Tenant)
+    items = Query(Tenant)
     if principal is not None and principal.tenant_uuid:
         items = items.filter(Tenant.uuid == principal.tenant_uuid)
-    items = items.offset(offset).limit(limit).all()
-    return schema.TenantList(items=items)
+    items, next_cursor = await fetch_page(
+        pool, items, Tenant.uuid, offset=offset, limit=limit, cursor=cursor
+    )
+    return schema.TenantList(items=items, next=next_cursor)
 
 
 def create_tenant(
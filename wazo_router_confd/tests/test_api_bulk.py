@@ -0,0 +1,127 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from unittest import mock
+
+
+def test_bulk_domains(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.domain import Domain
+    from wazo_router_confd.models.tenant import Tenant
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name='fabio', uuid="3ab844af-8039-45d9-a3aa-bae6f298228f")
+    domain1 = Domain(domain='testdomain1.com', tenant=tenant)
+    domain2 = Domain(domain='testdomain2.com', tenant=tenant)
+    session.add_all([tenant, domain1, domain2])
+    session.commit()
+    #
+    response = client.post(
+        "/1.0/domains/bulk",
+        json=[
+            {"action": "update", "id": domain1.id, "data": {"domain": "updated.com"}},
+            {"action": "delete", "id": domain2.id},
+            {
+                "action": "create",
+                "data": {"domain": "testdomain3.com", "tenant_uuid": str(tenant.uuid)},
+            },
+            {
+                "action": "create",
+                "data": {"domain": "testdomain4.com", "tenant_uuid": str(tenant.uuid)},
+            },
+        ],
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "items": [
+            {"action": "update", "id": domain1.id},
+            {"action": "delete", "id": domain2.id},
+            {"action": "create", "id": mock.ANY},
+            {"action": "create", "id": mock.ANY},
+        ]
+    }
+    session.expire_all()
+    assert sorted(domain for (domain,) in session.query(Domain.domain)) == [
+        "testdomain3.com",
+        "testdomain4.com",
+        "updated.com",
+    ]
+
+
+def test_bulk_domains_invalid(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.domain import Domain
+    from wazo_router_confd.models.tenant import Tenant
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name='fabio', uuid="3ab844af-8039-45d9-a3aa-bae6f298228f")
+    domain = Domain(domain='testdomain.com', tenant=tenant)
+    session.add_all([tenant, domain])
+    session.commit()
+    #
+    response = client.post(
+        "/1.0/domains/bulk",
+        json=[
+            {"action": "update", "id": domain.id, "data": {"domain": "updated.com"}},
+            {
+                "action": "create",
+                "data": {"domain": "testdomain.com", "tenant_uuid": str(tenant.uuid)},
+            },
+            {"action": "delete", "id": domain.id + 1},
+            {"action": "delete"},
+        ],
+    )
+    assert response.status_code == 400
+    assert response.json() == {
+        "detail": [
+            {"index": 1, "message": "domain: Duplicated domain"},
+            {"index": 2, "message": "id: %s not found" % (domain.id + 1)},
+            {"index": 3, "message": "id: field required"},
+        ]
+    }
+    # none of the operations is applied
+    session.expire_all()
+    assert [domain for (domain,) in session.query(Domain.domain)] == ["testdomain.com"]
+
+
+def test_bulk_ipbxs(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.domain import Domain
+    from wazo_router_confd.models.ipbx import IPBX
+    from wazo_router_confd.models.tenant import Tenant
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name='fabio', uuid="3ab844af-8039-45d9-a3aa-bae6f298228f")
+    domain = Domain(domain='testdomain.com', tenant=tenant)
+    ipbx = IPBX(tenant=tenant, domain=domain, customer=1, ip_fqdn='mypbx.com')
+    session.add_all([tenant, domain, ipbx])
+    session.commit()
+    #
+    ipbx_data = {
+        "tenant_uuid": str(tenant.uuid),
+        "domain_id": domain.id,
+        "ip_fqdn": "mypbx2.com",
+        "username": "user",
+        "password": "password",
+    }
+    response = client.post(
+        "/1.0/ipbxs/bulk",
+        json=[
+            {"action": "create", "data": ipbx_data},
+            {"action": "create", "data": dict(ipbx_data, ip_fqdn="mypbx3.com")},
+            {"action": "delete", "id": ipbx.id},
+        ],
+    )
+    assert response.status_code == 200
+    assert [item['action'] for item in response.json()['items']] == [
+        "create",
+        "create",
+        "delete",
+    ]
+    session.expire_all()
+    ipbxs = session.query(IPBX).order_by(IPBX.id).all()
+    assert [(x.id, x.ip_fqdn) for x in ipbxs] == [
+        (response.json()['items'][0]['id'], "mypbx2.com"),
+        (response.json()['items'][1]['id'], "mypbx3.com"),
+    ]
+    assert ipbxs[0].password_ha1 is not None
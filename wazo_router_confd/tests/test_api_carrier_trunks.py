@@ -175,7 +175,8 @@ def test_get_carrier_trunks(app, client):
                 'expire_seconds': 3600,
                 'retry_seconds': 30,
             }
-        ]
+        ],
+        "next": None,
     }
 
 
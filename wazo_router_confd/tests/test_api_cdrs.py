@@ -117,10 +117,48 @@ def test_get_cdrs(app, client):
                 "call_start": "2019-09-01T00:00:00",
                 "tenant_uuid": str(tenant.uuid),
             }
-        ]
+        ],
+        "next": None,
     }
 
 
+def test_get_cdrs_cursor(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.cdr import CDR
+    from wazo_router_confd.models.tenant import Tenant
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name="tenant", uuid="5a6c0c40-b481-41bb-a41a-75d1cc25ff34")
+    cdrs = [
+        CDR(
+            from_uri="100@localhost",
+            to_uri="200@localhost",
+            call_id=call_id,
+            source_ip="10.0.0.1",
+            source_port=5060,
+            tenant=tenant,
+        )
+        for call_id in ("1000", "1001", "1002")
+    ]
+    session.add_all([tenant] + cdrs)
+    session.commit()
+    #
+    response = client.get("/1.0/cdrs", params={"limit": 2})
+    assert response.status_code == 200
+    assert [x['call_id'] for x in response.json()['items']] == ["1000", "1001"]
+    assert response.json()['next'] is not None
+    #
+    response = client.get(
+        "/1.0/cdrs", params={"limit": 2, "cursor": response.json()['next']}
+    )
+    assert response.status_code == 200
+    assert [x['call_id'] for x in response.json()['items']] == ["1002"]
+    assert response.json()['next'] is None
+    #
+    response = client.get("/1.0/cdrs", params={"cursor": "invalid"})
+    assert response.status_code == 400
+
+
 def test_update_cdr(app, client):
     from wazo_router_confd.database import SessionLocal
     from wazo_router_confd.models.cdr import CDR
@@ -117,7 +117,8 @@ def test_get_cdrs(app_auth, client_auth_with_token):
                 "call_start": "2019-09-01T00:00:00",
                 "tenant_uuid": str(tenant.uuid),
             }
-        ]
+        ],
+        "next": None,
     }
 
 
@@ -0,0 +1,119 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+
+from dateutil.parser import parse
+
+
+def create_cdrs(app):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.cdr import CDR
+    from wazo_router_confd.models.tenant import Tenant
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name="tenant", uuid="5a6c0c40-b481-41bb-a41a-75d1cc25ff34")
+    tenant_2 = Tenant(name="tenant_2", uuid="ffffffff-ffff-4c1c-ad1c-ffffffffffff")
+    cdrs = [
+        CDR(
+            from_uri="100@localhost",
+            to_uri="200@localhost",
+            call_id=call_id,
+            source_ip="10.0.0.1",
+            source_port=5060,
+            duration=60,
+            call_start=parse(call_start),
+            tenant=tenant_,
+        )
+        for call_id, call_start, tenant_ in [
+            ("1000", "2019-09-01T00:00:00", tenant),
+            ("1001", "2019-09-02T00:00:00", tenant),
+            ("1002", "2019-09-03T00:00:00", tenant_2),
+        ]
+    ]
+    session.add_all([tenant, tenant_2] + cdrs)
+    session.commit()
+    return tenant, cdrs
+
+
+def test_export_cdrs(app, client):
+    tenant, cdrs = create_cdrs(app)
+    #
+    response = client.get("/1.0/cdrs/export")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert [item['call_id'] for item in items] == ["1000", "1001", "1002"]
+    assert items[0] == {
+        "id": cdrs[0].id,
+        "from_uri": "100@localhost",
+        "to_uri": "200@localhost",
+        "call_id": "1000",
+        "source_ip": "10.0.0.1",
+        "source_port": 5060,
+        "duration": 60,
+        "call_start": "2019-09-01T00:00:00",
+        "tenant_uuid": str(tenant.uuid),
+    }
+
+
+def test_export_cdrs_filters(app, client):
+    tenant, cdrs = create_cdrs(app)
+    #
+    response = client.get(
+        "/1.0/cdrs/export",
+        params={
+            "tenant_uuid": str(tenant.uuid),
+            "start": "2019-09-01T12:00:00",
+            "end": "2019-09-03T00:00:00",
+        },
+    )
+    assert response.status_code == 200
+    assert [json.loads(line)['call_id'] for line in response.text.splitlines()] == [
+        "1001"
+    ]
+    #
+    response = client.get("/1.0/cdrs/export", params={"after_id": cdrs[0].id})
+    assert response.status_code == 200
+    assert [json.loads(line)['call_id'] for line in response.text.splitlines()] == [
+        "1001",
+        "1002",
+    ]
+
+
+def test_export_cdrs_csv(app, client):
+    tenant, cdrs = create_cdrs(app)
+    #
+    response = client.get("/1.0/cdrs/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    lines = response.text.splitlines()
+    assert lines[0] == (
+        "id,tenant_uuid,source_ip,source_port,from_uri,to_uri,call_id,call_start,duration"
+    )
+    assert lines[1] == "%s,%s,10.0.0.1,5060,100@localhost,200@localhost,1000,%s,60" % (
+        cdrs[0].id,
+        tenant.uuid,
+        "2019-09-01T00:00:00",
+    )
+    assert len(lines) == 4
+
+
+def test_export_cdrs_unsupported_format(app, client):
+    response = client.get("/1.0/cdrs/export", params={"format": "xml"})
+    assert response.status_code == 400
+
+
+def test_export_cdrs_query_partition_key():
+    from datetime import datetime
+
+    from wazo_router_confd.services.cdr import (
+        CDR_EXPORT_CLOCK_SKEW,
+        get_cdr_export_query,
+    )
+
+    start = datetime(2019, 9, 1)
+    query, params = get_cdr_export_query(None, start=start, end=datetime(2019, 10, 1))
+    # the partition key is bounded along with the call start
+    assert "created_at >= %s" in query
+    assert params == [0, start, start - CDR_EXPORT_CLOCK_SKEW, datetime(2019, 10, 1)]
@@ -0,0 +1,157 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from dateutil.parser import parse
+
+
+def test_get_cdr_stats(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.cdr import CDR
+    from wazo_router_confd.models.tenant import Tenant
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name="tenant", uuid="5a6c0c40-b481-41bb-a41a-75d1cc25ff34")
+    cdrs = [
+        CDR(
+            from_uri="100@localhost",
+            to_uri="200@localhost",
+            call_id=call_id,
+            source_ip="10.0.0.1",
+            source_port=5060,
+            duration=duration,
+            call_start=parse(call_start),
+            tenant=tenant,
+        )
+        for call_id, call_start, duration in [
+            ("1000", "2019-09-01T10:05:00", 60),
+            ("1001", "2019-09-01T10:30:00", 120),
+            ("1002", "2019-09-01T11:00:00", 30),
+        ]
+    ]
+    session.add_all([tenant] + cdrs)
+    session.commit()
+    #
+    response = client.get("/1.0/cdrs/stats")
+    assert response.status_code == 200
+    assert response.json() == {
+        "items": [
+            {
+                "period": "2019-09-01T10:00:00",
+                "tenant_uuid": str(tenant.uuid),
+                "carrier_trunk_id": None,
+                "ipbx_id": None,
+                "calls": 2,
+                "total_minutes": 3.0,
+                "average_duration": 90.0,
+            },
+            {
+                "period": "2019-09-01T11:00:00",
+                "tenant_uuid": str(tenant.uuid),
+                "carrier_trunk_id": None,
+                "ipbx_id": None,
+                "calls": 1,
+                "total_minutes": 0.5,
+                "average_duration": 30.0,
+            },
+        ]
+    }
+    #
+    session.delete(cdrs[0])
+    session.commit()
+    response = client.get("/1.0/cdrs/stats", params={"granularity": "day"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "items": [
+            {
+                "period": "2019-09-01T00:00:00",
+                "tenant_uuid": str(tenant.uuid),
+                "carrier_trunk_id": None,
+                "ipbx_id": None,
+                "calls": 2,
+                "total_minutes": 2.5,
+                "average_duration": 75.0,
+            }
+        ]
+    }
+    # the rollups emptied by a deletion are deleted too
+    from wazo_router_confd.models.cdr_rollup import CDRRollup
+
+    session.delete(cdrs[2])
+    session.commit()
+    assert sorted(
+        (granularity, period.isoformat(), calls)
+        for granularity, period, calls in session.query(
+            CDRRollup.granularity, CDRRollup.period, CDRRollup.calls
+        )
+    ) == [("day", "2019-09-01T00:00:00", 1), ("hour", "2019-09-01T10:00:00", 1)]
+
+
+def test_cdr_rollups_per_statement(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.cdr import CDR
+    from wazo_router_confd.models.cdr_rollup import CDRRollup
+    from wazo_router_confd.models.tenant import Tenant
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name="tenant", uuid="5a6c0c40-b481-41bb-a41a-75d1cc25ff34")
+    session.add(tenant)
+    session.commit()
+    # a batch of cdrs inserted by a single statement
+    session.execute(
+        CDR.__table__.insert(),
+        [
+            dict(
+                tenant_uuid=tenant.uuid,
+                from_uri="100@localhost",
+                to_uri="200@localhost",
+                call_id=call_id,
+                source_ip="10.0.0.1",
+                source_port=5060,
+                duration=60,
+                call_start=parse(call_start),
+            )
+            for call_id, call_start in [
+                ("1000", "2019-09-01T11:05:00"),
+                ("1001", "2019-09-01T10:30:00"),
+                ("1002", "2019-09-01T11:00:00"),
+            ]
+        ],
+    )
+    session.commit()
+
+    def get_rollups():
+        session.expire_all()
+        return sorted(
+            (granularity, period.isoformat(), calls, duration)
+            for granularity, period, calls, duration in session.query(
+                CDRRollup.granularity,
+                CDRRollup.period,
+                CDRRollup.calls,
+                CDRRollup.duration,
+            )
+        )
+
+    assert get_rollups() == [
+        ("day", "2019-09-01T00:00:00", 3, 180),
+        ("hour", "2019-09-01T10:00:00", 1, 60),
+        ("hour", "2019-09-01T11:00:00", 2, 120),
+    ]
+    # an update of every cdr at once keeps the calls
+    session.query(CDR).update({CDR.duration: CDR.duration * 2})
+    session.commit()
+    assert get_rollups() == [
+        ("day", "2019-09-01T00:00:00", 3, 360),
+        ("hour", "2019-09-01T10:00:00", 1, 120),
+        ("hour", "2019-09-01T11:00:00", 2, 240),
+    ]
+    session.query(CDR).filter(CDR.call_id != "1001").delete()
+    session.commit()
+    assert get_rollups() == [
+        ("day", "2019-09-01T00:00:00", 1, 120),
+        ("hour", "2019-09-01T10:00:00", 1, 120),
+    ]
+
+
+def test_get_cdr_stats_unsupported_granularity(app, client):
+    response = client.get("/1.0/cdrs/stats", params={"granularity": "week"})
+    assert response.status_code == 400
@@ -191,7 +191,8 @@ def test_get_dids(app_auth, client_auth_with_token):
                 "ipbx_id": ipbx.id,
                 "carrier_trunk_id": carrier_trunk.id,
             }
-        ]
+        ],
+        "next": None,
     }
 
 
@@ -0,0 +1,105 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+
+
+def create_ipbx_and_carrier_trunk(app):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.carrier import Carrier
+    from wazo_router_confd.models.carrier_trunk import CarrierTrunk
+    from wazo_router_confd.models.domain import Domain
+    from wazo_router_confd.models.tenant import Tenant
+    from wazo_router_confd.models.ipbx import IPBX
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name='fabio', uuid='5a6c0c40-b481-41bb-a41a-75d1cc25ff34')
+    domain = Domain(domain='testdomain.com', tenant=tenant)
+    ipbx = IPBX(tenant=tenant, domain=domain, customer=1, ip_fqdn='mypbx.com')
+    carrier = Carrier(name='carrier', tenant=tenant)
+    carrier_trunk = CarrierTrunk(
+        name='carrier_trunk1', carrier=carrier, sip_proxy='proxy.somedomain.com'
+    )
+    session.add_all([tenant, domain, ipbx, carrier, carrier_trunk])
+    session.commit()
+    return session, tenant, ipbx, carrier_trunk
+
+
+def test_import_dids_ndjson(app, client):
+    from wazo_router_confd.models.did import DID
+
+    session, tenant, ipbx, carrier_trunk = create_ipbx_and_carrier_trunk(app)
+    did = dict(
+        tenant_uuid=str(tenant.uuid), ipbx_id=ipbx.id, carrier_trunk_id=carrier_trunk.id
+    )
+    content = "\n".join(
+        [
+            json.dumps(dict(did, did_regex=r'^391[0-9]+$')),
+            json.dumps(dict(did, did_regex=r'^392[0-9]+$')),
+            json.dumps(dict(did, did_regex=r'^391[0-9]+$')),
+            json.dumps(dict(did, did_regex=r'^(39')),
+            json.dumps(dict(did, did_regex=r'^393[0-9]+$', ipbx_id=ipbx.id + 1)),
+            "{invalid",
+        ]
+    )
+    response = client.post("/1.0/dids/import", data=content)
+    assert response.status_code == 200
+    assert response.json()['created'] == 2
+    assert [error['line'] for error in response.json()['errors']] == [3, 4, 5, 6]
+    assert response.json()['errors'][0]['message'] == "did_regex: Duplicated did_regex"
+    assert sorted((x.did_regex, x.did_prefix) for x in session.query(DID)) == [
+        (r'^391[0-9]+$', '391'),
+        (r'^392[0-9]+$', '392'),
+    ]
+
+
+def test_import_dids_csv(app, client):
+    from wazo_router_confd.models.did import DID
+
+    session, tenant, ipbx, carrier_trunk = create_ipbx_and_carrier_trunk(app)
+    content = (
+        "tenant_uuid,ipbx_id,carrier_trunk_id,did_regex\n"
+        "%(tenant_uuid)s,%(ipbx_id)s,%(carrier_trunk_id)s,^391[0-9]+$\n"
+        "%(tenant_uuid)s,%(ipbx_id)s,,^392[0-9]+$\n"
+    ) % dict(
+        tenant_uuid=tenant.uuid, ipbx_id=ipbx.id, carrier_trunk_id=carrier_trunk.id
+    )
+    response = client.post("/1.0/dids/import", data=content, params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.json()['created'] == 1
+    assert [error['line'] for error in response.json()['errors']] == [3]
+    assert [x.did_regex for x in session.query(DID)] == [r'^391[0-9]+$']
+
+
+def test_get_copy_csv_row():
+    from wazo_router_confd.services.did import get_copy_csv_row
+
+    assert get_copy_csv_row(['uuid', 1, 2, None, '']) == '"uuid",1,2,,""\n'
+    assert get_copy_csv_row(['^a"b,c$']) == '"^a""b,c$"\n'
+
+
+def test_import_dids_without_regex(app, client):
+    from wazo_router_confd.models.did import DID
+
+    session, tenant, ipbx, carrier_trunk = create_ipbx_and_carrier_trunk(app)
+    did = dict(
+        tenant_uuid=str(tenant.uuid), ipbx_id=ipbx.id, carrier_trunk_id=carrier_trunk.id
+    )
+    response = client.post("/1.0/dids/import", data=json.dumps(did))
+    assert response.status_code == 200
+    assert response.json()['created'] == 1
+    # NULL, not an empty regex matching every number
+    assert [(x.did_regex, x.did_prefix) for x in session.query(DID)] == [(None, '')]
+    response = client.post(
+        "/1.0/kamailio/routing",
+        json={
+            "event": "sip-routing",
+            "source_ip": "10.0.0.1",
+            "source_port": 5060,
+            "call_id": "call-id",
+            "from_uri": "sip:100@sourcedomain.com",
+            "to_uri": "sip:36123456789@dummy.com",
+        },
+    )
+    assert response.status_code == 200
+    assert response.json() == {"auth": None, "rtjson": {"success": False}}
@@ -88,7 +88,8 @@ def test_get_domains(app, client):
                 'domain': 'testdomain.com',
                 'tenant_uuid': str(tenant.uuid),
             }
-        ]
+        ],
+        "next": None,
     }
 
 
@@ -114,7 +114,8 @@ def test_get_ipbxs(app, client):
                 "username": "user",
                 "realm": "realm",
             }
-        ]
+        ],
+        "next": None,
     }
 
 
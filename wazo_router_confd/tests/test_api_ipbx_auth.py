@@ -114,7 +114,8 @@ def test_get_ipbxs(app_auth, client_auth_with_token):
                 "username": "user",
                 "realm": "realm",
             }
-        ]
+        ],
+        "next": None,
     }
 
 
@@ -0,0 +1,38 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+
+def test_kamailio_cdr_batch(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.cdr import CDR
+    from wazo_router_confd.models.tenant import Tenant
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name='fabio', uuid='5a6c0c40-b481-41bb-a41a-75d1cc25ff34')
+    session.add_all([tenant])
+    session.commit()
+    #
+    cdr = {
+        "tenant_uuid": str(tenant.uuid),
+        "event": "sip-routing",
+        "source_ip": "10.0.0.1",
+        "source_port": 5060,
+        "call_id": "call-id",
+        "from_uri": "100@testdomain.com",
+        "to_uri": "39123456789@dummy.com",
+        "call_start": 1570752000,
+        "duration": 60,
+    }
+    response = client.post(
+        "/1.0/kamailio/cdr/batch",
+        json=[
+            cdr,
+            dict(cdr, call_id="call-id-2"),
+            dict(cdr, tenant_uuid='ffffffff-ffff-4c1c-ad1c-ffffffffffff'),
+            dict(cdr, source_ip=None),
+        ],
+    )
+    assert response.status_code == 200
+    assert [x['success'] for x in response.json()] == [True, True, False, False]
+    assert response.json()[1]['cdr']['call_id'] == 'call-id-2'
+    assert sorted(x.call_id for x in session.query(CDR)) == ['call-id', 'call-id-2']
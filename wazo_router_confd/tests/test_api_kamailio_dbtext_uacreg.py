@@ -41,3 +41,51 @@ def test_kamailio_dbtext_uacreg(app, client):
         )
         % carrier_trunk.id
     }
+
+
+def test_kamailio_dbtext_uacreg_etag(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.tenant import Tenant
+    from wazo_router_confd.models.carrier import Carrier
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name='fabio', uuid='5a6c0c40-b481-41bb-a41a-75d1cc25ff34')
+    carrier = Carrier(name='carrier1', tenant=tenant)
+    session.add_all([tenant, carrier])
+    session.commit()
+    #
+    response = client.get("/1.0/kamailio/dbtext/uacreg")
+    assert response.status_code == 200
+    etag = response.headers['etag']
+    response = client.get(
+        "/1.0/kamailio/dbtext/uacreg", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+    # a new trunk changes the version
+    response = client.post(
+        "/1.0/carrier_trunks",
+        json={
+            "name": "trunk1",
+            "tenant_uuid": str(tenant.uuid),
+            "carrier_id": carrier.id,
+            "sip_proxy": "192.168.1.1",
+            "registered": True,
+            "auth_username": "username",
+            "auth_password": "password",
+            "realm": "realm",
+            "registrar_proxy": "registrar",
+            "from_domain": "domain.com",
+            "expire_seconds": 300,
+            "retry_seconds": 10,
+        },
+    )
+    assert response.status_code == 200
+    response = client.get(
+        "/1.0/kamailio/dbtext/uacreg",
+        headers={"If-None-Match": etag},
+        params={"wait": 5},
+    )
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert "username:domain.com" in response.json()['content']
@@ -0,0 +1,87 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+
+def test_kamailio_routing_batch(app, client):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.carrier import Carrier
+    from wazo_router_confd.models.carrier_trunk import CarrierTrunk
+    from wazo_router_confd.models.domain import Domain
+    from wazo_router_confd.models.tenant import Tenant
+    from wazo_router_confd.models.ipbx import IPBX
+    from wazo_router_confd.models.did import DID
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name='fabio', uuid='5a6c0c40-b481-41bb-a41a-75d1cc25ff34')
+    domain = Domain(domain='testdomain.com', tenant=tenant)
+    ipbx = IPBX(
+        tenant=tenant,
+        domain=domain,
+        customer=1,
+        ip_fqdn='mypbx.com',
+        registered=True,
+        username='user',
+        password='password',
+    )
+    carrier = Carrier(name='carrier', tenant=tenant)
+    carrier_trunk = CarrierTrunk(
+        name='carrier_trunk1', carrier=carrier, sip_proxy='proxy.somedomain.com'
+    )
+    did = DID(
+        did_regex=r'^39[0-9]+$',
+        did_prefix='39',
+        tenant=tenant,
+        ipbx=ipbx,
+        carrier_trunk=carrier_trunk,
+    )
+    session.add_all([tenant, domain, ipbx, carrier, carrier_trunk, did])
+    session.commit()
+    #
+    request_from_uri = "sip:100@sourcedomain.com"
+    request_did_to_uri = "sip:39123456789@dummy.com"
+    request_domain_to_uri = "sip:100@testdomain.com"
+    request_unknown_to_uri = "sip:36123456789@dummy.com"
+    #
+    response = client.post(
+        "/1.0/kamailio/routing/batch",
+        json=[
+            {"source_ip": "10.0.0.1", "from_uri": request_from_uri, "to_uri": to_uri}
+            for to_uri in (
+                request_did_to_uri,
+                request_unknown_to_uri,
+                request_domain_to_uri,
+                request_did_to_uri,
+            )
+        ],
+    )
+    assert response.status_code == 200
+    responses = response.json()
+    assert len(responses) == 4
+    assert responses[0]['rtjson']['success'] is True
+    assert responses[0]['rtjson']['routes'][0]['dst_uri'] == "sip:mypbx.com:5060"
+    assert responses[0]['rtjson']['routes'][0]['headers']['to'] == {
+        "display": None,
+        "uri": request_did_to_uri,
+    }
+    assert responses[1] == {"auth": None, "rtjson": {"success": False}}
+    assert responses[2]['rtjson']['routes'][0]['dst_uri'] == "sip:mypbx.com:5060"
+    assert responses[2]['rtjson']['routes'][0]['headers']['to'] == {
+        "display": None,
+        "uri": request_domain_to_uri,
+    }
+    assert responses[3] == responses[0]
+    # every response matches the one of the single routing endpoint
+    response = client.post(
+        "/1.0/kamailio/routing",
+        json={
+            "source_ip": "10.0.0.1",
+            "from_uri": request_from_uri,
+            "to_uri": request_did_to_uri,
+        },
+    )
+    assert response.status_code == 200
+    assert response.json() == responses[0]
+    #
+    response = client.post("/1.0/kamailio/routing/batch", json=[])
+    assert response.status_code == 200
+    assert response.json() == []
@@ -115,7 +115,8 @@ def test_get_normalization_profiles(app, client):
                 "always_ld": False,
                 "always_intl_prefix_plus": False,
             }
-        ]
+        ],
+        "next": None,
     }
 
 
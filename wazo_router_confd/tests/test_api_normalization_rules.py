@@ -130,7 +130,8 @@ def test_get_normalization_rules(app, client):
                 "match_regex": "^11",
                 "replace_regex": '',
             }
-        ]
+        ],
+        "next": None,
     }
 
 
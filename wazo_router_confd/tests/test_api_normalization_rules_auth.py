@@ -132,7 +132,8 @@ def test_get_normalization_rules(app_auth, client_auth_with_token):
                 "match_regex": "^11",
                 "replace_regex": '',
             }
-        ]
+        ],
+        "next": None,
     }
 
 
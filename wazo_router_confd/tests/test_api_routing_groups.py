@@ -97,7 +97,8 @@ def test_get_routing_groups(app, client):
                 "routing_rule_id": routing_rule.id,
                 "tenant_uuid": str(tenant.uuid),
             }
-        ]
+        ],
+        "next": None,
     }
 
 
@@ -115,7 +115,8 @@ def test_get_routing_rules(app, client):
                 "did_regex": r"^(\+?1)?(8(00|44|55|66|77|88)[2-9]\d{6})$",
                 "route_type": "pstn",
             }
-        ]
+        ],
+        "next": None,
     }
 
 
@@ -133,7 +133,8 @@ def test_get_routing_rules(app_auth, client_auth_with_token):
                 "did_regex": r"^(\+?1)?(8(00|44|55|66|77|88)[2-9]\d{6})$",
                 "route_type": "pstn",
             }
-        ]
+        ],
+        "next": None,
     }
 
 
@@ -5,3 +5,14 @@
 def test_api_status(client):
     response = client.get("/status")
     assert response.status_code == 204
+
+
+def test_api_metrics(client):
+    response = client.get("/status")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert (
+        'wazo_router_confd_http_request_duration_seconds_count'
+        '{method="GET",route="/status",status="204"}'
+    ) in response.text
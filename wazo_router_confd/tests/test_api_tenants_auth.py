@@ -61,7 +61,10 @@ def test_get_tenants(app_auth, client_auth_with_token):
     #
     response = client_auth_with_token.get("/1.0/tenants")
     assert response.status_code == 200
-    assert response.json() == {"items": [{'uuid': str(tenant.uuid), 'name': 'fabio'}]}
+    assert response.json() == {
+        "items": [{'uuid': str(tenant.uuid), 'name': 'fabio'}],
+        "next": None,
+    }
 
 
 def test_update_tenant(app_auth, client_auth_with_token):
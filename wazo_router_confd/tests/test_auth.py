@@ -1,7 +1,15 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from wazo_router_confd.auth import Principal
+from fastapi import Depends, FastAPI
+from starlette.testclient import TestClient
+
+from wazo_router_confd.auth import (
+    AuthMiddleware,
+    Principal,
+    get_principal,
+    get_token_ttl,
+)
 
 
 def test_auth_principal():
@@ -16,3 +24,106 @@ def test_auth_principal():
         str(principal)
         == "Principal(auth_id='auth_id', uuid='uuid', tenant_uuid='tenant_uuid', tenant_uuids=['tenant_uuid'], token='token')"
     )
+
+
+def test_get_token_ttl():
+    from datetime import datetime, timedelta, timezone
+
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+    assert 3590 < get_token_ttl({"utc_expires_at": expires_at.isoformat()}) <= 3600
+    expires_at = expires_at.replace(tzinfo=timezone.utc)
+    assert 3590 < get_token_ttl({"utc_expires_at": expires_at.isoformat()}) <= 3600
+    expires_at = expires_at.astimezone(timezone(timedelta(hours=2)))
+    assert 3590 < get_token_ttl({"utc_expires_at": expires_at.isoformat()}) <= 3600
+    assert get_token_ttl({"utc_expires_at": "tomorrow"}) is None
+    assert get_token_ttl({}) is None
+
+
+class FakeAuthClient(object):
+    async def get_token_data(self, token, tenant_uuid):
+        if token != 'token':
+            return None
+        return Principal(
+            auth_id="auth_id",
+            uuid="uuid",
+            tenant_uuid=tenant_uuid or "tenant_uuid",
+            tenant_uuids=[tenant_uuid or "tenant_uuid"],
+            token=token,
+        )
+
+
+def test_auth_middleware():
+    app = FastAPI()
+
+    @app.get("/principal")
+    async def principal(principal: Principal = Depends(get_principal)):
+        return {"tenant_uuid": principal.tenant_uuid}
+
+    app.add_middleware(AuthMiddleware, auth_client=FakeAuthClient())
+    client = TestClient(app)
+    response = client.get("/principal")
+    assert response.status_code == 401
+    assert response.text == "Missing X-Auth-Token header"
+    response = client.get("/principal", headers={"X-Auth-Token": "invalid"})
+    assert response.status_code == 401
+    response = client.get(
+        "/principal", headers={"X-Auth-Token": "token", "Wazo-Tenant": "tenant"}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"tenant_uuid": "tenant"}
+
+
+def test_auth_client(event_loop):
+    from datetime import datetime, timedelta
+
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    from wazo_router_confd.auth import AuthClient
+
+    calls = []
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+
+    async def token(request):
+        calls.append('token')
+        if request.match_info['token'] != 'token':
+            return web.json_response({}, status=404)
+        return web.json_response(
+            {
+                "data": {
+                    "auth_id": "auth_id",
+                    "token": "token",
+                    "utc_expires_at": expires_at.isoformat(),
+                    "metadata": {"uuid": "uuid", "tenant_uuid": "tenant1"},
+                }
+            }
+        )
+
+    async def tenants(request):
+        calls.append('tenants')
+        return web.json_response({"items": [{"uuid": "tenant1"}, {"uuid": "tenant2"}]})
+
+    app = web.Application()
+    app.router.add_get('/token/{token}', token)
+    app.router.add_get('/tenants', tenants)
+    server = TestServer(app, loop=event_loop)
+    event_loop.run_until_complete(server.start_server())
+    auth_client = AuthClient(url=str(server.make_url('')).rstrip('/'), cert=False)
+    try:
+        get_token_data = auth_client.get_token_data
+        principal = event_loop.run_until_complete(get_token_data('token', None))
+        assert principal.tenant_uuid == 'tenant1'
+        assert principal.tenant_uuids == ['tenant1', 'tenant2']
+        assert sorted(calls) == ['tenants', 'token']
+        # the valid tokens are remembered by token and tenant
+        assert event_loop.run_until_complete(get_token_data('token', None)) is principal
+        assert len(calls) == 2
+        principal = event_loop.run_until_complete(get_token_data('token', 'tenant2'))
+        assert principal.tenant_uuids == ['tenant2']
+        assert event_loop.run_until_complete(get_token_data('token', 'tenant3')) is None
+        assert event_loop.run_until_complete(get_token_data('invalid', None)) is None
+        assert event_loop.run_until_complete(get_token_data('invalid', None)) is None
+        assert len(calls) == 10
+    finally:
+        event_loop.run_until_complete(auth_client.close())
+        event_loop.run_until_complete(server.close())
@@ -0,0 +1,61 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from wazo_router_confd.cache import add_cache_tags, pop_cache_tags
+
+TENANT_UUID = '5a6c0c40-b481-41bb-a41a-75d1cc25ff34'
+
+
+def test_cache_tags(app):
+    from wazo_router_confd.database import SessionLocal
+    from wazo_router_confd.models.carrier import Carrier
+    from wazo_router_confd.models.carrier_trunk import CarrierTrunk
+    from wazo_router_confd.models.domain import Domain
+    from wazo_router_confd.models.tenant import Tenant
+    from wazo_router_confd.models.ipbx import IPBX
+    from wazo_router_confd.models.did import DID
+
+    session = SessionLocal(bind=app.engine)
+    tenant = Tenant(name='fabio', uuid=TENANT_UUID)
+    domain = Domain(domain='testdomain.com', tenant=tenant)
+    ipbx = IPBX(tenant=tenant, domain=domain, customer=1, ip_fqdn='mypbx.com')
+    carrier = Carrier(name='carrier', tenant=tenant)
+    carrier_trunk = CarrierTrunk(
+        name='carrier_trunk1', carrier=carrier, sip_proxy='proxy.somedomain.com'
+    )
+    did = DID(
+        did_regex=r'^39[0-9]+$',
+        did_prefix='39',
+        tenant=tenant,
+        ipbx=ipbx,
+        carrier_trunk=carrier_trunk,
+    )
+    session.add_all([tenant, domain, ipbx, carrier, carrier_trunk, did])
+    session.commit()
+    assert pop_cache_tags(session) == {
+        'tenant:%s' % TENANT_UUID,
+        'domain:testdomain.com',
+        'auth_domain:testdomain.com',
+        'auth_domain:*',
+        'ipbx:%s' % ipbx.id,
+        'source_ip:mypbx.com',
+        'tenant_trunks:%s' % TENANT_UUID,
+        'carrier_trunk:%s' % carrier_trunk.id,
+        'carrier_trunks',
+        'auth_trunk_ip:*',
+        'did_prefix:39',
+    }
+    assert pop_cache_tags(session) == set()
+    # both the previous and the new values are evicted
+    did.did_prefix = '3904'
+    session.commit()
+    assert pop_cache_tags(session) == {'did_prefix:39', 'did_prefix:3904'}
+    # the tags of a rolled back transaction are discarded
+    carrier_trunk.ip_address = '10.0.0.1'
+    session.flush()
+    session.rollback()
+    assert pop_cache_tags(session) == set()
+    # tags of the writes done outside of the ORM
+    add_cache_tags(session, ['ipbx:%s' % ipbx.id])
+    session.commit()
+    assert pop_cache_tags(session) == {'ipbx:%s' % ipbx.id}
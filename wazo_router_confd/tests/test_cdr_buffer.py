@@ -0,0 +1,136 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from unittest import mock
+
+import psycopg2  # type: ignore
+
+from wazo_router_confd.cdr_buffer import CDRBuffer
+from wazo_router_confd.schemas.cdr import CDRCreate
+
+
+class Pool(object):
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return 'conn'
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+def get_cdr(call_id):
+    return CDRCreate(
+        tenant_uuid='5a6c0c40-b481-41bb-a41a-75d1cc25ff34',
+        source_ip='10.0.0.1',
+        source_port=5060,
+        from_uri='100@testdomain.com',
+        to_uri='39123456789@dummy.com',
+        call_id=call_id,
+    )
+
+
+def test_cdr_buffer_flush(event_loop):
+    inserted = []
+
+    async def insert_cdrs(conn, cdrs):
+        inserted.append([cdr.call_id for cdr in cdrs])
+
+    cdr_buffer = CDRBuffer(size=2, interval=60000)
+    with mock.patch(
+        'wazo_router_confd.services.kamailio.insert_cdrs', side_effect=insert_cdrs
+    ):
+        event_loop.run_until_complete(cdr_buffer.connect(Pool()))
+        cdr_buffer.add([get_cdr('1')])
+        assert inserted == []
+        # the size is reached
+        cdr_buffer.add([get_cdr('2')])
+        event_loop.run_until_complete(cdr_buffer.flush())
+        assert inserted == [['1', '2']]
+        # the remaining CDRs are flushed on shutdown
+        cdr_buffer.add([get_cdr('3')])
+        event_loop.run_until_complete(cdr_buffer.disconnect())
+        assert inserted == [['1', '2'], ['3']]
+
+
+def test_cdr_buffer_flush_failed(event_loop):
+    async def insert_cdrs(conn, cdrs):
+        raise RuntimeError("database unavailable")
+
+    cdr_buffer = CDRBuffer(size=1, interval=60000)
+    cdr_buffer.max_pending = 2
+    with mock.patch(
+        'wazo_router_confd.services.kamailio.insert_cdrs', side_effect=insert_cdrs
+    ):
+        event_loop.run_until_complete(cdr_buffer.connect(Pool()))
+        for call_id in ('1', '2', '3'):
+            cdr_buffer.cdrs.append(get_cdr(call_id))
+            event_loop.run_until_complete(cdr_buffer.flush())
+        # the oldest CDRs are dropped
+        assert [cdr.call_id for cdr in cdr_buffer.cdrs] == ['2', '3']
+        event_loop.run_until_complete(cdr_buffer.disconnect())
+
+
+def test_cdr_buffer_flush_rejected(event_loop):
+    inserted = []
+
+    async def insert_cdrs(conn, cdrs):
+        if any(cdr.call_id == '2' for cdr in cdrs):
+            raise psycopg2.DataError("value too long")
+        inserted.extend(cdr.call_id for cdr in cdrs)
+
+    cdr_buffer = CDRBuffer(size=4, interval=60000)
+    with mock.patch(
+        'wazo_router_confd.services.kamailio.insert_cdrs', side_effect=insert_cdrs
+    ):
+        event_loop.run_until_complete(cdr_buffer.connect(Pool()))
+        cdr_buffer.cdrs.extend(get_cdr(call_id) for call_id in ('1', '2', '3', '4'))
+        event_loop.run_until_complete(cdr_buffer.flush())
+        # only the rejected CDR is dropped, the batch is not retried
+        assert inserted == ['1', '3', '4']
+        assert cdr_buffer.cdrs == []
+        event_loop.run_until_complete(cdr_buffer.disconnect())
+
+
+def test_cdr_batch_buffered_unknown_tenant(event_loop):
+    from wazo_router_confd.schemas.kamailio import CDRRequest
+    from wazo_router_confd.services.kamailio import cdr_batch
+
+    class Cursor(object):
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, exc_type, exc, tb):
+            pass
+
+        async def execute(self, sql, params):
+            self.tenant_uuids = params[0]
+
+        async def fetchall(self):
+            return [
+                (tenant_uuid,)
+                for tenant_uuid in self.tenant_uuids
+                if tenant_uuid == '5a6c0c40-b481-41bb-a41a-75d1cc25ff34'
+            ]
+
+    class Connection(object):
+        def cursor(self):
+            return Cursor()
+
+    class TenantPool(Pool):
+        async def __aenter__(self):
+            return Connection()
+
+    cdr = get_cdr('1').dict()
+    requests = [
+        CDRRequest(**cdr),
+        CDRRequest(**dict(cdr, tenant_uuid='ffffffff-ffff-4c1c-ad1c-ffffffffffff')),
+    ]
+    cdr_buffer = CDRBuffer(size=10, interval=60000)
+    responses = event_loop.run_until_complete(
+        cdr_batch(TenantPool(), requests, cdr_buffer)
+    )
+    # the CDRs of unknown tenants are rejected as on the direct insertion
+    assert [response['success'] for response in responses] == [True, False]
+    assert [cdr.call_id for cdr in cdr_buffer.cdrs] == ['1']
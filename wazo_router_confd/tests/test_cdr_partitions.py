@@ -0,0 +1,40 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import date
+
+from wazo_router_confd import cdr_partitions
+
+
+def test_add_months():
+    assert cdr_partitions.add_months(date(2019, 11, 1), 1) == date(2019, 12, 1)
+    assert cdr_partitions.add_months(date(2019, 11, 1), 3) == date(2020, 2, 1)
+    assert cdr_partitions.add_months(date(2019, 1, 1), -1) == date(2018, 12, 1)
+
+
+def test_partition_name():
+    assert cdr_partitions.get_partition_name(date(2019, 3, 1)) == 'cdrs_2019_03'
+    assert cdr_partitions.get_partition_month('cdrs_2019_03') == date(2019, 3, 1)
+    assert cdr_partitions.get_partition_month('cdrs_default') is None
+    assert cdr_partitions.is_cdr_partition('cdrs_default')
+    assert cdr_partitions.is_cdr_partition('cdrs_2019_03')
+    assert not cdr_partitions.is_cdr_partition('cdrs')
+
+
+def test_expired_partitions():
+    partitions = ['cdrs_2019_09', 'cdrs_2019_10', 'cdrs_2019_11', 'cdrs_default']
+    today = date(2019, 12, 15)
+    assert cdr_partitions.get_expired_partitions(partitions, today, 0) == []
+    assert cdr_partitions.get_expired_partitions(partitions, today, 2) == [
+        'cdrs_2019_09'
+    ]
+    assert cdr_partitions.get_expired_partitions(partitions, today, 1) == [
+        'cdrs_2019_09',
+        'cdrs_2019_10',
+    ]
+
+
+def test_include_object():
+    assert not cdr_partitions.include_object(None, 'cdrs_2019_09', 'table', True, None)
+    assert cdr_partitions.include_object(None, 'cdrs', 'table', True, None)
+    assert cdr_partitions.include_object(None, 'cdrs_2019_09', 'index', True, None)
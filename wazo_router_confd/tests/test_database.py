@@ -0,0 +1,50 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from unittest import mock
+from uuid import UUID
+
+from fastapi import Depends, FastAPI
+from sqlalchemy.orm import Query, Session
+from starlette.requests import Request
+from starlette.testclient import TestClient
+
+from wazo_router_confd.database import compile_query, get_db, setup_database
+from wazo_router_confd.models.tenant import Tenant
+
+
+def test_db_session_on_demand():
+    app = setup_database(FastAPI(), dict(database_uri='sqlite://'))
+    sessions = []
+
+    @app.get("/without_db")
+    async def without_db(request: Request):
+        return {"db": getattr(request.state, 'db', None) is not None}
+
+    @app.get("/with_db")
+    def with_db(db: Session = Depends(get_db)):
+        sessions.append(db)
+        return {"result": db.execute("SELECT 1").scalar()}
+
+    client = TestClient(app)
+    with mock.patch.object(Session, 'close', autospec=True) as close:
+        assert client.get("/without_db").json() == {"db": False}
+        assert client.get("/with_db").json() == {"result": 1}
+        assert client.get("/with_db").json() == {"result": 1}
+    # a session by request, closed once answered
+    assert len(sessions) == 2 and sessions[0] is not sessions[1]
+    assert close.call_args_list == [mock.call(sessions[0]), mock.call(sessions[1])]
+
+
+def test_compile_query():
+    uuid = UUID('5a6c0c40-b481-41bb-a41a-75d1cc25ff34')
+    sql, params = compile_query(Query(Tenant).filter(Tenant.uuid == uuid))
+    assert (
+        sql.split()
+        == (
+            "SELECT tenants.name, tenants.uuid FROM tenants "
+            "WHERE tenants.uuid = %(uuid_1)s"
+        ).split()
+    )
+    # as psycopg2 adapts it
+    assert params == {'uuid_1': str(uuid)}
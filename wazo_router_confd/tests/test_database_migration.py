@@ -8,6 +8,7 @@ from alembic import migration  # type: ignore
 from alembic.autogenerate import compare_metadata  # type: ignore
 
 from wazo_router_confd import database
+from wazo_router_confd.cdr_partitions import include_object
 from wazo_router_confd import conftest
 from wazo_router_confd.models.base import Base
 
@@ -21,7 +22,9 @@ def test_database_migration():
     try:
         database.upgrade_database(app, config, force_migration=True)
         with app.engine.begin() as conn:
-            ctx = migration.MigrationContext.configure(conn)
+            ctx = migration.MigrationContext.configure(
+                conn, opts={'include_object': include_object}
+            )
             diff = compare_metadata(ctx, Base.metadata)
             assert diff == [], pprint.pformat(diff, indent=2, width=20)
     finally:
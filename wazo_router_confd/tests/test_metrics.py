@@ -0,0 +1,43 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from wazo_router_confd.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_registry_render():
+    registry = Registry()
+    counter = registry.register(
+        Counter('test_requests_total', 'Requests', ['cache', 'result'])
+    )
+    histogram = registry.register(
+        Histogram('test_duration_seconds', 'Duration', ['route'], buckets=(0.1, 1.0))
+    )
+    registry.register(Gauge('test_pool_size', 'Pool size', lambda: 4))
+    registry.register(Gauge('test_pool_in_use', 'Pool in use', lambda: None))
+
+    counter.inc(cache='routing', result='hit')
+    counter.inc(2, cache='routing', result='miss')
+    histogram.observe(0.05, route='/status')
+    histogram.observe(0.1, route='/status')
+    histogram.observe(5, route='/status')
+    assert counter.get(cache='routing', result='miss') == 2
+    assert histogram.get_count(route='/status') == 3
+
+    assert registry.render().splitlines() == [
+        '# HELP test_requests_total Requests',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{cache="routing",result="hit"} 1.0',
+        'test_requests_total{cache="routing",result="miss"} 2.0',
+        '# HELP test_duration_seconds Duration',
+        '# TYPE test_duration_seconds histogram',
+        'test_duration_seconds_bucket{route="/status",le="0.1"} 2.0',
+        'test_duration_seconds_bucket{route="/status",le="1.0"} 2.0',
+        'test_duration_seconds_bucket{route="/status",le="+Inf"} 3.0',
+        'test_duration_seconds_count{route="/status"} 3.0',
+        'test_duration_seconds_sum{route="/status"} 5.15',
+        '# HELP test_pool_size Pool size',
+        '# TYPE test_pool_size gauge',
+        'test_pool_size 4.0',
+        '# HELP test_pool_in_use Pool in use',
+        '# TYPE test_pool_in_use gauge',
+    ]
@@ -0,0 +1,99 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import pytest  # type: ignore
+
+from fastapi import HTTPException
+from sqlalchemy import Column, Integer, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Query, sessionmaker
+
+from wazo_router_confd.services import pagination
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "items"
+
+    id = Column(Integer, primary_key=True)
+
+
+class Pool(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def acquire(self):
+        return self
+
+    def cursor(self, cursor_factory=None):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    async def fetchall(self):
+        return self.rows
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    # inserted out of order, the pages are ordered by id
+    session.add_all([Item(id=i) for i in (5, 3, 1, 4, 2)])
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_cursor():
+    assert pagination.decode_cursor(pagination.encode_cursor(42)) == 42
+    assert pagination.decode_cursor(pagination.encode_cursor('uuid')) == 'uuid'
+    with pytest.raises(HTTPException) as e:
+        pagination.decode_cursor('invalid')
+    assert e.value.status_code == 400
+
+
+def test_paginate_cursor(session):
+    items, cursor = pagination.paginate(session.query(Item), Item.id, limit=2)
+    assert [item.id for item in items] == [1, 2]
+    items, cursor = pagination.paginate(
+        session.query(Item), Item.id, limit=2, cursor=cursor
+    )
+    assert [item.id for item in items] == [3, 4]
+    items, cursor = pagination.paginate(
+        session.query(Item), Item.id, limit=2, cursor=cursor
+    )
+    assert [item.id for item in items] == [5]
+    assert cursor is None
+
+
+def test_paginate_offset(session):
+    items, cursor = pagination.paginate(session.query(Item), Item.id, offset=3, limit=1)
+    assert [item.id for item in items] == [4]
+    assert pagination.decode_cursor(cursor) == 4
+    items, cursor = pagination.paginate(session.query(Item), Item.id, offset=3)
+    assert [item.id for item in items] == [4, 5]
+    assert cursor is None
+
+
+def test_fetch_page(event_loop):
+    pool = Pool([dict(id=i) for i in (3, 4, 5)])
+    items, cursor = event_loop.run_until_complete(
+        pagination.fetch_page(pool, Query(Item), Item.id, limit=2, cursor='WzJd')
+    )
+    assert items == [dict(id=3), dict(id=4)]
+    assert pagination.decode_cursor(cursor) == 4
+    # after the cursor, with one more row than the page
+    ((sql, params),) = pool.executed
+    assert 'WHERE items.id > %(id_1)s ORDER BY items.id' in sql
+    assert params == {'id_1': 2, 'param_1': 3}
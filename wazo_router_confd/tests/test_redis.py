@@ -0,0 +1,315 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from unittest import mock
+
+from wazo_router_confd.redis import LocalCache
+
+
+def test_local_cache_lru():
+    cache = LocalCache(maxsize=2, ttl=10)
+    cache.set('a', {'value': 1})
+    cache.set('b', {'value': 2})
+    assert cache.get('a') == {'value': 1}
+    cache.set('c', {'value': 3})
+    # b is the least recently used entry
+    assert cache.get('b') is None
+    assert cache.get('a') == {'value': 1}
+    assert cache.get('c') == {'value': 3}
+    cache.delete(['a', 'unknown'])
+    assert cache.get('a') is None
+    cache.clear()
+    assert cache.get('c') is None
+
+
+def test_local_cache_ttl():
+    cache = LocalCache(maxsize=10, ttl=10)
+    with mock.patch('wazo_router_confd.redis.monotonic', return_value=100):
+        cache.set('a', {'value': 1})
+        cache.set('negative', {'success': False}, ttl=5)
+    with mock.patch('wazo_router_confd.redis.monotonic', return_value=107):
+        assert cache.get('a') == {'value': 1}
+        assert cache.get('negative') is None
+    with mock.patch('wazo_router_confd.redis.monotonic', return_value=111):
+        assert cache.get('a') is None
+
+
+def test_local_cache_disabled():
+    cache = LocalCache(maxsize=0, ttl=10)
+    cache.set('a', {'value': 1})
+    assert cache.get('a') is None
+
+
+def test_single_flight(event_loop):
+    import asyncio
+
+    from wazo_router_confd.redis import SingleFlight
+
+    single_flight = SingleFlight()
+    calls = []
+
+    async def callback(keys):
+        calls.append(keys)
+        await asyncio.sleep(0.01)
+        return {key: {'key': key} for key in keys}
+
+    results = event_loop.run_until_complete(
+        asyncio.gather(
+            single_flight.run(['a', 'b'], callback),
+            single_flight.run(['b', 'c'], callback),
+            single_flight.run(['a'], callback),
+        )
+    )
+    assert results == [
+        {'a': {'key': 'a'}, 'b': {'key': 'b'}},
+        {'b': {'key': 'b'}, 'c': {'key': 'c'}},
+        {'a': {'key': 'a'}},
+    ]
+    assert calls == [['a', 'b'], ['c']]
+    assert single_flight.tasks == {}
+
+
+def test_wait_invalidation(event_loop):
+    import asyncio
+
+    from wazo_router_confd.redis import Redis
+
+    redis = Redis('redis://localhost')
+
+    async def invalidate():
+        await asyncio.sleep(0.01)
+        for waiter in redis.invalidation_waiters:
+            waiter.set_result(None)
+
+    async def wait():
+        start = event_loop.time()
+        await asyncio.gather(redis.wait_invalidation(5), invalidate())
+        return event_loop.time() - start
+
+    assert event_loop.run_until_complete(wait()) < 1
+    assert redis.invalidation_waiters == set()
+    # without an invalidation, the timeout is waited
+    event_loop.run_until_complete(redis.wait_invalidation(0.01))
+    assert redis.invalidation_waiters == set()
+
+
+class FakePipeline(object):
+    def __init__(self, pool):
+        self.pool = pool
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+
+        return command
+
+    async def execute(self):
+        return [
+            getattr(self.pool, 'do_%s' % name)(*args, **kwargs)
+            for name, args, kwargs in self.commands
+        ]
+
+
+class FakePool(object):
+    def __init__(self):
+        self.values = {}
+        self.sorted_sets = {}
+        self.deletes = []
+        self.messages = []
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    multi_exec = pipeline
+
+    def do_set(self, key, value, expire=0):
+        self.values[key] = value
+
+    def do_expire(self, key, ttl):
+        pass
+
+    def do_zadd(self, key, *pairs):
+        members = self.sorted_sets.setdefault(key, {})
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            members[member.encode()] = score
+
+    def do_zremrangebyscore(self, key, max):
+        members = self.sorted_sets.get(key, {})
+        for member, score in list(members.items()):
+            if score <= max:
+                del members[member]
+
+    def do_zrangebyscore(self, key, min):
+        members = self.sorted_sets.get(key, {})
+        return [member for member, score in members.items() if score >= min]
+
+    def do_eval(self, script, keys, args):
+        # the script counting the invalidations
+        generation = int(self.values.get(keys[0], 0)) + 1
+        for key in keys:
+            self.values[key] = str(generation).encode()
+        return generation
+
+    def do_mget(self, *keys):
+        return [self.values.get(key) for key in keys]
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def mget(self, *keys):
+        return self.do_mget(*keys)
+
+    def do_delete(self, *keys):
+        self.deletes.append(keys)
+        for key in keys:
+            self.values.pop(key, None)
+            self.sorted_sets.pop(key, None)
+
+    async def delete(self, *keys):
+        self.do_delete(*keys)
+
+    async def publish_json(self, channel, message):
+        self.messages.append(message)
+
+
+def test_invalidate_tags(event_loop):
+    from wazo_router_confd import redis as redis_module
+
+    redis = redis_module.Redis('redis://localhost', ttl=60, negative_ttl=5)
+    redis.pool = FakePool()
+
+    async def invalidate():
+        await redis.set_values(
+            {'key%d' % i: {'value': i} for i in range(5)},
+            {'key%d' % i: {'tag', 'tag%d' % i} for i in range(5)},
+            ['key0'],
+        )
+        # the keys expired since are pruned from the tags
+        with mock.patch.object(redis_module, 'time', return_value=10 ** 10):
+            await redis.set_values({'key5': {'value': 5}}, {'key5': {'tag'}})
+        assert list(redis.pool.sorted_sets['cache_tag_keys:tag']) == [b'key5']
+        await redis.set_values(
+            {'key%d' % i: {'value': i} for i in range(5)},
+            {'key%d' % i: {'tag'} for i in range(5)},
+        )
+        with mock.patch.object(redis_module, 'INVALIDATION_CHUNK_SIZE', 2):
+            await redis.invalidate_tags(['tag', 'tag1'])
+
+    event_loop.run_until_complete(invalidate())
+    # the tags are dropped at once, the keys are evicted in chunks
+    assert redis.pool.deletes[0] == ('cache_tag_keys:tag', 'cache_tag_keys:tag1')
+    assert [len(keys) for keys in redis.pool.deletes[1:]] == [2, 2, 2]
+    assert [len(message['keys']) for message in redis.pool.messages] == [2, 2, 2]
+    # the first message carries the tags, for the listeners of every instance
+    assert [message.get('tags') for message in redis.pool.messages] == [
+        ['tag', 'tag1'],
+        None,
+        None,
+    ]
+    assert sorted(redis.pool.values) == [
+        'cache_tag_generation:tag',
+        'cache_tag_generation:tag1',
+        'wazo_router_confd:cache_generation',
+    ]
+    assert 'cache_tag_keys:tag2' in redis.pool.sorted_sets
+
+
+def test_invalidation_during_computation(event_loop):
+    from wazo_router_confd.redis import Redis
+
+    redis = Redis('redis://localhost', ttl=60, negative_ttl=5)
+    redis.pool = FakePool()
+    reads = []
+
+    async def callback(keys):
+        reads.append(keys)
+        # a write commits and invalidates the tag once the value is read
+        if len(reads) == 1:
+            await redis.invalidate_tags(['tag'])
+        return {key: ({'value': len(reads)}, {'tag'}) for key in keys}
+
+    async def get(key):
+        return await redis.get_or_set_values([key], callback)
+
+    # the value read before the invalidation is returned but not cached
+    assert event_loop.run_until_complete(get('a')) == {'a': {'value': 1}}
+    assert 'a' not in redis.pool.values
+    assert redis.local_cache.get('a') is None
+    # the value read after the invalidation is cached
+    assert event_loop.run_until_complete(get('a')) == {'a': {'value': 2}}
+    assert 'a' in redis.pool.values
+    assert event_loop.run_until_complete(get('a')) == {'a': {'value': 2}}
+    assert reads == [['a'], ['a']]
+
+
+def test_invalidation_listeners(event_loop):
+    import asyncio
+
+    from wazo_router_confd.redis import Redis
+
+    redis = Redis('redis://localhost')
+    calls = []
+    redis.add_invalidation_listener(calls.append)
+    channel = mock.Mock()
+    messages = [
+        {'keys': ['a'], 'tags': ['ipbx:1']},
+        {'keys': ['b']},
+        {'flush': True},
+    ]
+    channel.wait_message = mock.Mock(
+        side_effect=lambda: asyncio.sleep(0, result=bool(messages))
+    )
+    channel.get_json = mock.Mock(
+        side_effect=lambda: asyncio.sleep(0, result=messages.pop(0))
+    )
+    event_loop.run_until_complete(redis._subscribe(channel))
+    assert calls == [['ipbx:1'], None]
+
+
+def test_resubscribe(event_loop):
+    import asyncio
+
+    import aioredis  # type: ignore
+
+    from wazo_router_confd import redis as redis_module
+
+    redis = redis_module.Redis('redis://localhost')
+    calls = []
+    redis.add_invalidation_listener(calls.append)
+    redis.local_cache.set('a', {'value': 1})
+    closed_channel = mock.Mock()
+    closed_channel.wait_message = mock.Mock(
+        side_effect=lambda: asyncio.sleep(0, result=False)
+    )
+    failed_channel = mock.Mock()
+    failed_channel.wait_message = mock.Mock(
+        side_effect=aioredis.ChannelClosedError("closed")
+    )
+    subscribed = asyncio.Event()
+
+    async def create_subscriber():
+        # the first attempt fails, the second channel fails once subscribed
+        results.pop(0)()
+        if not results:
+            subscribed.set()
+            await asyncio.Future()
+        return failed_channel
+
+    def fail():
+        raise ConnectionRefusedError("redis unavailable")
+
+    results = [fail, lambda: None, lambda: None]
+
+    async def resubscribe():
+        task = asyncio.ensure_future(redis._resubscribe(closed_channel))
+        await asyncio.wait_for(subscribed.wait(), 1)
+        task.cancel()
+
+    with mock.patch.object(redis_module, 'SUBSCRIBE_RETRY_DELAY', 0), mock.patch.object(
+        redis, '_create_subscriber', side_effect=create_subscriber
+    ):
+        event_loop.run_until_complete(resubscribe())
+    # the invalidations missed while unsubscribed are handled as a flush
+    assert calls == [None]
+    assert redis.local_cache.get('a') is None
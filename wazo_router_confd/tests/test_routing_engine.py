@@ -0,0 +1,230 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from wazo_router_confd.routing_engine import (
+    CarrierTrunkRecord,
+    DIDRecord,
+    IPBXRecord,
+    NormalizationProfileRecord,
+    NormalizationRuleRecord,
+    RoutingSnapshot,
+)
+from wazo_router_confd.schemas import kamailio as schema
+
+TENANT_UUID = '5a6c0c40-b481-41bb-a41a-75d1cc25ff34'
+
+
+def get_snapshot():
+    return RoutingSnapshot(
+        ipbxs=[
+            IPBXRecord(
+                id=1,
+                tenant_uuid=TENANT_UUID,
+                domain='testdomain.com',
+                normalization_profile_id=1,
+                ip_fqdn='10.0.0.1',
+                ip_address=None,
+                port=5060,
+                username='user',
+                password=None,
+                password_ha1=None,
+                realm=None,
+            )
+        ],
+        carrier_trunks=[
+            CarrierTrunkRecord(
+                id=1,
+                tenant_uuid=TENANT_UUID,
+                normalization_profile_id=None,
+                sip_proxy='proxy.somedomain.com',
+                sip_proxy_port=5060,
+                ip_address='10.0.0.2',
+                auth_username=None,
+                auth_password=None,
+                realm=None,
+            )
+        ],
+        dids=[
+            DIDRecord(
+                id=1,
+                tenant_uuid=TENANT_UUID,
+                ipbx_id=1,
+                did_regex=r'^39[0-9]+$',
+                did_prefix='39',
+            )
+        ],
+        normalization_profiles=[
+            NormalizationProfileRecord(id=1, always_intl_prefix_plus=False)
+        ],
+        normalization_rules=[
+            NormalizationRuleRecord(
+                id=1,
+                profile_id=1,
+                rule_type=2,
+                priority=0,
+                match_regex=r'^39(.+)',
+                match_prefix='39',
+                replace_regex=r'0\1',
+            )
+        ],
+    )
+
+
+def test_routing_snapshot_auth(event_loop):
+    snapshot = get_snapshot()
+
+    response = event_loop.run_until_complete(
+        snapshot.auth(schema.AuthRequest(source_ip='10.0.0.1', username='user'))
+    )
+    assert response == dict(
+        success=True,
+        tenant_uuid=TENANT_UUID,
+        ipbx_id=1,
+        domain='testdomain.com',
+        username='user',
+        password_ha1=None,
+    )
+    #
+    response = event_loop.run_until_complete(
+        snapshot.auth(schema.AuthRequest(source_ip='10.0.0.2', username='other'))
+    )
+    assert response == dict(success=True, tenant_uuid=TENANT_UUID, carrier_trunk_id=1)
+    #
+    response = event_loop.run_until_complete(
+        snapshot.auth(schema.AuthRequest(source_ip='10.0.0.3', username='other'))
+    )
+    assert response == dict(success=False)
+
+
+def test_routing_snapshot_routing_did(event_loop):
+    snapshot = get_snapshot()
+
+    response = event_loop.run_until_complete(
+        snapshot.routing(
+            schema.RoutingRequest(
+                source_ip='10.0.0.3',
+                from_uri='sip:100@sourcedomain.com',
+                to_uri='sip:39123456789@dummy.com',
+            )
+        )
+    )
+    assert response['auth'] is None
+    assert response['rtjson']['success'] is True
+    assert len(response['rtjson']['routes']) == 1
+    route = response['rtjson']['routes'][0]
+    assert route['dst_uri'] == 'sip:10.0.0.1:5060'
+    assert route['headers']['to']['uri'] == 'sip:0123456789@dummy.com'
+
+
+def test_routing_snapshot_routing_outbound(event_loop):
+    snapshot = get_snapshot()
+
+    response = event_loop.run_until_complete(
+        snapshot.routing(
+            schema.RoutingRequest(
+                source_ip='10.0.0.1',
+                from_uri='sip:100@sourcedomain.com',
+                to_uri='sip:200@destinationdomain.com',
+            )
+        )
+    )
+    assert response == {
+        "auth": None,
+        "rtjson": {
+            "success": True,
+            "version": "1.0",
+            "routing": "serial",
+            "routes": [
+                {
+                    "dst_uri": "sip:proxy.somedomain.com:5060",
+                    "path": "",
+                    "socket": "",
+                    "headers": {
+                        "from": {"display": None, "uri": "sip:100@sourcedomain.com"},
+                        "to": {"display": None, "uri": "sip:200@destinationdomain.com"},
+                        "extra": "",
+                    },
+                    "branch_flags": 8,
+                    "fr_timer": 5000,
+                    "fr_inv_timer": 30000,
+                }
+            ],
+        },
+    }
+
+
+def test_routing_snapshot_routing_no_route(event_loop):
+    snapshot = get_snapshot()
+
+    response = event_loop.run_until_complete(
+        snapshot.routing(
+            schema.RoutingRequest(
+                source_ip='10.0.0.3',
+                from_uri='sip:100@sourcedomain.com',
+                to_uri='sip:36123456789@dummy.com',
+            )
+        )
+    )
+    assert response == {"auth": None, "rtjson": {"success": False}}
+
+
+def test_did_index_longest_prefix():
+    from wazo_router_confd.routing_engine import DIDIndex
+
+    dids = DIDIndex(
+        [
+            DIDRecord(
+                id=1,
+                tenant_uuid=TENANT_UUID,
+                ipbx_id=1,
+                did_regex=r'^39[0-9]+$',
+                did_prefix='39',
+            ),
+            DIDRecord(
+                id=2,
+                tenant_uuid=TENANT_UUID,
+                ipbx_id=2,
+                did_regex=r'^390401234567[0-9]+$',
+                did_prefix='390401234567',
+            ),
+            DIDRecord(
+                id=3, tenant_uuid=TENANT_UUID, ipbx_id=3, did_regex=None, did_prefix=''
+            ),
+        ]
+    )
+    assert len(dids) == 2
+    assert dids.match('3904012345678').id == 2
+    assert dids.match('3904012345').id == 1
+    assert dids.match('3904012345678', tenant_uuid=TENANT_UUID).id == 2
+    assert dids.match('3904012345678', tenant_uuid='other') is None
+    assert dids.match('36123456') is None
+
+
+def test_routing_engine_request_reload(event_loop):
+    import asyncio
+
+    from wazo_router_confd.routing_engine import RoutingEngine
+
+    engine = RoutingEngine(reload_delay=0.01)
+    reloads = []
+
+    async def reload():
+        reloads.append(None)
+
+    engine.reload = reload
+    # not connected, nothing to reload
+    engine.request_reload(['ipbx:1'])
+    assert engine._reload_task is None
+
+    async def burst():
+        engine._lock = asyncio.Lock()
+        for i in range(3):
+            engine.request_reload(['ipbx:%s' % i])
+        await asyncio.sleep(0.05)
+        engine.request_reload(None)
+        await asyncio.sleep(0.05)
+
+    # the changes of a burst are loaded at once, off the response path
+    event_loop.run_until_complete(burst())
+    assert len(reloads) == 2
+    engine.disconnect()
@@ -6,3 +6,51 @@ def test_split_uri_to_parts():
     from wazo_router_confd.services.kamailio import split_uri_to_parts
 
     assert ('', '', '', '') == split_uri_to_parts('')
+    assert ('sip:', '100', 'domain.com', ':5060') == split_uri_to_parts(
+        'sip:100@domain.com:5060;transport=udp'
+    )
+
+
+def test_routing_redis_key():
+    from wazo_router_confd.schemas.kamailio import RoutingRequest
+    from wazo_router_confd.services.kamailio import get_routing_redis_key
+
+    request = RoutingRequest(
+        source_ip='10.0.0.1',
+        source_port=5060,
+        from_name='From name',
+        from_uri='sip:100@sourcedomain.com',
+        to_uri='sip:39123456789@dummy.com',
+    )
+    key = get_routing_redis_key(request)
+    assert key == get_routing_redis_key(
+        RoutingRequest(
+            source_ip='10.0.0.1',
+            source_port=32768,
+            domain='other.com',
+            from_uri='sip:100@sourcedomain.com;tag=1234',
+            to_uri='sip:39123456789@dummy.com;user=phone',
+            to_name='To name',
+        )
+    )
+    assert key != get_routing_redis_key(request.copy(update=dict(auth=True)))
+    assert key != get_routing_redis_key(
+        request.copy(update=dict(from_uri='sip:200@sourcedomain.com'))
+    )
+
+
+def test_auth_redis_key():
+    from wazo_router_confd.schemas.kamailio import AuthRequest
+    from wazo_router_confd.services.kamailio import get_auth_redis_key
+
+    request = AuthRequest(source_ip='10.0.0.1', source_port=5060, username='user')
+    key = get_auth_redis_key(request, b'key')
+    assert key == get_auth_redis_key(
+        request.copy(update=dict(source_port=32768)), b'key'
+    )
+    request = request.copy(update=dict(password='secret'))
+    assert key != get_auth_redis_key(request, b'key')
+    assert 'secret' not in get_auth_redis_key(request, b'key')
+    # every instance sharing the secret shares the cache keys
+    assert get_auth_redis_key(request, b'key') == get_auth_redis_key(request, b'key')
+    assert get_auth_redis_key(request, b'key') != get_auth_redis_key(request, b'other')
@@ -94,3 +94,83 @@ def test_normalize_e164_to_local_number(app, database_uri, event_loop):
 
     ret = event_loop.run_until_complete(test())
     assert '+36011625234' == ret
+
+
+def test_normalize_number():
+    from wazo_router_confd.services.normalization import normalize_number
+
+    profile = dict(
+        id=1,
+        always_intl_prefix_plus=True,
+        rules=[
+            dict(
+                rule_type=1,
+                match_prefix='39',
+                match_regex=r'^39(.+)',
+                replace_regex=r'36\1',
+            ),
+            dict(
+                rule_type=2,
+                match_prefix='39',
+                match_regex=r'^39(.+)',
+                replace_regex=r'0\1',
+            ),
+        ],
+    )
+    assert normalize_number('+39 011 625234', 1) == '39011625234'
+    assert normalize_number('+39 011 625234', 1, profile) == '36011625234'
+    assert normalize_number('39011625234', 2, profile) == '+0011625234'
+
+
+def test_compiled_normalization_profile():
+    from wazo_router_confd.services.normalization import (
+        CompiledNormalizationProfile,
+        get_compiled_normalization_profile,
+    )
+
+    profile = CompiledNormalizationProfile(
+        1,
+        False,
+        [
+            (1, '39', r'^39(.+)', r'36\1'),
+            (1, '', r'^36(.+)', r'35\1'),
+            (1, '44', r'^44(.+)', r'0\1'),
+            (1, '39', r'^(', r''),
+        ],
+    )
+    # the rules matching a prefix of the number, in order of priority
+    assert [rule.replace_regex for rule in profile.get_rules('39011', 1)] == [
+        r'36\1',
+        r'35\1',
+    ]
+    assert profile.normalize('39011', 1) == '35011'
+    assert profile.normalize('44011', 1) == '0011'
+    assert profile.normalize('39011', 2) == '39011'
+    # prefixes longer than 10 digits, up to the whole number
+    profile = CompiledNormalizationProfile(
+        1,
+        False,
+        [
+            (1, '390612345678', r'^390612345678(.*)', r'0612345678\1'),
+            (1, '4420712345678', r'^4420712345678$', r'100'),
+        ],
+    )
+    assert profile.normalize('3906123456789', 1) == '06123456789'
+    assert profile.normalize('4420712345678', 1) == '100'
+    #
+    profile_dict = dict(
+        id=1,
+        always_intl_prefix_plus=True,
+        rules=[
+            dict(
+                rule_type=2,
+                match_prefix='39',
+                match_regex=r'^39(.+)',
+                replace_regex=r'0\1',
+            )
+        ],
+    )
+    compiled_profile = get_compiled_normalization_profile(profile_dict)
+    assert get_compiled_normalization_profile(dict(profile_dict)) is compiled_profile
+    profile_dict['rules'] = []
+    assert get_compiled_normalization_profile(profile_dict) is not compiled_profile
@@ -20,3 +20,37 @@ def test_hash_ha1():
     #
     result = password.hash_ha1("username", "realm", "password")
     assert result is not None
+
+
+def test_verify():
+    from wazo_router_confd.services import password
+
+    stored_password = password.hash("password")
+    assert password.verify(stored_password, "password")
+    assert not password.verify(stored_password, "wrong")
+
+
+def test_password_verifier(event_loop):
+    from unittest import mock
+
+    from wazo_router_confd.services import password
+
+    verifier = password.PasswordVerifier(workers=1, cache_ttl=30)
+    stored_password = password.hash("password")
+    try:
+        assert event_loop.run_until_complete(
+            verifier.verify(stored_password, "password")
+        )
+        assert not event_loop.run_until_complete(
+            verifier.verify(stored_password, "wrong")
+        )
+        # the successful verifications are cached, by a keyed hash
+        assert len(verifier.cache.values) == 1
+        assert "password" not in list(verifier.cache.values)[0]
+        with mock.patch.object(verifier, 'executor') as executor:
+            assert event_loop.run_until_complete(
+                verifier.verify(stored_password, "password")
+            )
+            executor.submit.assert_not_called()
+    finally:
+        verifier.close()
@@ -0,0 +1,88 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from wazo_router_confd.services import regex as regex_service
+
+
+def test_get_regex_error():
+    assert regex_service.get_regex_error(r'^39[0-9]+$') is None
+    assert regex_service.get_regex_error(r'^(\+?1)?(8(00|44|55)[2-9]\d{6})$') is None
+    assert regex_service.get_regex_error(r'^(?:00|\+)(39)(.+)') is None
+    assert regex_service.get_regex_error(r'(').startswith('invalid regex')
+    assert regex_service.get_regex_error(r'^(a+)+$') is not None
+    assert regex_service.get_regex_error(r'^(\d*)*$') is not None
+    assert regex_service.get_regex_error(r'^(a|a)*$') is not None
+    assert regex_service.get_regex_error(r'^(\d)\1$') is not None
+    assert regex_service.get_regex_error(r'^\+?\d{1,15}$') is None
+    assert regex_service.get_regex_error(r'^[0-9]*[0-9]*a$') is not None
+
+
+def test_get_replacement_error():
+    assert regex_service.get_replacement_error(r'^39(.+)', r'0\1') is None
+    assert regex_service.get_replacement_error(r'^39(.+)', r'0\2') is not None
+
+
+def test_get_literal_prefix():
+    assert regex_service.get_literal_prefix(None) == ''
+    assert regex_service.get_literal_prefix(r'^39[0-9]+$') == '39'
+    assert regex_service.get_literal_prefix(r'^3912?') == '391'
+    assert regex_service.get_literal_prefix(r'^(39)(04)\d+') == '3904'
+    assert regex_service.get_literal_prefix(r'^(\+?1)?(8(00|44)[2-9]\d{6})$') == ''
+    assert regex_service.get_literal_prefix(r'^IT39', 'IT0123456789') == 'IT39'
+
+
+def test_regex_budget():
+    budget = regex_service.RegexBudget(max_evaluations=2)
+    assert budget.match(r'^39', '3912') is not None
+    assert budget.sub(r'^39', '0', '3912') == '012'
+    # once exhausted, nothing matches and numbers are left untouched
+    assert budget.match(r'^39', '3912') is None
+    assert budget.sub(r'^39', '0', '3912') == '3912'
+    assert budget.exhausted
+    #
+    budget = regex_service.RegexBudget()
+    assert (
+        budget.match(r'^3', '3' * (regex_service.REGEX_MAX_SUBJECT_LENGTH + 1)) is None
+    )
+
+
+def test_regex_budget_counts_evaluations_only():
+    from unittest import mock
+
+    budget = regex_service.RegexBudget(max_seconds=0.05)
+    # the time elapsed between two evaluations, e.g. waiting for the
+    # database, is not spent from the budget
+    with mock.patch.object(regex_service, 'monotonic', side_effect=[0.0, 0.001]):
+        assert budget.match(r'^39', '3912') is not None
+    with mock.patch.object(regex_service, 'monotonic', side_effect=[10.0, 10.001]):
+        assert budget.match(r'^39', '3912') is not None
+    assert not budget.exhausted
+    with mock.patch.object(regex_service, 'monotonic', side_effect=[20.0, 20.1]):
+        assert budget.match(r'^39', '3912') is not None
+    assert budget.match(r'^39', '3912') is None
+    assert budget.exhausted
+
+
+def test_regex_budget_skips_unsafe_regexes():
+    budget = regex_service.RegexBudget()
+    # regexes stored before the validation of the API are never evaluated
+    assert regex_service.get_safe_regex(r'^(a+)+$') is None
+    assert budget.match(r'^(\d+)+$', '3912') is None
+    assert budget.sub(r'^(\d+)+$', '0', '3912') == '3912'
+    pattern = '^39' + '[0-9]?' * regex_service.REGEX_MAX_PATTERN_LENGTH
+    assert regex_service.get_safe_regex(pattern) is None
+    assert budget.match(pattern, '3912') is None
+    assert not budget.exhausted
+
+
+def test_regex_budget_bounds_backtracking():
+    from time import monotonic
+
+    # polynomial backtracking, seconds for a single match of 128 digits
+    pattern = r'^[0-9]*[0-9]*[0-9]*[0-9]*[0-9]*[0-9]*[0-9]*[0-9]*a$'
+    assert regex_service.get_regex_error(pattern) is not None
+    budget = regex_service.RegexBudget()
+    start = monotonic()
+    assert budget.match(pattern, '1' * regex_service.REGEX_MAX_SUBJECT_LENGTH) is None
+    assert budget.sub(pattern, '', '1' * regex_service.REGEX_MAX_SUBJECT_LENGTH)
+    assert monotonic() - start < 1
@@ -0,0 +1,71 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from wazo_router_confd.tracing import (
+    SERVER_TIMING_HEADER,
+    TRACE_HEADER,
+    Trace,
+    current_trace,
+    setup_tracing,
+    span,
+)
+
+
+def get_app(config):
+    app = FastAPI()
+
+    @app.get("/stages")
+    async def stages():
+        with span('stage.first'):
+            pass
+        for _ in range(2):
+            with span('stage.second'):
+                pass
+        return {}
+
+    return setup_tracing(app, config)
+
+
+def test_span():
+    with span('untraced'):
+        pass
+    trace = Trace()
+    token = current_trace.set(trace)
+    try:
+        with span('traced'):
+            pass
+    finally:
+        current_trace.reset(token)
+    assert [name for name, _, _ in trace.spans] == ['traced']
+
+
+def test_tracing_header():
+    client = TestClient(get_app({}))
+    response = client.get("/stages")
+    assert SERVER_TIMING_HEADER not in response.headers
+    response = client.get("/stages", headers={TRACE_HEADER: '1'})
+    timings = response.headers[SERVER_TIMING_HEADER].split(', ')
+    assert [x.split(';')[0] for x in timings] == ['stage.first', 'stage.second']
+    assert all(x.split(';')[1].startswith('dur=') for x in timings)
+
+
+def test_tracing_file(tmp_path):
+    trace_file = tmp_path / 'traces.jsonl'
+    app = get_app(dict(trace_file=str(trace_file), trace_sample_rate=1))
+    with TestClient(app) as client:
+        response = client.get("/stages")
+        assert SERVER_TIMING_HEADER not in response.headers
+    records = [json.loads(x) for x in trace_file.read_text().splitlines()]
+    assert len(records) == 1
+    assert records[0]['path'] == '/stages'
+    assert records[0]['status'] == 200
+    assert [x['name'] for x in records[0]['spans']] == [
+        'stage.first',
+        'stage.second',
+        'stage.second',
+    ]
@@ -0,0 +1,174 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import logging
+import os
+import random
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from time import monotonic
+from typing import Dict, IO, List, Optional, Tuple
+
+from fastapi import FastAPI
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# requests with this header get the timing of their stages in the response
+TRACE_HEADER = 'X-Wazo-Router-Trace'
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+logger = logging.getLogger(__name__)
+
+
+class Trace(object):
+    """
+    Timed spans of the stages of a request, as name, start offset and
+    duration in seconds.
+    """
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.start = monotonic()
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def add_span(self, name: str, start: float, end: float):
+        self.spans.append((name, start - self.start, end - start))
+
+    def get_server_timing(self) -> str:
+        # spans of the same stage are summed, e.g. for a batch
+        durations: Dict[str, float] = {}
+        for name, _, duration in self.spans:
+            durations[name] = durations.get(name, 0) + duration
+        return ', '.join(
+            '%s;dur=%.3f' % (name, duration * 1000)
+            for name, duration in durations.items()
+        )
+
+    def to_dict(self, request: Request, status_code: int, duration: float) -> dict:
+        return dict(
+            trace_id=self.trace_id,
+            date=datetime.utcnow().isoformat(),
+            method=request.method,
+            path=request.url.path,
+            status=status_code,
+            duration_ms=round(duration * 1000, 3),
+            spans=[
+                dict(
+                    name=name,
+                    start_ms=round(start * 1000, 3),
+                    duration_ms=round(duration * 1000, 3),
+                )
+                for name, start, duration in self.spans
+            ],
+        )
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+
+@contextmanager
+def span(name: str):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = monotonic()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, monotonic())
+
+
+class TraceFile(object):
+    """
+    Sink of the sampled traces, one JSON record per line.
+    """
+
+    path: str
+    file: Optional[IO[str]]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def open(self):
+        self.file = open(self.path, 'a', buffering=1)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write(self, record: dict):
+        if self.file is None:
+            return
+        try:
+            self.file.write(json.dumps(record) + '\n')
+        except OSError as e:
+            logger.warning("fail to write the trace: %s", e)
+
+
+class TracingMiddleware(object):
+    """
+    Trace the requests with the trace header, answered with the timing of
+    their stages, and a sample of the requests, written to the trace file.
+    """
+
+    def __init__(
+        self, app: ASGIApp, trace_file: Optional[TraceFile], sample_rate: float
+    ):
+        self.app = app
+        self.trace_file = trace_file
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        header = TRACE_HEADER in Headers(scope=scope)
+        sampled = self.trace_file is not None and random.random() < self.sample_rate
+        if not header and not sampled:
+            await self.app(scope, receive, send)
+            return
+        trace = Trace()
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if header:
+                    message.setdefault('headers', [])
+                    headers = MutableHeaders(scope=message)
+                    headers[SERVER_TIMING_HEADER] = trace.get_server_timing()
+            await send(message)
+
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_trace.reset(token)
+            if sampled and self.trace_file is not None:
+                self.trace_file.write(
+                    trace.to_dict(
+                        Request(scope), status_code, monotonic() - trace.start
+                    )
+                )
+
+
+def setup_tracing(app: FastAPI, config: dict):
+    sample_rate = float(config.get('trace_sample_rate') or 0)
+    trace_file = TraceFile(config['trace_file']) if config.get('trace_file') else None
+    if trace_file is not None:
+        app.add_event_handler("startup", trace_file.open)
+        app.add_event_handler("shutdown", trace_file.close)
+
+    app.add_middleware(
+        TracingMiddleware, trace_file=trace_file, sample_rate=sample_rate
+    )
+
+    return app